@@ -0,0 +1,131 @@
+"""Пакетный запуск транслятора и модели процессора по манифесту заданий.
+
+Манифест -- JSONL, одна строка -- одно задание:
+
+    {"source": "prog.vjs", "input": "input.txt", "limit": 100000, "timeout": 5, "mode": "fast", "id": "prog-1"}
+
+Обязательны `source` и `input` (пути относительно манифеста), остальное берётся из параметров запуска.
+Каждый исходный текст транслируется один раз, программы передаются процессам-исполнителям при их запуске,
+результаты пишутся в JSONL по мере завершения заданий.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from interpreter.translator import translate
+from machine.emulator import load_memory, simulation
+from machine.isa import mem_size
+from machine.memory import Memory
+
+
+class JobTimeoutError(Exception):
+    pass
+
+
+programs: dict[str, Memory] = {}  # программы процесса-исполнителя: путь к исходному тексту -> память
+
+
+def init_worker(shipped: dict[str, Memory]) -> None:
+    programs.update(shipped)
+    logging.disable(logging.WARNING)
+
+
+def on_timeout(signum, frame):
+    raise JobTimeoutError()
+
+
+def job_result(job: dict, **fields) -> dict:
+    return {"id": job["id"], "source": job["source"], "input": job["input"], **fields}
+
+
+def run_job(job: dict) -> dict:
+    """Исполнить задание в процессе-исполнителе, время ограничивается таймером SIGALRM."""
+    result = job_result(job)
+    started = time.perf_counter()
+    signal.signal(signal.SIGALRM, on_timeout)
+    if job["timeout"]:
+        signal.setitimer(signal.ITIMER_REAL, job["timeout"])
+    try:
+        with open(job["input"], encoding="utf-8") as file:
+            text = file.read()
+        output, instr_counter, ticks = simulation(programs[job["source"]].copy(), text, job["limit"], job["mode"])
+        result["status"] = "limit" if instr_counter >= job["limit"] else "ok"
+        result.update(output=output, instr_counter=instr_counter, ticks=ticks)
+    except JobTimeoutError:
+        result["status"] = "timeout"
+    except Exception as error:
+        result.update(status="error", error=repr(error))
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    result["seconds"] = round(time.perf_counter() - started, 6)
+    return result
+
+
+def read_manifest(manifest: str, limit: int, timeout: float | None, mode: str) -> list[dict]:
+    base = Path(manifest).resolve().parent
+    jobs = []
+    with open(manifest, encoding="utf-8") as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            job = {"id": number, "limit": limit, "timeout": timeout, "mode": mode} | json.loads(line)
+            job["source"] = os.path.join(base, job["source"])
+            job["input"] = os.path.join(base, job["input"])
+            jobs.append(job)
+    return jobs
+
+
+def translate_sources(jobs: list[dict]) -> tuple[dict[str, Memory], dict[str, str]]:
+    """Транслировать каждый исходный текст один раз; вернуть программы и ошибки трансляции."""
+    shipped: dict[str, Memory] = {}
+    errors: dict[str, str] = {}
+    for source in dict.fromkeys(job["source"] for job in jobs):
+        try:
+            with open(source, encoding="utf-8") as file:
+                shipped[source] = load_memory(translate(file.read()), mem_size)
+        except Exception as error:
+            errors[source] = repr(error)
+    return shipped, errors
+
+
+def main(manifest, results, workers=None, limit=100000, timeout=None, mode="fast") -> dict[str, int]:
+    """Исполнить задания манифеста, вернуть число заданий по статусам."""
+    jobs = read_manifest(manifest, limit, timeout, mode)
+    shipped, errors = translate_sources(jobs)
+    statuses: dict[str, int] = {}
+
+    with open(results, "w", encoding="utf-8") as out:
+
+        def emit(result: dict) -> None:
+            statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+
+        for job in jobs:
+            if job["source"] in errors:
+                emit(job_result(job, status="error", error=errors[job["source"]]))
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(shipped,)) as pool:
+            futures = [pool.submit(run_job, job) for job in jobs if job["source"] in shipped]
+            for future in as_completed(futures):
+                emit(future.result())
+    return statuses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch translator + emulator runner")
+    parser.add_argument("manifest", help="JSONL manifest of jobs")
+    parser.add_argument("results", help="JSONL file for results")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--limit", type=int, default=100000, help="default instruction limit per job")
+    parser.add_argument("--timeout", type=float, default=None, help="default timeout per job, seconds")
+    parser.add_argument("--mode", default="fast", help="emulator mode (default: fast)")
+    args = parser.parse_args()
+    print(main(args.manifest, args.results, args.workers, args.limit, args.timeout, args.mode))
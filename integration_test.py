@@ -1,18 +1,25 @@
 import contextlib
 import io
+import itertools
+import json
 import logging
 import os
 import tempfile
 
+import batch_runner
 import pytest
-from interpreter import translator
-from machine import emulator
+from interpreter import strength, translator
+from interpreter.folding import evaluate
+from interpreter.ir import Instr, IrProgram
+from interpreter.lexer import Token, tokenize
+from interpreter.parser import AstType, parse
+from interpreter.peephole import peephole
+from machine import emulator, isa, ports, profiler, simt
+from machine.debuginfo import SourceLocation, debug_filename, read_debug_info
+from machine.snapshot import MachineSnapshot
 
 
-@pytest.mark.golden_test("golden/*.yml")
-def test_translator_and_machine(golden, caplog):
-    caplog.set_level(logging.DEBUG)
-
+def run_golden(golden, mode: str, check: bool = False, stream: bool = False, binary: bool = False) -> tuple[str, str]:
     with tempfile.TemporaryDirectory() as tmpdirname:
         source = os.path.join(tmpdirname, "source.vjs")
         input_stream = os.path.join(tmpdirname, "input.txt")
@@ -24,13 +31,780 @@ def test_translator_and_machine(golden, caplog):
             file.write(golden["in_stdin"])
 
         with contextlib.redirect_stdout(io.StringIO()) as stdout:
-            translator.main(source, target)
+            translator.main(source, target, binary)
             print("============================================================")
-            emulator.main(target, input_stream)
+            emulator.main(target, input_stream, mode, check, stream)
+
+        if binary:
+            with isa.read_code(target) as loaded:
+                code = machine_words(loaded)
+        else:
+            with open(target, encoding="utf-8") as file:
+                code = file.read()
+    return code, stdout.getvalue()
+
+
+def machine_words(code) -> list[tuple]:
+    return [(word.index, word.opcode, word.arg1, word.arg2) for word in code]
+
+
+@pytest.mark.parametrize("mode", ["micro", "decoded"])
+@pytest.mark.golden_test("golden/*.yml")
+def test_translator_and_machine(golden, mode, caplog):
+    caplog.set_level(logging.DEBUG)
+
+    code, stdout = run_golden(golden, mode)
+
+    assert code == golden.out["out_code"]
+    assert stdout == golden.out["out_stdout"]
+    assert caplog.text == golden.out["out_log"]
+
+
+@pytest.mark.parametrize("mode", ["block", "fast"])
+@pytest.mark.golden_test("golden/*.yml")
+def test_machine_modes(golden, mode):
+    _, stdout = run_golden(golden, mode, check=True)
+
+    assert stdout == golden.out["out_stdout"]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_stream_ports(golden):
+    _, stdout = run_golden(golden, "fast", stream=True)
+
+    assert stdout == golden.out["out_stdout"]
+
+
+def test_stream_prompt():
+    # приглашение выведено до того, как программа ждёт ввода
+    class Terminal(io.StringIO):
+        def __init__(self, text, sink):
+            super().__init__(text)
+            self.sink = sink
+            self.seen = []
+
+        def readline(self, size=-1):
+            self.seen.append(self.sink.getvalue())
+            return super().readline(size)
+
+    sink = io.StringIO()
+    terminal = Terminal("Bob", sink)
+    code = translator.translate('print_str("Who?\\n");\nlet name = read();\nprint_str(name);')
+    output = ports.StreamOutput(sink)
+    emulator.simulation(code, ports.StreamInput(terminal, tie=output), 100000, "fast", output=output)
+
+    assert terminal.seen[0] == "Who?\n"
+    assert sink.getvalue() == "Who?\nBob"
+    with pytest.raises(TypeError):
+        ports.InputPort()
+
+
+def test_hot_blocks():
+    # компилируются только блоки цикла, код до и после него исполняется декодированным
+    source = "let i = 0;\nwhile (i < 100) {\n  i = i + 1;\n}\nprint_int(i);"
+    code = translator.translate(source)
+    _, control_unit, _ = emulator.run(code, "", 100000, "block", trace=False)
+    compiled = [start for start, block in control_unit.blocks.items() if block is not None]
+
+    assert compiled
+    assert all(control_unit.entries[start] == control_unit.hot_threshold for start in compiled)
+    assert 0 not in control_unit.blocks
+    assert emulator.simulation(code, "", 100000, "block") == emulator.simulation(code, "", 100000, "decoded")
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_every_block_compiled(golden, monkeypatch):
+    monkeypatch.setattr(emulator.BlockControlUnit, "hot_threshold", 1)
+    code = translator.translate(golden["in_source"])
+    stdin = golden["in_stdin"]
+
+    assert emulator.simulation(code, stdin, 100000, "block", check=True) == emulator.simulation(
+        code, stdin, 100000, "decoded"
+    )
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_object_file(golden, caplog):
+    caplog.set_level(logging.DEBUG)
+
+    code, stdout = run_golden(golden, "decoded", binary=True)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", encoding="utf-8") as file:
+        file.write(golden.out["out_code"])
+        file.flush()
+        assert code == machine_words(isa.read_code(file.name))
+    assert stdout == golden.out["out_stdout"]
+    assert caplog.text == golden.out["out_log"]
+
+
+@pytest.mark.parametrize("mode", sorted(emulator.control_units))
+def test_wide_values(mode):
+    # регистры не переполняются на 32 битах, память хранит то же
+    source = "let x = 3000000000;\nlet y = 2000000000;\nlet z = y + y;\nprint_int(x);\nprint_int(z);"
+    outputs = {
+        emulator.simulation(translator.translate(source, opt_level), "", 100000, mode)[0] for opt_level in (0, 1)
+    }
+
+    assert outputs == {"30000000004000000000"}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        target = os.path.join(tmpdir, "wide.o")
+        isa.write_code(target, translator.translate(source), binary=True)
+        with isa.read_code(target) as loaded:
+            assert emulator.simulation(loaded, "", 100000, mode)[0] == "30000000004000000000"
+        assert loaded.closed
+
+
+@pytest.mark.parametrize("mode", ["micro", "fast", "block"])
+def test_values_beyond_int64(mode):
+    # регистры не ограничены, в памяти такие числа лежат вне колонок; снимок их сохраняет
+    source = "let a = read_char();\nlet b = a << 62;\nlet c = b + b;\nprint_int(a);\nprint_int(c);"
+    expected = "65" + str(65 << 63)
+    outputs = {
+        emulator.simulation(translator.translate(source, opt_level), "A", 100000, mode)[0] for opt_level in (0, 1)
+    }
+
+    assert outputs == {expected}
+    code = translator.translate(source)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        snapshot = os.path.join(tmpdir, "state.snapshot")
+        emulator.simulation(code, "A", 100000, mode, snapshot_at=50, on_snapshot=lambda machine: machine.save(snapshot))
+        state = MachineSnapshot.load(snapshot)
+        resumed = emulator.simulation(code, "A", 100000, mode, resume=state)
+    assert 65 << 63 in state.memory.wide.values()
+    assert resumed[0] == expected
+
+
+def test_tokenize_positions():
+    lexemes = tokenize('let a = 1;\n  print_str("x\\n");')
+
+    assert next(lexemes) == (Token.LET, "let", 1, 1)
+    assert [lexeme[2:] for lexeme in lexemes] == [
+        (1, 5),
+        (1, 7),
+        (1, 9),
+        (1, 10),
+        (2, 3),
+        (2, 12),
+        (2, 13),
+        (2, 18),
+        (2, 19),
+    ]
+
+
+def test_parse_large_program():
+    statements = ["let a = 0;"] + [
+        "a = a + {} * (a - 1);\nif (a > 5) {{ print_int(a); }}".format(i) for i in range(5000)
+    ]
+    root = parse("\n".join(statements))
+
+    assert len(root.children) == 10001
+    assert (root.children[-1].astType, root.children[-1].line) == (AstType.IF, 10001)
+    with pytest.raises(AssertionError, match="unexpected end of program"):
+        parse("while (a < 1) { a = a + 1;")
+
+
+def test_compact_ast():
+    node = parse("let a = 12;").children[0].children[1]
+
+    assert (node.astType, node.value) == (AstType.NUMBER, 12)
+    assert not hasattr(node, "__dict__")
+
+
+def test_long_expression():
+    # глубина дерева -- 1500, больше предела рекурсии Python
+    source = "let a = read_char();\nlet b = a" + " + a" * 1500 + ";\nprint_int(b);"
+    outputs = {emulator.simulation(translator.translate(source, opt_level), "A", 100000)[0] for opt_level in (1, 2)}
+
+    assert outputs == {str(65 * 1501)}
+    assert translator.translate(source)
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_simulation_batch(golden):
+    pytest.importorskip("numpy")
+    code = translator.ast_to_machine_code(parse(golden["in_source"]))
+    stdin = golden["in_stdin"]
+    inputs = [stdin, "", stdin[:3], stdin[::-1], stdin * 2]
+
+    results = simt.simulation_batch(code, inputs, limit=100000, batch_size=4)
+
+    assert results == [emulator.simulation(code, text, limit=100000, mode="fast") for text in inputs]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_batch_runner(golden):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        for name, text in (("source.vjs", golden["in_source"]), ("input.txt", golden["in_stdin"])):
+            with open(os.path.join(tmpdirname, name), "w", encoding="utf-8") as file:
+                file.write(text)
+        with open(os.path.join(tmpdirname, "loop.vjs"), "w", encoding="utf-8") as file:
+            file.write("let c = 1;\nwhile(c != 0) {\n  c = 1;\n}")
+        manifest = os.path.join(tmpdirname, "manifest.jsonl")
+        with open(manifest, "w", encoding="utf-8") as file:
+            for job in (
+                {"source": "source.vjs", "input": "input.txt"},
+                {"source": "source.vjs", "input": "input.txt", "mode": "micro"},
+                {"source": "loop.vjs", "input": "input.txt", "limit": 10**9, "timeout": 0.2},
+                {"source": "loop.vjs", "input": "input.txt", "limit": 1000},
+            ):
+                file.write(json.dumps(job) + "\n")
+
+        results = os.path.join(tmpdirname, "results.jsonl")
+        statuses = batch_runner.main(manifest, results, workers=2)
+        with open(results, encoding="utf-8") as file:
+            jobs = [json.loads(line) for line in file]
+
+    assert statuses == {"ok": 2, "timeout": 1, "limit": 1}
+    for job in jobs:
+        if job["status"] == "ok":
+            stdout = "{}\ninstr_counter:  {} ticks: {}\n".format(job["output"], job["instr_counter"], job["ticks"])
+            assert stdout == golden.out["out_stdout"].split("\n", 1)[1]
+
+
+@pytest.mark.parametrize("mode", ["micro", "fast", "block"])
+@pytest.mark.golden_test("golden/*.yml")
+def test_snapshot_resume(golden, mode):
+    code = translator.translate(golden["in_source"])
+    stdin = golden["in_stdin"]
+    expected = emulator.simulation(code, stdin, limit=100000, mode=mode)
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        snapshot = os.path.join(tmpdirname, "state.snapshot")
+        emulator.simulation(
+            code, stdin, limit=100000, mode=mode, snapshot_at=expected[1] // 2, on_snapshot=lambda s: s.save(snapshot)
+        )
+        resumed = emulator.simulation(code, stdin, limit=100000, mode=mode, resume=MachineSnapshot.load(snapshot))
+
+    assert resumed == expected
+
+
+@pytest.mark.parametrize("mode", ["micro", "fast", "block"])
+def test_snapshot_wide_values(mode):
+    code = translator.translate("let y = 2000000000;\nlet z = y + y;\nprint_int(z);\nprint_int(y);")
+    expected = emulator.simulation(code, "", limit=100000, mode=mode)
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        snapshot = os.path.join(tmpdirname, "state.snapshot")
+        emulator.simulation(
+            code, "", limit=100000, mode=mode, snapshot_at=expected[1] // 2, on_snapshot=lambda s: s.save(snapshot)
+        )
+        resumed = emulator.simulation(code, "", limit=100000, mode=mode, resume=MachineSnapshot.load(snapshot))
+
+    assert resumed == expected
+    assert expected[0] == "40000000002000000000"
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_profiler(golden):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        source = os.path.join(tmpdirname, "source.vjs")
+        target = os.path.join(tmpdirname, "target.o")
+        with open(source, "w", encoding="utf-8") as file:
+            file.write(golden["in_source"])
+        translator.main(source, target)
+        code = isa.read_code(target)
+        info = read_debug_info(debug_filename(target))
+
+    output, instr_counter, profile = profiler.profile(code, golden["in_stdin"], 100000, info)
+
+    assert len(info.locations) == len(code)
+    assert emulator.simulation(code, golden["in_stdin"], 100000, mode="profile", check=True)[:2] == (
+        output,
+        instr_counter,
+    )
+    assert sum(profile.instructions) == instr_counter
+    stacks = [stack.rsplit(" ", 1) for stack in profile.collapsed_stacks()]
+    assert sum(int(ticks) for _, ticks in stacks) == profile.total_ticks()
+    assert sum(ticks for _, ticks in profile.by_line().values()) == profile.total_ticks()
+    lines = golden["in_source"].count("\n") + 1
+    assert all(0 <= line <= lines for line in profile.by_line())
+    for line, (_, instructions, _) in profile.by_loop().items():
+        assert info.source_line(line).startswith("while")
+        assert instructions <= instr_counter
+
+
+def stack_accesses(code) -> int:
+    return sum(word.opcode in (isa.Opcode.LD_STACK, isa.Opcode.ST_STACK) for word in code)
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_register_allocation(golden):
+    baseline = translator.translate(golden["in_source"])
+    code = translator.translate(golden["in_source"], opt_level=1)
+
+    expected = emulator.simulation(baseline, golden["in_stdin"], 100000, mode="fast")
+    output, _, ticks = emulator.simulation(code, golden["in_stdin"], 100000, mode="fast", check=True)
+
+    assert output == expected[0]
+    assert ticks < expected[2]
+    assert stack_accesses(code) < stack_accesses(baseline)
+
+
+def test_register_allocation_spills():
+    # 12 переменных живы одновременно в цикле -- регистров r1-r8 не хватает
+    names = "abcdefghij"
+    source = "".join("let {} = {};\n".format(name, value) for value, name in enumerate(names, 1))
+    source += "let n = 0;\nwhile (n < 5) {\n  let t = a + j;\n"
+    source += "".join("  {} = {};\n".format(left, right) for left, right in itertools.pairwise(names))
+    source += "  j = t;\n  n = n + 1;\n}\nprint_int(" + " + ".join(names) + ");\n"
+
+    code = translator.translate(source, opt_level=1)
+    output, _, _ = emulator.simulation(code, "", 100000, mode="fast", check=True)
+
+    assert output == "125"
+    assert 0 < stack_accesses(code) < stack_accesses(translator.translate(source))
+
+
+def test_expression_registers():
+    source = "let f2 = read_char();\nlet f3 = read_char();\nlet f4 = f2 + f3;\nprint_int(f4);"
+    program = translator.ast_to_program(parse(source), opt_level=1)
+    statement = [
+        (word.opcode, word.arg1, word.arg2)
+        for word, location in zip(program.machine_code, program.locations)
+        if location.line == 3 and word.opcode is not isa.Opcode.PUSH  # PUSH -- слот переменной f4
+    ]
+
+    assert [opcode for opcode, _, _ in statement] == [isa.Opcode.MV, isa.Opcode.MV, isa.Opcode.ADD, isa.Opcode.MV]
+    assert all(isinstance(arg, isa.Register) for _, *args in statement for arg in args)
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        "((a + b) * (c - a)) % ((b << 2) + (c / 3))",
+        "(((a + 1) - (b + 2)) ^ ((c + 3) | (a + 4))) - (((b + 5) & (c + 6)) + ((a + 7) * (b + 8)))",
+        "a * (b * (c * (a + (b / (c % 4)))))",
+    ],
+)
+def test_expression_registers_spill(expression):
+    # второй пример требует пять регистров, из четырёх промежуточный результат уходит на стек
+    # значения читаются, чтобы выражение не свернулось при трансляции
+    source = "let a = read_char();\nlet b = read_char();\nlet c = read_char();\nprint_int({});".format(expression)
+
+    results = [
+        emulator.simulation(translator.translate(source, opt_level), "\x07\x03\x0c", 100000, mode="fast", check=True)
+        for opt_level in (0, 1)
+    ]
+
+    assert results[1][0] == results[0][0]
+    assert results[1][2] < results[0][2]
+
+
+def test_ir_labels():
+    program = IrProgram()
+    loop, end = program.new_label(), program.new_label()
+    program.place(loop)
+    program.append(Instr.from_args(isa.Opcode.CMP, isa.Register.r9, isa.Register.r0, SourceLocation()))
+    program.append(Instr.from_args(isa.Opcode.JE, end, 0, SourceLocation()))
+    program.append(Instr(isa.Opcode.ADD, isa.Register.r10, [isa.Register.r9, isa.Register.r11], SourceLocation()))
+    program.append(Instr.from_args(isa.Opcode.JUMP, loop, 0, SourceLocation()))
+    program.place(end)
+    program.append(Instr.from_args(isa.Opcode.HALT, 0, 0, SourceLocation()))
+    code, _ = program.to_words()
+
+    # трёхадресный ADD с результатом не в первом операнде опускается в MV и двухадресный ADD
+    assert machine_words(code) == [
+        (0, isa.Opcode.CMP, isa.Register.r9, isa.Register.r0),
+        (1, isa.Opcode.JE, 5, 0),
+        (2, isa.Opcode.MV, isa.Register.r9, isa.Register.r10),
+        (3, isa.Opcode.ADD, isa.Register.r10, isa.Register.r11),
+        (4, isa.Opcode.JUMP, 0, 0),
+        (5, isa.Opcode.HALT, 0, 0),
+    ]
+
+
+def test_jump_threading():
+    # if в конце тела цикла переходит на JUMP к условию цикла, на -O2 -- сразу к условию
+    source = "let i = 0;\nlet s = 0;\nwhile (i < 20) {\n  i = i + 1;\n  if (i % 3 == 0) {\n    s = s + i;\n  }\n}\n"
+    source += "print_int(s);"
+
+    results = [
+        emulator.simulation(translator.translate(source, opt_level), "", 100000, mode="fast", check=True)
+        for opt_level in (1, 2)
+    ]
+
+    assert results[0][0] == results[1][0] == "63"
+    assert results[1][1] < results[0][1]
+
+
+def test_constant_folding():
+    source = "let k = (1 << 10) * 3;\nlet m = k / 7 + k % 5;\nprint_int(m - 1);"
+    program = translator.ast_to_program(parse(source), opt_level=1)
+    first_line = [word for word, location in zip(program.machine_code, program.locations) if location.line == 1]
+
+    assert (isa.Opcode.LD_LIT, 3072) in [(word.opcode, word.arg2) for word in first_line]
+    assert not any(word.opcode is isa.Opcode.JUMP for word in first_line)  # нет цикла умножения
+    assert emulator.simulation(program.machine_code, "", 100000, mode="fast")[0] == "439"
+
+
+@pytest.mark.parametrize("comparison", ["<", ">", ">=", "==", "!="])
+def test_constant_conditions(comparison):
+    source = "let a = 3;\nif (a {} 3) {{\n  let b = a + 1;\n  print_int(b);\n}}\n".format(comparison)
+    source += "while (a > 4 + 1) {\n  print_int(a);\n}\nprint_int(a);"
+
+    results = [
+        emulator.simulation(translator.translate(source, opt_level), "", 100000, mode="fast") for opt_level in (0, 1)
+    ]
+    program = translator.ast_to_program(parse(source), opt_level=1)
+
+    assert results[1][0] == results[0][0]
+    assert not {"if", "while"} & {location.node for location in program.locations}
+
+
+def test_peephole_rules():
+    program = IrProgram()
+    block_end = program.new_label()
+    for opcode, arg1, arg2 in [
+        (isa.Opcode.PUSH, isa.Register.r9, 0),
+        (isa.Opcode.POP, isa.Register.r9, 0),
+        (isa.Opcode.MV, isa.Register.r10, isa.Register.r10),
+        (isa.Opcode.PUSH, isa.Register.r10, 0),
+        (isa.Opcode.POP, isa.Register.r11, 0),
+        (isa.Opcode.ST_STACK, isa.Register.r11, 3),
+        (isa.Opcode.LD_STACK, isa.Register.r12, 3),
+        (isa.Opcode.LD_LIT, isa.Register.r15, 4090),
+    ]:
+        program.append(Instr.from_args(opcode, arg1, arg2, SourceLocation()))
+    program.place(block_end)
+    program.append(Instr.from_args(isa.Opcode.LD_LIT, isa.Register.r15, 4091, SourceLocation()))
+    program.append(Instr.from_args(isa.Opcode.HALT, 0, 0, SourceLocation()))
+
+    peephole(program)
+    code, _ = program.to_words()
+
+    assert [(opcode, arg1, arg2) for _, opcode, arg1, arg2 in machine_words(code)] == [
+        (isa.Opcode.MV, isa.Register.r10, isa.Register.r11),
+        (isa.Opcode.ST_STACK, isa.Register.r11, 3),
+        (isa.Opcode.MV, isa.Register.r11, isa.Register.r12),
+        (isa.Opcode.LD_LIT, isa.Register.r15, 4091),
+        (isa.Opcode.HALT, 0, 0),
+    ]
+    assert set(program.stats) == {"push-pop", "self-move", "store-load", "dead-write"}
+    assert all(instructions >= 0 and ticks > 0 for instructions, ticks in program.stats.values())
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_optimization_levels(golden):
+    results = [
+        emulator.simulation(translator.translate(golden["in_source"], opt_level), golden["in_stdin"], 100000, "fast")
+        for opt_level in (0, 1, 2)
+    ]
+
+    assert results[2][0] == results[1][0] == results[0][0]
+    assert results[2][1] <= results[1][1] < results[0][1]
+
+
+@pytest.mark.parametrize("expression", ["a * 0", "a * 1", "a * 2", "a * 100", "a / 1", "a / 8", "a % 1", "a % 16"])
+def test_strength_reduction(expression):
+    source = "let a = read_char();\nlet b = {};\nprint_int(b);".format(expression)
+    results = [
+        emulator.simulation(translator.translate(source, opt_level), "x", 100000, "fast") for opt_level in (0, 1)
+    ]
+    program = translator.ast_to_program(parse(source), opt_level=1)
+    second_line = [word.opcode for word, location in zip(program.machine_code, program.locations) if location.line == 2]
+
+    assert results[1][0] == results[0][0]
+    assert results[1][2] < results[0][2]
+    assert isa.Opcode.JUMP not in second_line  # без цикла подпрограммы
+
+
+@pytest.mark.parametrize("multiplier", [0, 1, 2, 3, 4, 7, 10, 100, 127])
+def test_strength_reduction_values(multiplier):
+    # сдвиги и сложения умножают на то же число, что и подпрограмма на -O0
+    source = "let a = read_char();\nlet b = a * {};\nprint_int(b);".format(multiplier)
+    results = {
+        emulator.simulation(translator.translate(source, opt_level), "x", 100000, "fast")[0] for opt_level in (0, 1, 2)
+    }
+
+    assert results == {str(evaluate(AstType.MUL, ord("x"), multiplier))}
+
+
+def test_strength_reduction_cost_model():
+    regs = [isa.Register.r9, isa.Register.r10, isa.Register.r11]
+
+    # 3 = 11b: два сложения дешевле сдвига и вычитания; 127 = 10000000b - 1: наоборот
+    assert [opcode for opcode, _, _ in strength.multiply(3, regs)] == [isa.Opcode.MV, isa.Opcode.ADD, isa.Opcode.ADD]
+    assert [opcode for opcode, _, _ in strength.multiply(127, regs)] == [
+        isa.Opcode.MV,
+        isa.Opcode.LD_LIT,
+        isa.Opcode.SHL,
+        isa.Opcode.SUB,
+    ]
+
+
+@pytest.mark.parametrize("mode", sorted(emulator.control_units))
+def test_call_ret(mode):
+    w = isa.Word
+    code = [
+        w(0, isa.Opcode.LD_LIT, isa.Register.r1, 60),
+        w(1, isa.Opcode.CALL, 5, 0),
+        w(2, isa.Opcode.CALL, 5, 0),
+        w(3, isa.Opcode.PRINT, isa.Register.r1, 0),
+        w(4, isa.Opcode.HALT, 0, 0),
+        w(5, isa.Opcode.INC, isa.Register.r1, 0),
+        w(6, isa.Opcode.PRINT, isa.Register.r1, 0),
+        w(7, isa.Opcode.RET, 0, 0),
+    ]
+    ticks = sum(emulator.instruction_ticks[word.opcode] for word in code[:4] + code[5:] * 2) + 1  # + HALT
+
+    assert emulator.simulation(code, "", 1000, mode=mode, check=True) == ("=>>", 10, ticks)
+
+
+def test_runtime_routines():
+    source = "let a = read_char();\nlet b = read_char();\n"
+    source += "".join("print_int(a {} b);\n".format(operator) for operator in "*/%*+-")
+    baseline = translator.translate(source)
+    code = translator.translate(source, opt_level=1)
+    inputs = ["\x2a\x05", "\x07\x03", "\x64\x09"]
+
+    results = [emulator.simulation(code, text, 100000, mode="fast", check=True) for text in inputs]
+
+    assert [output for output, _, _ in results] == [
+        emulator.simulation(baseline, text, 100000, mode="fast")[0] for text in inputs
+    ]
+    # по копии умножения, деления и вывода числа
+    assert [word.opcode for word in code].count(isa.Opcode.RET) == 3
+    assert len(code) < len(baseline) // 3
+    pytest.importorskip("numpy")
+    assert simt.simulation_batch(code, inputs, limit=100000) == results
+
+
+def test_runtime_routine_inlined():
+    # единственный вызов подпрограммы заменяется её кодом
+    source = "let a = read_char();\nprint_int(a * a);"
+    code = translator.translate(source, opt_level=2)
+
+    assert not {isa.Opcode.CALL, isa.Opcode.RET} & {word.opcode for word in code}
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_extended_isa(golden):
+    for opt_level in (0, 1):
+        base = translator.translate(golden["in_source"], opt_level)
+        extended = translator.translate(golden["in_source"], opt_level, isa="extended")
+        expected = emulator.simulation(base, golden["in_stdin"], 100000, mode="fast")
+        output, _, ticks = emulator.simulation(extended, golden["in_stdin"], 100000, mode="fast", check=True)
+
+        assert not isa.extended_opcodes & {word.opcode for word in base}
+        assert output == expected[0]
+        assert ticks <= expected[2]
+
+
+@pytest.mark.parametrize("mode", sorted(emulator.control_units))
+def test_hardware_arithmetic(mode):
+    w = isa.Word
+    code = [
+        w(0, isa.Opcode.LD_LIT, isa.Register.r1, -7),
+        w(1, isa.Opcode.LD_LIT, isa.Register.r2, 2),
+        w(2, isa.Opcode.MV, isa.Register.r1, isa.Register.r3),
+        w(3, isa.Opcode.DIV, isa.Register.r3, isa.Register.r2),  # -3: к нулю
+        w(4, isa.Opcode.MOD, isa.Register.r1, isa.Register.r2),  # -1: знак делимого
+        w(5, isa.Opcode.MUL, isa.Register.r3, isa.Register.r1),  # 3
+        w(6, isa.Opcode.MUL_LIT, isa.Register.r3, 16),  # 48
+        w(7, isa.Opcode.PRINT, isa.Register.r3, 0),
+        w(8, isa.Opcode.DIV, isa.Register.r3, isa.Register.r0),  # -1: деление на 0
+        w(9, isa.Opcode.MUL_LIT, isa.Register.r3, -49),
+        w(10, isa.Opcode.PRINT, isa.Register.r3, 0),
+        w(11, isa.Opcode.HALT, 0, 0),
+    ]
+    ticks = sum(emulator.instruction_ticks[word.opcode] for word in code)
+
+    assert emulator.simulation(code, "", 1000, mode=mode, check=True) == ("01", 11, ticks)
+    assert emulator.instruction_ticks[isa.Opcode.MUL] == 6
+    assert emulator.instruction_ticks[isa.Opcode.DIV] == 10
+
+
+@pytest.mark.parametrize("mode", sorted(emulator.control_units))
+def test_fused_branches(mode):
+    w = isa.Word
+    code = [
+        w(0, isa.Opcode.LD_LIT, isa.Register.r1, 3),
+        w(1, isa.Opcode.LD_LIT, isa.Register.r2, 48),
+        w(2, isa.Opcode.PRINT, isa.Register.r2, 0),
+        w(3, isa.Opcode.INC, isa.Register.r2, 0),
+        w(4, isa.Opcode.DEC, isa.Register.r1, 0),
+        w(5, isa.Opcode.BRNE, 2, isa.Register.r1, isa.Register.r0),  # 3 раза, "012"
+        w(6, isa.Opcode.BRL, 9, isa.Register.r2, 51),  # не переходит: 51 - 51 = 0
+        w(7, isa.Opcode.CMP_LIT, isa.Register.r2, 52),
+        w(8, isa.Opcode.JL, 10, 0),
+        w(9, isa.Opcode.PRINT, isa.Register.r2, 0),
+        w(10, isa.Opcode.BRGE, 12, isa.Register.r1, -1),
+        w(11, isa.Opcode.PRINT, isa.Register.r2, 0),
+        w(12, isa.Opcode.HALT, 0, 0),
+    ]
+    executed = code[:2] + code[2:6] * 3 + code[6:9] + [code[10], code[12]]
+    ticks = sum(emulator.instruction_ticks[word.opcode] for word in executed)
+
+    assert emulator.simulation(code, "", 1000, mode=mode, check=True) == ("012", len(executed) - 1, ticks)
+    pytest.importorskip("numpy")
+    assert simt.simulation_batch(code, [""], limit=1000) == [("012", len(executed) - 1, ticks)]
+
+
+def test_fused_branch_selection():
+    source = "let i = 0;\nwhile (i < 4000000) {\n  i = i + 1000000;\n}\nprint_int(i);"
+    program = translator.ast_to_program(parse(source), opt_level=1)
+    code = program.machine_code
+    loop = [word for word, location in zip(code, program.locations) if location.line == 2]
+
+    assert [word.opcode for word in loop] == [isa.Opcode.BRGE, isa.Opcode.JUMP]
+    assert isinstance(loop[0].arg2, isa.Register)
+    assert loop[0].arg3 == 4000000
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        target = os.path.join(tmpdirname, "target.o")
+        isa.write_code(target, code, binary=True)
+        with isa.read_code(target) as loaded:
+            assert machine_words(loaded) == machine_words(code)
+            assert [word.arg3 for word in loaded] == [word.arg3 for word in code]
+    results = [emulator.simulation(translator.translate(source, opt_level), "", 100000) for opt_level in (0, 1, 2)]
+    assert results[0][0] == results[1][0] == results[2][0] == "4000000"
+    assert results[2][2] < results[1][2] < results[0][2]
+
+
+@pytest.mark.parametrize("mode", sorted(emulator.control_units))
+def test_block_io(mode):
+    w = isa.Word
+    code = [
+        w(0, isa.Opcode.LD_LIT, isa.Register.r1, 20),
+        w(1, isa.Opcode.LD_LIT, isa.Register.r2, 3),
+        w(2, isa.Opcode.READ_BLOCK, isa.Register.r1, isa.Register.r2, 0),  # "abc", r1 = 23
+        w(3, isa.Opcode.LD_LIT, isa.Register.r3, 20),
+        w(4, isa.Opcode.LD_LIT, isa.Register.r4, 5),
+        w(5, isa.Opcode.READ_BLOCK, isa.Register.r1, isa.Register.r4, 0),  # "def" до конца ввода, r1 = 26
+        w(6, isa.Opcode.PRINT_BLOCK, isa.Register.r3, isa.Register.r4, 0),  # "abcde"
+        w(7, isa.Opcode.ADD_LIT, isa.Register.r1, 40),
+        w(8, isa.Opcode.PRINT, isa.Register.r1, 0),  # "B"
+        w(9, isa.Opcode.HALT, 0, 0),
+    ]
+    ticks = sum(emulator.instruction_ticks[word.opcode] for word in code)
+    ticks += 2 * emulator.block_ticks[isa.Opcode.READ_BLOCK] * 3 + emulator.block_ticks[isa.Opcode.PRINT_BLOCK] * 5
+
+    assert emulator.simulation(code, "abcdef", 1000, mode=mode, check=True) == ("abcdeB", 9, ticks)
+    pytest.importorskip("numpy")
+    assert simt.simulation_batch(code, ["abcdef"], limit=1000) == [("abcdeB", 9, ticks)]
+
+
+def test_block_io_translation():
+    source = 'let name = read();\nprint_str("Hello, ");\nprint_str(name);\nprint_str("!");'
+    baseline = translator.translate(source)
+    code = translator.translate(source, opt_level=1)
+    opcodes = [word.opcode for word in code]
+    expected = emulator.simulation(baseline, "Alice", 100000, "fast")
+
+    output, _, ticks = emulator.simulation(code, "Alice", 100000, "fast", check=True)
+
+    assert output == expected[0] == "Hello, Alice!"
+    assert ticks < expected[2] // 3
+    assert (opcodes.count(isa.Opcode.READ_BLOCK), opcodes.count(isa.Opcode.PRINT_BLOCK)) == (1, 3)
+    assert not {isa.Opcode.READ, isa.Opcode.PRINT} & set(opcodes)
+
+
+def test_string_interning():
+    source = 'print_str("ab");\nlet s = "ab";\nprint_str(s);\nprint_str("abc");\nprint_str("ab");'
+    baseline = translator.ast_to_program(parse(source))
+    program = translator.ast_to_program(parse(source), opt_level=1)
+    addresses = [word.arg2 for word in program.machine_code if word.opcode is isa.Opcode.LD_LIT][1:]  # без sp
+
+    output, _, _ = emulator.simulation(program.machine_code, "", 100000, "fast", check=True)
+
+    assert output == emulator.simulation(baseline.machine_code, "", 100000)[0] == "abababcab"
+    assert (len(baseline.static_mem), len(program.static_mem)) == (3 * 3 + 4, 3 + 4)
+    assert (baseline.static_saved, program.static_saved) == (0, 2 * 3)
+    assert addresses.count(addresses[0]) == 3
+    assert len(set(addresses)) == 2
+
+
+def test_extended_isa_folding():
+    # подпрограмма умножает на 2**n - 1 (n -- разряды множителя), MUL -- честно; свёртка считает так же
+    source = "let a = 7 * 6;\nprint_int(a);"
+    results = {
+        (opt_level, profile): emulator.simulation(translator.translate(source, opt_level, profile), "", 100000)[0]
+        for opt_level in (0, 1)
+        for profile in isa.isa_profiles
+    }
+
+    assert results == {(0, "base"): "49", (1, "base"): "49", (0, "extended"): "42", (1, "extended"): "42"}
+
+
+@pytest.mark.parametrize("opt_level", [0, 1, 2])
+def test_multiply_routine(opt_level):
+    # множители известны только при исполнении; свёртка считает то же, что подпрограмма
+    source = "let a = read_char();\nlet b = read_char();\nprint_int(a * b);\nprint_char(a);"
+    for left, right in [(4, 2), (7, 6), (13, 0), (1, 10), (255, 255)]:
+        output = emulator.simulation(translator.translate(source, opt_level), chr(left) + chr(right), 100000)[0]
+
+        assert output == str(evaluate(AstType.MUL, left, right)) + chr(left)
+
+
+@pytest.mark.parametrize(
+    ("start", "condition", "step"),
+    [
+        (0, "i < 5", "i + 1"),
+        (5, "i > 0", "i - 1"),
+        (5, "i >= 1", "i - 1"),
+        (0, "i == 0", "i + 1"),
+        (0, "i != 5", "i + 1"),
+    ],
+)
+def test_loop_rotation(start, condition, step):
+    source = "let i = {};\nwhile ({}) {{\n  print_int(i);\n  i = {};\n}}\nprint_int(i);".format(start, condition, step)
+    results = [
+        emulator.simulation(translator.translate(source, opt_level), "", 100000, "fast", check=True)
+        for opt_level in (0, 1, 2)
+    ]
+    loop_opcodes = {}
+    for opt_level in (1, 2):
+        program = translator.ast_to_program(parse(source), opt_level)
+        loop_opcodes[opt_level] = [
+            word.opcode for word, location in zip(program.machine_code, program.locations) if location.line == 2
+        ]
+
+    assert results[2][0] == results[1][0] == results[0][0]
+    assert results[2][2] < results[1][2]
+    assert isa.Opcode.JUMP in loop_opcodes[1]
+    assert isa.Opcode.JUMP not in loop_opcodes[2]  # условие проверяется и в конце тела
+
+
+def test_loop_invariants():
+    # a * 4 + b считается до цикла, переменная тела объявляется до цикла: в цикле нет PUSH
+    # (a * 4 -- это a * 7, см. `interpreter.folding`)
+    source = (
+        "let a = read_char();\nlet b = 3;\nlet i = 0;\nlet s = 0;\nwhile (i < a - 40) {\n  let t = i + (a * 4 + b);\n"
+    )
+    source += "  s = s + t;\n  i = i + 1;\n}\nprint_int(s);"
+    results = [
+        emulator.simulation(translator.translate(source, opt_level), "1", 100000, "fast", check=True)
+        for opt_level in (0, 1, 2)
+    ]
+    program = translator.ast_to_program(parse(source), opt_level=2)
+    back_branch = next(
+        word
+        for word, location in zip(program.machine_code, program.locations)
+        if location.line == 5 and word.opcode in isa.fused_branches and word.arg1 < word.index
+    )
+    loop = {word.opcode for word in program.machine_code[back_branch.arg1 : back_branch.index + 1]}
+
+    assert results[2][0] == results[1][0] == results[0][0] == "3150"
+    assert results[2][2] < results[1][2]
+    assert not {isa.Opcode.PUSH, isa.Opcode.SHL} & loop
+
 
-        with open(target, encoding="utf-8") as file:
-            code = file.read()
+def test_static_frame():
+    # блоки if не вложены друг в друга и делят слоты: a, i, b или c, d
+    source = "let a = read_char();\nlet i = 0;\nwhile (i < 3) {\n  if (a > 40) {\n    let b = a + i;\n    print_int(b);\n  }\n"
+    source += "  if (a > 50) {\n    let c = a - i;\n    let d = c + 1;\n    print_int(d);\n  }\n  i = i + 1;\n}"
+    results = [
+        emulator.simulation(translator.translate(source, opt_level), "A", 100000, "fast", check=True)
+        for opt_level in (0, 1)
+    ]
+    program = translator.ast_to_program(parse(source), opt_level=1)
+    let_lines = {1, 2, 5, 9, 10}
 
-        assert code == golden.out["out_code"]
-        assert stdout.getvalue() == golden.out["out_stdout"]
-        assert caplog.text == golden.out["out_log"]
+    assert translator.frame_size(parse(source).children) == program.frame_size == 4
+    assert results[1][0] == results[0][0] == "656666656764"
+    assert [
+        word.arg2 for word in program.machine_code if word.opcode is isa.Opcode.LD_LIT and word.arg1 is isa.Register.r15
+    ] == [4091]
+    assert not any(
+        word.opcode is isa.Opcode.PUSH and location.line in let_lines
+        for word, location in zip(program.machine_code, program.locations)
+    )
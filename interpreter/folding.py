@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+
+from machine.emulator import Alu
+from machine.isa import Opcode, isa_profiles
+
+from interpreter.parser import AstNode, AstType, postorder, walk
+
+# Свёртка констант и распространение констант по AST (с уровня оптимизации 1).
+#
+# Подвыражения из чисел вычисляются при трансляции так, как их посчитал бы код машины: умножение,
+# деление и остаток -- встроенными подпрограммами, поэтому сворачиваются только там, где подпрограмма
+# завершается (множитель не отрицательный, делимое не отрицательное, делитель положительный).
+# Подпрограмма умножения прибавляет сдвинутое множимое на каждом разряде множителя, не проверяя
+# значение разряда, то есть умножает на 2**n - 1, где n -- число разрядов множителя; так и сворачивается.
+# С расширенной системой команд (`--isa=extended`) умножение, деление и остаток -- инструкции MUL, DIV, MOD,
+# и сворачиваются они так, как их считает АЛУ (`machine.emulator.Alu`).
+# Результат должен помещаться в 32-битное слово, иначе выражение остаётся до исполнения.
+#
+# Переменная, которой присвоено число, заменяется этим числом в последующих выражениях, пока ей
+# не присвоят что-то другое. Переменные, которые меняются в теле цикла, до цикла, в нём и после него
+# не константы; после if -- тоже, если тело меняет их. Оператор if или while с условием,
+# известным при трансляции, заменяется телом или удаляется.
+
+word_min = -(2**31)
+word_max = 2**31 - 1
+
+operations: dict[AstType, Callable[[int, int], int]] = {
+    AstType.PLUS: lambda a, b: a + b,
+    AstType.MINUS: lambda a, b: a - b,
+    AstType.AND: lambda a, b: a & b,
+    AstType.OR: lambda a, b: a | b,
+    AstType.XOR: lambda a, b: a ^ b,
+    AstType.SHL: lambda a, b: a << b,
+    AstType.SHR: lambda a, b: a >> b,
+    AstType.MUL: lambda a, b: a * ((1 << b.bit_length()) - 1),
+    AstType.DIV: lambda a, b: a // b,
+    AstType.MOD: lambda a, b: a % b,
+}
+
+# операции, которые в расширенной системе команд -- инструкции
+hardware_opcodes: dict[AstType, Opcode] = {
+    AstType.MUL: Opcode.MUL,
+    AstType.DIV: Opcode.DIV,
+    AstType.MOD: Opcode.MOD,
+}
+
+# где операция определена так же, как в машине
+domains: dict[AstType, Callable[[int, int], bool]] = {
+    AstType.SHL: lambda a, b: 0 <= b < 32,
+    AstType.SHR: lambda a, b: b >= 0,
+    AstType.MUL: lambda a, b: b >= 0,
+    AstType.DIV: lambda a, b: a >= 0 and b > 0,
+    AstType.MOD: lambda a, b: a >= 0 and b > 0,
+}
+
+# выполняется ли тело при разности левой и правой частей сравнения; транслятор переходит за тело
+# обратным условием, поэтому `<=` (обратный переход JG -- по неотрицательной разности) работает как `<`
+conditions: dict[AstType, Callable[[int], bool]] = {
+    AstType.EQ: lambda diff: diff == 0,
+    AstType.NEQ: lambda diff: diff != 0,
+    AstType.GT: lambda diff: diff > 0,
+    AstType.GE: lambda diff: diff >= 0,
+    AstType.LT: lambda diff: diff < 0,
+    AstType.LE: lambda diff: diff < 0,
+}
+
+
+def constant_value(node: AstNode) -> int | None:
+    return node.value if node.astType == AstType.NUMBER else None
+
+
+def hardware_opcode(operation: AstType, isa: str) -> Opcode | None:
+    """Инструкция для операции, если она есть в профиле системы команд isa."""
+    opcode = hardware_opcodes.get(operation)
+    return opcode if opcode in isa_profiles[isa] else None
+
+
+def evaluate(operation: AstType, left: int, right: int, isa: str = "base") -> int | None:
+    """Значение операции над числами или None, если её нельзя посчитать при трансляции."""
+    opcode = hardware_opcode(operation, isa)
+    if opcode is not None:
+        value = Alu.operations[opcode](left, right)
+    elif operation in domains and not domains[operation](left, right):
+        return None
+    else:
+        value = operations[operation](left, right)
+    return value if word_min <= value <= word_max else None
+
+
+def fold_node(node: AstNode, env: dict[str, int], isa: str) -> AstNode:
+    """Узел с подставленной константой или свёрнутая операция; её операнды уже свёрнуты."""
+    if node.astType == AstType.NAME and node.value in env:
+        return AstNode(AstType.NUMBER, env[node.value])
+    if node.astType not in operations:
+        return node
+    left, right = (constant_value(child) for child in node.children)
+    if left is None or right is None:
+        return node
+    value = evaluate(node.astType, left, right, isa)
+    return node if value is None else AstNode(AstType.NUMBER, value)
+
+
+def fold_expression(node: AstNode, env: dict[str, int], isa: str) -> AstNode:
+    """Выражение с подставленными константами и свёрнутыми подвыражениями."""
+    folded: dict[int, AstNode] = {}  # id узла -> он же после свёртки
+    for current in postorder(node):
+        current.children = [folded.pop(id(child)) for child in current.children]
+        folded[id(current)] = fold_node(current, env, isa)
+    return folded[id(node)]
+
+
+def condition_value(comparison: AstNode) -> bool | None:
+    """Выполнится ли тело if/while, если это известно при трансляции."""
+    left, right = (constant_value(child) for child in comparison.children)
+    if left is None or right is None:
+        return None
+    return conditions[comparison.astType](left - right)
+
+
+def assigned_names(node: AstNode) -> set[str]:
+    """Переменные, которым присваивают внутри оператора."""
+    return {
+        current.children[0].value
+        for current in walk(node)
+        if current.astType == AstType.LET or current.astType == AstType.ASSIGN
+    }
+
+
+def forget(env: dict[str, int], node: AstNode) -> None:
+    for name in assigned_names(node):
+        env.pop(name, None)
+
+
+def fold_assignment(node: AstNode, env: dict[str, int], isa: str) -> None:
+    name = node.children[0].value
+    if node.children[1].astType in (AstType.STRING, AstType.READ, AstType.READ_CHAR):
+        env.pop(name, None)
+        return
+    node.children[1] = fold_expression(node.children[1], env, isa)
+    value = constant_value(node.children[1])
+    if value is None:
+        env.pop(name, None)
+    else:
+        env[name] = value
+
+
+def fold_if(node: AstNode, env: dict[str, int], isa: str) -> list[AstNode]:
+    comparison, body = node.children[0], node.children[1]
+    comparison.children = [fold_expression(child, env, isa) for child in comparison.children]
+    holds = condition_value(comparison)
+    if holds is False:
+        return []
+    if holds and not any(child.astType == AstType.LET for child in body.children):
+        return fold_statements(body.children, env, isa)
+    body.children = fold_statements(body.children, dict(env), isa)
+    forget(env, body)
+    if holds:  # тело со своими переменными остаётся блоком
+        body.line = node.line
+        return [body]
+    return [node]
+
+
+def fold_while(node: AstNode, env: dict[str, int], isa: str) -> list[AstNode]:
+    forget(env, node)
+    comparison, body = node.children[0], node.children[1]
+    comparison.children = [fold_expression(child, env, isa) for child in comparison.children]
+    if condition_value(comparison) is False:
+        return []
+    body.children = fold_statements(body.children, dict(env), isa)
+    return [node]
+
+
+def fold_statement(node: AstNode, env: dict[str, int], isa: str) -> list[AstNode]:
+    """Оператор после свёртки: ноль, один или несколько операторов."""
+    if node.astType == AstType.LET or node.astType == AstType.ASSIGN:
+        fold_assignment(node, env, isa)
+    elif node.astType == AstType.PRINT_INT or node.astType == AstType.PRINT_CHAR:
+        node.children[0] = fold_expression(node.children[0], env, isa)
+    elif node.astType == AstType.IF:
+        return fold_if(node, env, isa)
+    elif node.astType == AstType.WHILE:
+        return fold_while(node, env, isa)
+    return [node]
+
+
+def fold_statements(statements: list[AstNode], env: dict[str, int], isa: str) -> list[AstNode]:
+    result = []
+    for statement in statements:
+        result += fold_statement(statement, env, isa)
+    return result
+
+
+def fold_constants(root: AstNode, isa: str = "base") -> None:
+    root.children = fold_statements(root.children, {}, isa)
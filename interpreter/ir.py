@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+from collections.abc import Iterator
+
+from machine.blocks import branch_conditions
+from machine.debuginfo import SourceLocation
+from machine.isa import Opcode, Register, StaticMemAddressStub, VirtualRegister, Word, block_transfers, fused_branches
+
+# Промежуточное представление транслятора: трёхадресные инструкции (опкод, результат, операнды)
+# в базовых блоках с метками. Переходы ссылаются на метки, а не на адреса, поэтому проходы могут
+# свободно удалять и вставлять инструкции; адреса появляются только при переводе в `Word`.
+#
+# Раскладка аргументов слова по ролям: "d" -- результат, "s" -- операнд, "ds" -- операнд, он же
+# результат (двухадресная операция машины), "" -- аргумента нет (в слове 0). У совмещённого сравнения
+# с переходом (BRcc) три операнда: метка перехода и что сравнивается; у блочного ввода-вывода -- адрес
+# (он же результат: адрес за блоком), длина и порт.
+
+operand_roles: dict[Opcode, tuple[str, ...]] = {
+    Opcode.MV: ("s", "d"),
+    Opcode.LD_LIT: ("d", "s"),
+    Opcode.LD_STACK: ("d", "s"),
+    Opcode.LD_ADDR: ("d", "s"),
+    Opcode.LD: ("d", "s"),
+    Opcode.READ: ("d", "s"),
+    Opcode.POP: ("d", ""),
+    Opcode.ST_STACK: ("s", "s"),
+    Opcode.ST_ADDR: ("s", "s"),
+    Opcode.ST: ("s", "s"),
+    Opcode.PRINT: ("s", "s"),
+    Opcode.CMP: ("s", "s"),
+    Opcode.CMP_LIT: ("s", "s"),
+    Opcode.PUSH: ("s", ""),
+    Opcode.ADD_LIT: ("ds", "s"),
+    Opcode.MUL_LIT: ("ds", "s"),
+    Opcode.INC: ("ds", ""),
+    Opcode.DEC: ("ds", ""),
+    Opcode.NEG: ("ds", ""),
+    Opcode.HALT: ("", ""),
+    Opcode.CALL: ("s", ""),
+    Opcode.RET: ("", ""),
+    **{opcode: ("s", "") for opcode in branch_conditions},
+    **{opcode: ("s", "s", "s") for opcode in fused_branches},
+    **{opcode: ("ds", "s", "s") for opcode in block_transfers},
+    **{opcode: ("ds", "s") for opcode in (Opcode.ADD, Opcode.SUB, Opcode.AND, Opcode.OR, Opcode.XOR)},
+    **{opcode: ("ds", "s") for opcode in (Opcode.MUL, Opcode.DIV, Opcode.MOD)},
+    **{opcode: ("ds", "s") for opcode in (Opcode.SHL, Opcode.SHR)},
+}
+
+Operand = int | Register | VirtualRegister | StaticMemAddressStub
+
+
+class Label:
+    name: str
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+class Instr:
+    """Инструкция IR: dst -- результат (или None), srcs -- операнды: регистры, числа, метки переходов."""
+
+    opcode: Opcode
+    dst: Register | VirtualRegister | None
+    srcs: list[Operand | Label]
+    location: SourceLocation
+
+    def __init__(self, opcode: Opcode, dst, srcs: list, location: SourceLocation):
+        self.opcode = opcode
+        self.dst = dst
+        self.srcs = srcs
+        self.location = location
+
+    @classmethod
+    def from_args(cls, opcode: Opcode, arg1, arg2, location: SourceLocation, arg3=None) -> Instr:
+        """Инструкция из аргументов слова машинного кода."""
+        dst = None
+        srcs = []
+        for role, arg in zip(operand_roles[opcode], (arg1, arg2, arg3)):
+            if "d" in role:
+                dst = arg
+            if "s" in role:
+                srcs.append(arg)
+        return cls(opcode, dst, srcs, location)
+
+    def copy(self) -> Instr:
+        return Instr(self.opcode, self.dst, list(self.srcs), self.location)
+
+    def is_jump(self) -> bool:
+        return (
+            self.opcode in branch_conditions
+            or self.opcode in fused_branches
+            or self.opcode in (Opcode.HALT, Opcode.CALL, Opcode.RET)
+        )
+
+    def registers(self) -> list[Register | VirtualRegister]:
+        """Читаемые регистры."""
+        return [src for src in self.srcs if isinstance(src, Register | VirtualRegister)]
+
+    def needs_move(self) -> bool:
+        """Двухадресной операции машины нужен MV операнда в результат."""
+        return operand_roles[self.opcode][0] == "ds" and self.dst != self.srcs[0]
+
+    def size(self) -> int:
+        return 2 if self.needs_move() else 1
+
+    def to_words(self, addr: int, labels: dict[Label, int]) -> list[Word]:
+        srcs = iter(labels.get(src, src) if isinstance(src, Label) else src for src in self.srcs)
+        words = []
+        if self.needs_move():
+            assert self.dst not in self.srcs[1:], "Operand overwritten by move: {}".format(self)
+            words.append(Word(addr, Opcode.MV, next(srcs), self.dst))
+        elif operand_roles[self.opcode][0] == "ds":
+            next(srcs)
+        args = []
+        for role in operand_roles[self.opcode]:
+            args.append(self.dst if "d" in role else next(srcs) if role else 0)
+        words.append(Word(addr + len(words), self.opcode, *args))
+        return words
+
+    def __repr__(self):
+        return "{} {} <- {}".format(self.opcode.name, self.dst, self.srcs)
+
+
+class BasicBlock:
+    """Базовый блок: метки, по которым на него переходят, и инструкции; переход -- только последней."""
+
+    labels: list[Label]
+    instrs: list[Instr]
+
+    def __init__(self, labels: list[Label] | None = None):
+        self.labels = labels or []
+        self.instrs = []
+
+    def terminator(self) -> Instr | None:
+        if self.instrs and self.instrs[-1].is_jump():
+            return self.instrs[-1]
+        return None
+
+    def falls_through(self) -> bool:
+        terminator = self.terminator()
+        return terminator is None or terminator.opcode not in (Opcode.JUMP, Opcode.HALT, Opcode.RET)
+
+
+class IrProgram:
+    """Базовые блоки программы в порядке размещения в памяти; за блоком без перехода исполняется следующий."""
+
+    blocks: list[BasicBlock]
+
+    def __init__(self):
+        self.blocks = [BasicBlock()]
+        self.label_count = 0
+        self.stats: dict[str, tuple[int, int]] = {}  # что сэкономили проходы: правило -> (инструкции, такты)
+
+    def new_label(self, name: str = "L") -> Label:
+        self.label_count += 1
+        return Label("{}{}".format(name, self.label_count))
+
+    def place(self, label: Label) -> None:
+        """Поставить метку перед следующей инструкцией."""
+        if self.blocks[-1].instrs:
+            self.blocks.append(BasicBlock())
+        self.blocks[-1].labels.append(label)
+
+    def append(self, instr: Instr) -> Instr:
+        if self.blocks[-1].terminator() is not None:
+            self.blocks.append(BasicBlock())
+        self.blocks[-1].instrs.append(instr)
+        return instr
+
+    def instructions(self) -> Iterator[Instr]:
+        for block in self.blocks:
+            yield from block.instrs
+
+    def block_index(self) -> dict[Label, int]:
+        return {label: index for index, block in enumerate(self.blocks) for label in block.labels}
+
+    def successors(self, index: int, block_index: dict[Label, int]) -> list[int]:
+        """Номера блоков, куда может перейти исполнение из блока index.
+
+        За CALL исполнение идёт и в подпрограмму, и (после её RET) в следующий блок; у RET преемников нет.
+        """
+        block = self.blocks[index]
+        result = []
+        terminator = block.terminator()
+        if terminator is not None and terminator.srcs:
+            result.append(block_index[terminator.srcs[0]])
+        if block.falls_through() and index + 1 < len(self.blocks):
+            result.append(index + 1)
+        return result
+
+    def to_words(self) -> tuple[list[Word], list[SourceLocation]]:
+        """Разместить блоки подряд с адреса 0, заменить метки адресами."""
+        labels: dict[Label, int] = {}
+        addr = 0
+        for block in self.blocks:
+            for label in block.labels:
+                labels[label] = addr
+            addr += sum(instr.size() for instr in block.instrs)
+        code: list[Word] = []
+        locations: list[SourceLocation] = []
+        for instr in self.instructions():
+            words = instr.to_words(len(code), labels)
+            code += words
+            locations += [instr.location] * len(words)
+        return code, locations
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import re
+from collections.abc import Iterator
 from enum import Enum
 
 
@@ -41,16 +42,30 @@ class Token(Enum):
     NUMBER = r"-?[0-9]+"
 
 
-def lex(program: str) -> list[tuple[Token, str]]:
-    regex = "|".join(f"(?P<{t.name}>{t.value})" for t in Token)
-    found_tokens = re.finditer(regex, program)
-    tokens: list[tuple[Token, str]] = []
-    for token in found_tokens:
-        t_type: str = token.lastgroup
-        t_value: str = token.group(t_type)
-        if t_type == "STRING":
-            tokens.append((Token[t_type], t_value[1:-1].replace("\\n", "\n")))
+Lexeme = tuple[Token, str, int, int]  # тип, значение, номер строки и столбца (с 1)
 
-        else:
-            tokens.append((Token[t_type], t_value))
-    return tokens
+token_regex = re.compile("|".join(f"({t.value})" for t in Token))
+group_tokens: list[Token] = list(Token)  # группа регулярного выражения (с 1) -> её лексема
+
+
+def tokenize(program: str) -> Iterator[Lexeme]:
+    """Лексемы программы по одной, по мере чтения текста."""
+    line = 1
+    line_start = 0  # до этой позиции переводы строк уже посчитаны
+    line_begin = 0  # позиция первого символа строки line
+    for token in token_regex.finditer(program):
+        t_type = group_tokens[token.lastindex - 1]
+        t_value: str = token.group()
+        start = token.start()
+        newlines = program.count("\n", line_start, start)
+        if newlines:
+            line += newlines
+            line_begin = program.rfind("\n", line_start, start) + 1
+        line_start = start
+        if t_type is Token.STRING:
+            t_value = t_value[1:-1].replace("\\n", "\n")
+        yield t_type, t_value, line, start - line_begin + 1
+
+
+def lex(program: str) -> list[Lexeme]:
+    return list(tokenize(program))
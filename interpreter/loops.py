@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+from collections.abc import Iterator
+from itertools import count
+
+from machine.isa import Opcode
+
+from interpreter.folding import assigned_names, constant_value, hardware_opcode, operations, word_max
+from interpreter.ir import BasicBlock, Instr, IrProgram, Label
+from interpreter.parser import AstNode, AstType, postorder, walk
+
+# Циклы while (с уровня оптимизации 2).
+#
+# Над AST -- вынос из цикла того, что не меняется между итерациями. Переменные, объявленные прямо в теле
+# (let), объявляются перед циклом, а в теле им присваивают: иначе каждая итерация делает PUSH и стек растёт
+# до выхода из цикла. Подвыражения, в которых нет переменных, меняющихся в цикле, считаются один раз
+# до цикла во временные переменные (имена с `$`, в исходном тексте таких нет). Выносятся только операции,
+# которые завершаются при любых операндах: подпрограммы умножения и деления на отрицательных числах
+# не завершаются, а до выноса цикл мог и не дойти до них. Объявления перед циклом и сам цикл -- блок
+# со своими переменными. Вложенные циклы обрабатываются раньше объемлющих.
+#
+# Над IR -- поворот цикла: условие проверяется и в конце тела, поэтому за итерацию исполняется
+# на один JUMP меньше. Безусловный переход назад на заголовок (блок, который считает условие и выходит
+# из цикла по CMP или CMP_LIT и условному переходу) заменяется копией заголовка с обратным условным
+# переходом на начало тела; за копией исполнение проваливается на выход из цикла.
+
+# обратный условный переход: опкод и надо ли поменять местами операнды CMP (JG -- флаг neg сброшен,
+# это и `>=`; у `>` без равенства своего перехода нет); у CMP_LIT вместо этого `a > n` -- это `a >= n + 1`
+complement_branches: dict[Opcode, tuple[Opcode, bool]] = {
+    Opcode.JE: (Opcode.JNE, False),
+    Opcode.JNE: (Opcode.JE, False),
+    Opcode.JG: (Opcode.JL, False),
+    Opcode.JGE: (Opcode.JL, False),
+    Opcode.JL: (Opcode.JG, False),
+    Opcode.JLE: (Opcode.JL, True),
+}
+
+max_rotated_header = 12  # инструкций заголовка, которые можно скопировать в конец тела
+
+not_expressions = (AstType.STRING, AstType.READ, AstType.READ_CHAR)
+
+
+def is_total(node: AstNode, isa: str) -> bool:
+    """Завершается ли операция при любых значениях операндов."""
+    right = constant_value(node.children[1])
+    if node.astType in (AstType.SHL, AstType.SHR):
+        return right is not None and right >= 0
+    if node.astType == AstType.MUL:
+        return hardware_opcode(node.astType, isa) is not None or (right is not None and right >= 0)
+    if node.astType in (AstType.DIV, AstType.MOD):  # без инструкции -- степень двойки, см. `interpreter.strength`
+        return hardware_opcode(node.astType, isa) is not None or (
+            right is not None and right > 0 and not right & (right - 1)
+        )
+    return True
+
+
+def invariant_nodes(node: AstNode, assigned: set[str], isa: str) -> set[int]:
+    """id подвыражений node, которые не меняются в цикле."""
+    invariant: set[int] = set()
+    for current in postorder(node):
+        if current.astType == AstType.NUMBER:
+            holds = True
+        elif current.astType == AstType.NAME:
+            holds = current.value not in assigned
+        else:
+            holds = current.astType in operations and is_total(current, isa)
+            holds = holds and all(id(child) in invariant for child in current.children)
+        if holds:
+            invariant.add(id(current))
+    return invariant
+
+
+def expression_key(node: AstNode) -> tuple:
+    """Одинаковые выражения -- одинаковые ключи: узлы в прямом порядке с числом детей."""
+    return tuple((current.astType, current.value, len(current.children)) for current in walk(node))
+
+
+class Hoisting:
+    """Вынос из одного цикла: неизменные переменные и временные переменные для вынесенных выражений."""
+
+    def __init__(self, loop: AstNode, isa: str, names: Iterator[int]):
+        self.assigned = assigned_names(loop)
+        self.isa = isa
+        self.names = names
+        self.temporaries: dict[tuple, AstNode] = {}  # выражение -> его объявление перед циклом
+        self.line = loop.line
+
+    def expression(self, node: AstNode) -> AstNode:
+        """Выражение, где наибольшие неизменные подвыражения заменены временными переменными."""
+        invariant = invariant_nodes(node, self.assigned, self.isa)
+        replaced = self.replacement(node, invariant)
+        if replaced is not None:
+            return replaced
+        stack = [(node, index) for index in reversed(range(len(node.children)))]
+        while stack:  # слева направо, как при обходе в глубину
+            parent, index = stack.pop()
+            child = parent.children[index]
+            replaced = self.replacement(child, invariant)
+            if replaced is None:
+                stack.extend((child, index) for index in reversed(range(len(child.children))))
+            else:
+                parent.children[index] = replaced
+        return node
+
+    def replacement(self, node: AstNode, invariant: set[int]) -> AstNode | None:
+        """Чем заменить подвыражение или None, если замена -- внутри него."""
+        if node.astType not in operations:
+            return node
+        if id(node) not in invariant:
+            return None
+        key = expression_key(node)
+        if key not in self.temporaries:
+            declaration = AstNode(AstType.LET)
+            declaration.add_child(AstNode(AstType.NAME, "${}".format(next(self.names))))
+            declaration.add_child(node)
+            declaration.line = self.line
+            self.temporaries[key] = declaration
+        return AstNode(AstType.NAME, self.temporaries[key].children[0].value)
+
+    def statement(self, node: AstNode) -> None:
+        if node.astType in (AstType.LET, AstType.ASSIGN) and node.children[1].astType not in not_expressions:
+            node.children[1] = self.expression(node.children[1])
+        elif node.astType in (AstType.PRINT_INT, AstType.PRINT_CHAR):
+            node.children[0] = self.expression(node.children[0])
+        elif node.astType in (AstType.IF, AstType.WHILE):
+            self.condition(node.children[0])
+            self.statements(node.children[1].children)
+        elif node.astType == AstType.BLOCK:
+            self.statements(node.children)
+
+    def statements(self, nodes: list[AstNode]) -> None:
+        for node in nodes:
+            self.statement(node)
+
+    def condition(self, comparison: AstNode) -> None:
+        comparison.children = [self.expression(child) for child in comparison.children]
+
+
+def declare_before_loop(body: AstNode) -> list[AstNode]:
+    """Объявления переменных тела перед циклом; в теле объявления становятся присваиваниями."""
+    declarations = []
+    for statement in body.children:
+        if statement.astType == AstType.LET:
+            statement.astType = AstType.ASSIGN
+            declaration = AstNode(AstType.LET)
+            declaration.add_child(AstNode(AstType.NAME, statement.children[0].value))
+            declaration.add_child(AstNode(AstType.NUMBER, 0))
+            declaration.line = statement.line
+            declarations.append(declaration)
+    return declarations
+
+
+def hoist_loop(loop: AstNode, isa: str, names: Iterator[int]) -> AstNode:
+    comparison, body = loop.children[0], loop.children[1]
+    body.children = hoist_statements(body.children, isa, names)
+    hoisting = Hoisting(loop, isa, names)
+    hoisting.condition(comparison)
+    hoisting.statements(body.children)
+    declarations = [*hoisting.temporaries.values(), *declare_before_loop(body)]
+    if not declarations:
+        return loop
+    block = AstNode(AstType.BLOCK)
+    block.children = [*declarations, loop]
+    block.line = loop.line
+    return block
+
+
+def hoist_statements(statements: list[AstNode], isa: str, names: Iterator[int]) -> list[AstNode]:
+    result = []
+    for statement in statements:
+        if statement.astType == AstType.WHILE:
+            statement = hoist_loop(statement, isa, names)
+        elif statement.astType == AstType.IF:
+            statement.children[1].children = hoist_statements(statement.children[1].children, isa, names)
+        elif statement.astType == AstType.BLOCK:
+            statement.children = hoist_statements(statement.children, isa, names)
+        result.append(statement)
+    return result
+
+
+def hoist_loop_invariants(root: AstNode, isa: str = "base") -> None:
+    root.children = hoist_statements(root.children, isa, count(1))
+
+
+def loop_header(program: IrProgram, index: int) -> BasicBlock | None:
+    """Заголовок цикла, если блок index -- это CMP и условный переход; выход из цикла -- куда он ведёт."""
+    block = program.blocks[index]
+    if not 2 <= len(block.instrs) <= max_rotated_header:
+        return None
+    compare, branch = block.instrs[-2:]
+    if compare.opcode not in (Opcode.CMP, Opcode.CMP_LIT) or branch.opcode not in complement_branches:
+        return None
+    return block
+
+
+def next_block_index(program: IrProgram, index: int) -> int:
+    """Номер блока, который исполняется за блоком index (пустые блоки между ними не в счёт)."""
+    index += 1
+    while index < len(program.blocks) and not program.blocks[index].instrs:
+        index += 1
+    return index
+
+
+def body_label(program: IrProgram, index: int) -> Label:
+    block = program.blocks[index]
+    if not block.labels:
+        block.labels.append(program.new_label())
+    return block.labels[0]
+
+
+def rotated_test(header: BasicBlock, body: Label) -> list[Instr] | None:
+    """Копия заголовка, которая переходит на тело, пока условие цикла выполняется."""
+    code = [instr.copy() for instr in header.instrs[:-1]]
+    exit_branch = header.instrs[-1]
+    opcode, swap = complement_branches[exit_branch.opcode]
+    compare = code[-1]
+    if swap and compare.opcode is Opcode.CMP_LIT:
+        if compare.srcs[1] >= word_max:
+            return None
+        compare.srcs[1] += 1
+        opcode = Opcode.JG
+    elif swap:
+        compare.srcs.reverse()
+    code.append(Instr(opcode, None, [body], exit_branch.location))
+    return code
+
+
+def rotate_loops(program: IrProgram) -> None:
+    block_index = program.block_index()
+    for index, latch in enumerate(program.blocks):
+        terminator = latch.terminator()
+        if terminator is None or terminator.opcode is not Opcode.JUMP:
+            continue
+        header_index = block_index[terminator.srcs[0]]
+        header = loop_header(program, header_index) if header_index < index else None
+        if header is None:
+            continue
+        exit_index = block_index[header.instrs[-1].srcs[0]]
+        if not index < exit_index <= next_block_index(program, index):
+            continue
+        body = body_label(program, header_index + 1)
+        block_index[body] = header_index + 1
+        test = rotated_test(header, body)
+        if test is not None:
+            latch.instrs[-1:] = test
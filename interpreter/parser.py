@@ -1,8 +1,9 @@
 from __future__ import annotations
 
+from collections.abc import Collection, Iterable, Iterator
 from enum import Enum
 
-from interpreter.lexer import Token, lex
+from interpreter.lexer import Lexeme, Token, tokenize
 
 
 class AstType(Enum):
@@ -55,102 +56,152 @@ def map_token_to_type(token: Token) -> AstType:
 
 
 class AstNode:
-    def __init__(self, ast_type: AstType, value: str = ""):
+    """Узел AST; без `__dict__`, у числа value -- int, разобранный при разборе текста."""
+
+    __slots__ = ("astType", "children", "line", "value")
+
+    def __init__(self, ast_type: AstType, value: str | int = ""):
         self.astType = ast_type
         self.children: list[AstNode] = []
         self.value = value
+        self.line = 0  # строка исходного текста, заполняется для операторов
 
     @classmethod
-    def from_token(cls, token: Token, value: str = "") -> AstNode:
+    def from_token(cls, token: Token, value: str | int = "") -> AstNode:
         return cls(map_token_to_type(token), value)
 
     def add_child(self, node: AstNode) -> None:
         self.children.append(node)
 
 
-def match_list(tokens: list[tuple[Token, str]], token_req: list[Token]) -> None:
-    assert tokens[0][0] in token_req
+def walk(node: AstNode) -> Iterator[AstNode]:
+    """Узлы поддерева node, родитель раньше детей; без рекурсии, глубина дерева не ограничена."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(node.children))
+
+
+def postorder(node: AstNode) -> Iterator[AstNode]:
+    """Узлы поддерева node, дети раньше родителя; без рекурсии."""
+    stack = [(node, False)]
+    while stack:
+        node, visited = stack.pop()
+        if visited or not node.children:
+            yield node
+            continue
+        stack.append((node, True))
+        stack.extend((child, False) for child in reversed(node.children))
+
+
+class Tokens:
+    """Курсор по лексемам: текущая лексема (None в конце текста) и переход к следующей."""
+
+    def __init__(self, lexemes: Iterable[Lexeme]):
+        self.lexemes = iter(lexemes)
+        self.current: Lexeme | None = next(self.lexemes, None)
+
+    def __bool__(self) -> bool:
+        return self.current is not None
+
+    @property
+    def kind(self) -> Token | None:
+        return None if self.current is None else self.current[0]
+
+    @property
+    def value(self) -> str:
+        assert self.current is not None, "unexpected end of program"
+        return self.current[1]
 
+    @property
+    def line(self) -> int:
+        assert self.current is not None, "unexpected end of program"
+        return self.current[2]
 
-def match_list_and_delete(tokens: list[tuple[Token, str]], token_req: list[Token]) -> tuple[Token, str]:
+    def advance(self) -> Lexeme:
+        lexeme = self.current
+        assert lexeme is not None, "unexpected end of program"
+        self.current = next(self.lexemes, None)
+        return lexeme
+
+
+first_level_operations = frozenset((Token.PLUS, Token.MINUS))
+second_level_operations = frozenset(
+    (Token.MUL, Token.DIV, Token.AND, Token.OR, Token.XOR, Token.SHL, Token.SHR, Token.MOD)
+)
+comparisons = frozenset((Token.GE, Token.GT, Token.LE, Token.LT, Token.NEQ, Token.EQ))
+prints = frozenset((Token.PRINT_STR, Token.PRINT_INT, Token.PRINT_CHAR))
+reads = frozenset((Token.READ, Token.READ_CHAR))
+
+
+def match_list(tokens: Tokens, token_req: Collection[Token]) -> None:
+    assert tokens.kind in token_req
+
+
+def match_list_and_delete(tokens: Tokens, token_req: Collection[Token]) -> Lexeme:
     match_list(tokens, token_req)
-    return tokens.pop(0)
+    return tokens.advance()
 
 
-def parse_math_expression(tokens: list[tuple[Token, str]]) -> AstNode:
+def parse_math_expression(tokens: Tokens) -> AstNode:
     return parse_first_level_operation(tokens)
 
 
-def parse_first_level_operation(tokens: list[tuple[Token, str]]) -> AstNode:
+def parse_first_level_operation(tokens: Tokens) -> AstNode:
     left_node: AstNode = parse_second_level_operations(tokens)
     node: AstNode = left_node
-
-    while tokens and tokens[0][0] in [Token.PLUS, Token.MINUS]:
-        node = AstNode.from_token(tokens[0][0])
-        tokens.pop(0)
+    while tokens.kind in first_level_operations:
+        node = AstNode.from_token(tokens.advance()[0])
         node.add_child(left_node)
         node.add_child(parse_second_level_operations(tokens))
         left_node = node
     return node
 
 
-def parse_second_level_operations(tokens: list[tuple[Token, str]]) -> AstNode:
+def parse_second_level_operations(tokens: Tokens) -> AstNode:
     left_node: AstNode = parse_literal_or_name(tokens)
     node: AstNode = left_node
-    while tokens and tokens[0][0] in [
-        Token.MUL,
-        Token.DIV,
-        Token.AND,
-        Token.OR,
-        Token.XOR,
-        Token.SHL,
-        Token.SHR,
-        Token.MOD,
-    ]:
-        node = AstNode.from_token(tokens[0][0])
-        tokens.pop(0)
+    while tokens.kind in second_level_operations:
+        node = AstNode.from_token(tokens.advance()[0])
         node.add_child(left_node)
         node.add_child(parse_literal_or_name(tokens))
         left_node = node
     return node
 
 
-def parse_literal_or_name(tokens: list[tuple[Token, str]]) -> AstNode:
-    if tokens[0][0] == Token.NAME or tokens[0][0] == Token.NUMBER:
-        node: AstNode = AstNode.from_token(tokens[0][0], tokens[0][1])
-        tokens.pop(0)
-        return node
+def parse_literal_or_name(tokens: Tokens) -> AstNode:
+    if tokens.kind == Token.NUMBER:
+        return AstNode(AstType.NUMBER, int(tokens.advance()[1]))
+    if tokens.kind == Token.NAME:
+        return AstNode(AstType.NAME, tokens.advance()[1])
     match_list_and_delete(tokens, [Token.LPAREN])
     expression: AstNode = parse_first_level_operation(tokens)
     match_list_and_delete(tokens, [Token.RPAREN])
     return expression
 
 
-def parse_operand(tokens: list[tuple[Token, str]]) -> AstNode:
-    if tokens[0][0] == Token.STRING:
-        node: AstNode = AstNode.from_token(tokens[0][0], tokens[0][1])
-        tokens.pop(0)
-        return node
-    if tokens[0][0] == Token.READ or tokens[0][0] == Token.READ_CHAR:
+def parse_operand(tokens: Tokens) -> AstNode:
+    if tokens.kind == Token.STRING:
+        token, value, _, _ = tokens.advance()
+        return AstNode.from_token(token, value)
+    if tokens.kind in reads:
         return parse_read(tokens)
     node: AstNode = parse_math_expression(tokens)
     return node
 
 
-def parse_comparison(tokens: list[tuple[Token, str]]) -> AstNode:
+def parse_comparison(tokens: Tokens) -> AstNode:
     left_node: AstNode = parse_math_expression(tokens)
-    match_list(tokens, [Token.GE, Token.GT, Token.LE, Token.LT, Token.NEQ, Token.EQ])
-    comp: AstNode = AstNode.from_token(tokens[0][0])
-    tokens.pop(0)
+    comp: AstNode = AstNode.from_token(match_list_and_delete(tokens, comparisons)[0])
     right_node: AstNode = parse_math_expression(tokens)
     comp.add_child(left_node)
     comp.add_child(right_node)
     return comp
 
 
-def parse_while(tokens: list[tuple[Token, str]]) -> AstNode:
-    node: AstNode = AstNode.from_token(tokens[0][0])
-    match_list_and_delete(tokens, [Token.WHILE])
+def parse_while(tokens: Tokens) -> AstNode:
+    node: AstNode = AstNode.from_token(match_list_and_delete(tokens, [Token.WHILE])[0])
     match_list_and_delete(tokens, [Token.LPAREN])
     node.add_child(parse_comparison(tokens))
     match_list_and_delete(tokens, [Token.RPAREN])
@@ -158,37 +209,33 @@ def parse_while(tokens: list[tuple[Token, str]]) -> AstNode:
     return node
 
 
-def parse_if(tokens: list[tuple[Token, str]]) -> AstNode:
-    node: AstNode = AstNode.from_token(tokens[0][0])
-    match_list_and_delete(tokens, [Token.IF])
+def parse_if(tokens: Tokens) -> AstNode:
+    node: AstNode = AstNode.from_token(match_list_and_delete(tokens, [Token.IF])[0])
     match_list_and_delete(tokens, [Token.LPAREN])
     node.add_child(parse_comparison(tokens))
     match_list_and_delete(tokens, [Token.RPAREN])
     node.add_child(parse_block(tokens))
-    if tokens[0][0] == Token.ELSE:
+    if tokens.kind == Token.ELSE:
         match_list_and_delete(tokens, [Token.ELSE])
         node.add_child(parse_block(tokens))
     return node
 
 
-def parse_allocation_or_assignment(tokens: list[tuple[Token, str]]) -> AstNode:
-    if tokens[0][0] == Token.LET:
+def parse_allocation_or_assignment(tokens: Tokens) -> AstNode:
+    if tokens.kind == Token.LET:
         node: AstNode = AstNode.from_token(Token.LET)
         match_list_and_delete(tokens, [Token.LET])
     else:
         node: AstNode = AstNode.from_token(Token.ASSIGN)
-    match_list(tokens, [Token.NAME])
-    node.add_child(AstNode.from_token(Token.NAME, tokens[0][1]))
-    tokens.pop(0)
+    node.add_child(AstNode.from_token(Token.NAME, match_list_and_delete(tokens, [Token.NAME])[1]))
     match_list_and_delete(tokens, [Token.ASSIGN])
     node.add_child(parse_operand(tokens))
     match_list_and_delete(tokens, [Token.SEMICOLON])
     return node
 
 
-def parse_print(tokens: list[tuple[Token, str]]) -> AstNode:
-    node: AstNode = AstNode.from_token(tokens[0][0])
-    match_list_and_delete(tokens, [Token.PRINT_STR, Token.PRINT_INT, Token.PRINT_CHAR])
+def parse_print(tokens: Tokens) -> AstNode:
+    node: AstNode = AstNode.from_token(match_list_and_delete(tokens, prints)[0])
     match_list_and_delete(tokens, [Token.LPAREN])
     node.add_child(parse_operand(tokens))
     if node.astType == AstType.PRINT_INT:
@@ -202,38 +249,44 @@ def parse_print(tokens: list[tuple[Token, str]]) -> AstNode:
     return node
 
 
-def parse_read(tokens: list[tuple[Token, str]]) -> AstNode:
-    node: AstNode = AstNode.from_token(tokens[0][0])
-    match_list_and_delete(tokens, [Token.READ, Token.READ_CHAR])
+def parse_read(tokens: Tokens) -> AstNode:
+    node: AstNode = AstNode.from_token(match_list_and_delete(tokens, reads)[0])
     match_list_and_delete(tokens, [Token.LPAREN])
     match_list_and_delete(tokens, [Token.RPAREN])
     return node
 
 
-def parse_block(tokens: list[tuple[Token, str]]) -> AstNode:
+def parse_block(tokens: Tokens) -> AstNode:
     node: AstNode = AstNode(AstType.BLOCK)
     match_list_and_delete(tokens, [Token.LBRACE])
-    while tokens[0][0] != Token.RBRACE:
+    while tokens.kind != Token.RBRACE:
         node.add_child(parse_statement(tokens))
     match_list_and_delete(tokens, [Token.RBRACE])
     return node
 
 
-def parse_statement(tokens: list[tuple[Token, str]]) -> AstNode:
-    if tokens[0][0] == Token.WHILE:
+def parse_statement(tokens: Tokens) -> AstNode:
+    line = tokens.line
+    node = parse_statement_node(tokens)
+    node.line = line
+    return node
+
+
+def parse_statement_node(tokens: Tokens) -> AstNode:
+    if tokens.kind == Token.WHILE:
         return parse_while(tokens)
-    if tokens[0][0] == Token.IF:
+    if tokens.kind == Token.IF:
         return parse_if(tokens)
-    if tokens[0][0] == Token.LET or tokens[0][0] == Token.NAME:
+    if tokens.kind == Token.LET or tokens.kind == Token.NAME:
         return parse_allocation_or_assignment(tokens)
-    if tokens[0][0] == Token.PRINT_STR or tokens[0][0] == Token.PRINT_INT or tokens[0][0] == Token.PRINT_CHAR:
+    if tokens.kind in prints:
         return parse_print(tokens)
-    if tokens[0][0] == Token.READ:
+    if tokens.kind == Token.READ:
         return parse_read(tokens)
-    raise InvalidStatementError("Invalid statement {}".format(tokens[0][0].name))
+    raise InvalidStatementError("Invalid statement {}".format(tokens.kind.name))
 
 
-def parse_program(tokens: list[tuple[Token, str]]) -> AstNode:
+def parse_program(tokens: Tokens) -> AstNode:
     node: AstNode = AstNode(AstType.ROOT)
     while tokens:
         node.add_child(parse_statement(tokens))
@@ -241,4 +294,4 @@ def parse_program(tokens: list[tuple[Token, str]]) -> AstNode:
 
 
 def parse(program: str) -> AstNode:
-    return parse_program(lex(program))
+    return parse_program(Tokens(tokenize(program)))
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+
+from machine.blocks import branch_conditions
+from machine.isa import Opcode, Register, fused_branches
+
+from interpreter.folding import fold_constants
+from interpreter.ir import BasicBlock, Instr, IrProgram, Label
+from interpreter.loops import hoist_loop_invariants, rotate_loops
+from interpreter.parser import AstNode
+from interpreter.peephole import peephole
+from interpreter.regalloc import allocate_registers
+
+# Проходы над AST и IR и их наборы по уровням оптимизации. Проход меняет AST или IrProgram на месте;
+# проходы над AST выполняются до трансляции, над IR -- после, до перевода IR в машинный код.
+#   -O0 -- код как есть (совпадает с эталонными golden-тестами);
+#   -O1 -- свёртка констант (`interpreter.folding`), переменные в регистрах (`interpreter.regalloc`),
+#          сравнение с условным переходом -- одной инструкцией BRcc;
+#   -O2 -- ещё и вынос неизменного из циклов и поворот циклов (`interpreter.loops`), чистка графа переходов:
+#          сквозные переходы, недостижимые блоки, переходы на следующий блок, -- и оконная оптимизация
+#          после распределения регистров (`interpreter.peephole`).
+
+AstPass = Callable[[AstNode, str], None]  # с профилем системы команд, см. `machine.isa.isa_profiles`
+Pass = Callable[[IrProgram], None]
+
+
+def jump_only_target(block: BasicBlock) -> Label | None:
+    """Метка, на которую сразу переходит блок из одного JUMP."""
+    if len(block.instrs) == 1 and block.instrs[0].opcode is Opcode.JUMP:
+        return block.instrs[0].srcs[0]
+    return None
+
+
+def thread_jumps(program: IrProgram) -> None:
+    """Переход на блок из одного JUMP ведёт сразу на цель этого JUMP."""
+    block_index = program.block_index()
+    for block in program.blocks:
+        terminator = block.terminator()
+        if terminator is None or not terminator.srcs:
+            continue
+        target = terminator.srcs[0]
+        seen = {target}
+        next_target = jump_only_target(program.blocks[block_index[target]])
+        while next_target is not None and next_target not in seen:  # цикл из JUMP оставляем как есть
+            target = next_target
+            seen.add(target)
+            next_target = jump_only_target(program.blocks[block_index[target]])
+        terminator.srcs[0] = target
+
+
+def remove_unreachable_blocks(program: IrProgram) -> None:
+    block_index = program.block_index()
+    reachable = {0}
+    work = [0]
+    while work:
+        for succ in program.successors(work.pop(), block_index):
+            if succ not in reachable:
+                reachable.add(succ)
+                work.append(succ)
+    program.blocks = [block for index, block in enumerate(program.blocks) if index in reachable]
+
+
+def remove_jumps_to_next(program: IrProgram) -> None:
+    """Переход на блок, который и так исполняется следующим (пустые блоки между ними не в счёт), удаляется."""
+    block_index = program.block_index()
+    for index, block in enumerate(program.blocks):
+        terminator = block.terminator()
+        if terminator is None or terminator.opcode not in branch_conditions:
+            continue
+        next_index = index + 1
+        while next_index < len(program.blocks) and not program.blocks[next_index].instrs:
+            next_index += 1
+        target = block_index[terminator.srcs[0]]
+        if index < target <= next_index:
+            block.instrs.pop()
+
+
+branch_fusions: dict[Opcode, Opcode] = {jump: fused for fused, jump in fused_branches.items()}
+
+
+def fused_operands(block: BasicBlock, compare: Instr) -> list:
+    """Операнды сравнения; MV в регистры условия прямо перед ним удаляются из block, сравнивается их источник.
+
+    Условие if/while транслятор сравнивает как `CMP r12, r9` или `CMP_LIT r12, n` (левая часть в r12,
+    правая в r9), и после перехода r12 и r9 не читаются. Встроенные подпрограммы так не сравнивают.
+    """
+    operands = list(compare.srcs)
+    if operands[0] != Register.r12 or (compare.opcode is Opcode.CMP and operands[1] != Register.r9):
+        return operands
+    temps = set(operands) & {Register.r12, Register.r9}
+    while block.instrs and block.instrs[-1].opcode is Opcode.MV and block.instrs[-1].dst in temps:
+        move = block.instrs.pop()
+        temps.discard(move.dst)
+        operands = [move.srcs[0] if src == move.dst else src for src in operands]
+    return operands
+
+
+def fuse_branches(program: IrProgram) -> None:
+    """CMP или CMP_LIT и условный переход за ним -> BRcc (после распределения регистров)."""
+    for block in program.blocks:
+        terminator = block.terminator()
+        if terminator is None or terminator.opcode not in branch_fusions or len(block.instrs) < 2:
+            continue
+        compare = block.instrs[-2]
+        if compare.opcode not in (Opcode.CMP, Opcode.CMP_LIT):
+            continue
+        del block.instrs[-2:]
+        operands = fused_operands(block, compare)
+        fused = branch_fusions[terminator.opcode]
+        block.instrs.append(Instr(fused, None, [terminator.srcs[0], *operands], terminator.location))
+
+
+ast_pipelines: dict[int, list[AstPass]] = {
+    0: [],
+    1: [fold_constants],
+    2: [fold_constants, hoist_loop_invariants],
+}
+
+pipelines: dict[int, list[Pass]] = {
+    0: [],
+    1: [allocate_registers, fuse_branches],
+    2: [
+        thread_jumps,
+        remove_unreachable_blocks,
+        rotate_loops,
+        remove_jumps_to_next,
+        allocate_registers,
+        fuse_branches,
+        peephole,
+    ],
+}
+
+
+def run_ast_passes(root: AstNode, opt_level: int, isa: str = "base") -> None:
+    for ast_pass in ast_pipelines[opt_level]:
+        ast_pass(root, isa)
+
+
+def run_passes(program: IrProgram, opt_level: int) -> None:
+    for ir_pass in pipelines[opt_level]:
+        ir_pass(program)
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+
+from machine.emulator import instruction_ticks
+from machine.isa import Opcode
+
+from interpreter.ir import BasicBlock, Instr, IrProgram
+
+# Оконная оптимизация (peephole) IR после распределения регистров (с уровня оптимизации 2).
+#
+# Правило смотрит на окно из нескольких подряд идущих инструкций блока и возвращает замену или None.
+# Окно может заходить на первую инструкцию следующего блока, если в него проваливается исполнение;
+# тогда замена должна оставить эту инструкцию как есть -- на неё переходят и из других мест.
+# После замены окна проверяются с предыдущей инструкции, пока ни одно правило не сработает.
+# Флаги портят и удаляемые MV, PUSH, POP, но условный переход транслятор ставит сразу за CMP.
+#
+# Сэкономленное каждым правилом копится в `IrProgram.stats`: инструкции и такты (по `instruction_ticks`,
+# по одному исполнению каждой инструкции).
+
+Rule = Callable[[list[Instr]], list[Instr] | None]
+
+# инструкции, которые только пишут свой dst
+pure_writes = (Opcode.LD_LIT, Opcode.MV, Opcode.LD_STACK)
+
+
+def push_pop(window: list[Instr]) -> list[Instr] | None:
+    """PUSH a; POP b -> MV a, b (ничего, если a -- это b)."""
+    push, pop = window
+    if push.opcode is not Opcode.PUSH or pop.opcode is not Opcode.POP:
+        return None
+    if push.srcs[0] == pop.dst:
+        return []
+    return [Instr(Opcode.MV, pop.dst, [push.srcs[0]], pop.location)]
+
+
+def self_move(window: list[Instr]) -> list[Instr] | None:
+    """MV a, a."""
+    (move,) = window
+    if move.opcode is Opcode.MV and move.dst == move.srcs[0]:
+        return []
+    return None
+
+
+def dead_write(window: list[Instr]) -> list[Instr] | None:
+    """Запись в регистр, который следующая инструкция перезаписывает, не читая."""
+    first, second = window
+    if first.opcode not in pure_writes or second.opcode not in pure_writes:
+        return None
+    if first.dst != second.dst or first.dst in second.registers():
+        return None
+    return [second]
+
+
+def store_load(window: list[Instr]) -> list[Instr] | None:
+    """ST_STACK a, s; LD_STACK b, s -> ST_STACK a, s; MV a, b."""
+    store, load = window
+    if store.opcode is not Opcode.ST_STACK or load.opcode is not Opcode.LD_STACK:
+        return None
+    if store.srcs[1] != load.srcs[0]:
+        return None
+    return [store, Instr(Opcode.MV, load.dst, [store.srcs[0]], load.location)]
+
+
+def move_back(window: list[Instr]) -> list[Instr] | None:
+    """MV a, b; MV b, a -> MV a, b."""
+    first, second = window
+    if first.opcode is not Opcode.MV or second.opcode is not Opcode.MV:
+        return None
+    if first.dst != second.srcs[0] or second.dst != first.srcs[0]:
+        return None
+    return [first]
+
+
+# имя -> (размер окна, правило)
+rules: dict[str, tuple[int, Rule]] = {
+    "push-pop": (2, push_pop),
+    "self-move": (1, self_move),
+    "dead-write": (2, dead_write),
+    "store-load": (2, store_load),
+    "move-back": (2, move_back),
+}
+
+
+def ticks(instrs: list[Instr]) -> int:
+    return sum(instruction_ticks[instr.opcode] for instr in instrs)
+
+
+def record(program: IrProgram, name: str, window: list[Instr], replacement: list[Instr]) -> None:
+    instructions, saved_ticks = program.stats.get(name, (0, 0))
+    program.stats[name] = (
+        instructions + len(window) - len(replacement),
+        saved_ticks + ticks(window) - ticks(replacement),
+    )
+
+
+def apply_rule(program: IrProgram, block: BasicBlock, index: int, tail: Instr | None) -> bool:
+    """Заменить окно с инструкции index по первому сработавшему правилу."""
+    for name, (size, rule) in rules.items():
+        window = block.instrs[index : index + size]
+        if len(window) < size and tail is not None:
+            window.append(tail)
+        replacement = rule(window) if len(window) == size else None
+        if replacement is None:
+            continue
+        if index + size > len(block.instrs):  # окно заходит на tail
+            if replacement[-1:] != [tail]:
+                continue
+            replacement = replacement[:-1]
+        record(program, name, window[: len(block.instrs) - index], replacement)
+        block.instrs[index : index + size] = replacement
+        return True
+    return False
+
+
+def rewrite_block(program: IrProgram, block: BasicBlock, tail: Instr | None) -> bool:
+    """Применять правила к окнам блока; tail -- первая инструкция блока, в который блок проваливается."""
+    changed = False
+    index = 0
+    while index < len(block.instrs):
+        if apply_rule(program, block, index, tail):
+            changed = True
+            index = max(index - 1, 0)
+        else:
+            index += 1
+    return changed
+
+
+def fall_through_instr(program: IrProgram, index: int) -> Instr | None:
+    """Первая инструкция, исполняемая за блоком index, если блок в неё проваливается."""
+    if not program.blocks[index].falls_through():
+        return None
+    for next_index in range(index + 1, len(program.blocks)):
+        if program.blocks[next_index].instrs:
+            return program.blocks[next_index].instrs[0]
+    return None
+
+
+def peephole(program: IrProgram) -> None:
+    changed = True
+    while changed:
+        changed = False
+        for index, block in enumerate(program.blocks):
+            changed |= rewrite_block(program, block, fall_through_instr(program, index))
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+from machine.isa import Opcode, Register, VirtualRegister
+
+from interpreter.ir import Instr, IrProgram
+
+# Распределение регистров для переменных (с уровня оптимизации 1).
+#
+# Транслятор обращается к переменной только через MV с виртуальным регистром: `MV %x, rT` -- чтение,
+# `MV rT, %x` -- запись. По графу базовых блоков IR считается живучесть переменных на каждой инструкции,
+# затем линейным сканированием (Poletto, Sarkar) переменным назначаются регистры r1-r8. Встроенные
+# подпрограммы (умножение, деление, ввод) сохраняют используемые ими r2-r8 на стеке, r1 транслятор не трогает.
+# Если регистров не хватает, вытесняется переменная с самым дальним концом интервала живучести:
+# она остаётся в своём слоте стека, и MV с ней становятся LD_STACK/ST_STACK. Записи в переменные,
+# которые дальше не читаются, удаляются.
+
+home_registers: list[Register] = [Register(reg_num) for reg_num in range(1, 9)]
+
+
+def instruction_successors(program: IrProgram) -> list[list[int]]:
+    """Номера инструкций (в порядке размещения), куда может перейти исполнение после каждой инструкции."""
+    blocks = program.blocks
+    total = sum(len(block.instrs) for block in blocks)
+    starts = [total] * (len(blocks) + 1)  # первая инструкция блока; пустой блок -- первая инструкция следующего
+    position = total
+    for index in range(len(blocks) - 1, -1, -1):
+        position -= len(blocks[index].instrs)
+        starts[index] = position if blocks[index].instrs else starts[index + 1]
+    block_index = program.block_index()
+    result: list[list[int]] = []
+    for index, block in enumerate(blocks):
+        result += [[starts[index] + offset + 1] for offset in range(len(block.instrs) - 1)]
+        if block.instrs:
+            targets = [starts[succ] for succ in program.successors(index, block_index)]
+            result.append([target for target in targets if target < total])
+    return result
+
+
+def uses_and_defs(instrs: list[Instr], numbers: dict[VirtualRegister, int]) -> tuple[list[int], list[int]]:
+    """Битовые маски читаемых и записываемых инструкцией переменных."""
+    uses = [0] * len(instrs)
+    defs = [0] * len(instrs)
+    for addr, instr in enumerate(instrs):
+        for arg in (instr.dst, *instr.srcs):
+            if isinstance(arg, VirtualRegister):
+                assert instr.opcode is Opcode.MV, "Virtual register outside MV: {}".format(instr.opcode)
+                numbers.setdefault(arg, len(numbers))
+        if isinstance(instr.dst, VirtualRegister):
+            defs[addr] |= 1 << numbers[instr.dst]
+        elif instr.opcode is Opcode.MV and isinstance(instr.srcs[0], VirtualRegister):
+            uses[addr] |= 1 << numbers[instr.srcs[0]]
+    return uses, defs
+
+
+def liveness(successors: list[list[int]], uses: list[int], defs: list[int]) -> tuple[list[int], list[int]]:
+    """Живые на входе и на выходе каждой инструкции переменные, обратный анализ до неподвижной точки."""
+    live_in = [0] * len(successors)
+    live_out = [0] * len(successors)
+    changed = True
+    while changed:
+        changed = False
+        for addr in range(len(successors) - 1, -1, -1):
+            out = 0
+            for succ in successors[addr]:
+                out |= live_in[succ]
+            live_out[addr] = out
+            new_in = uses[addr] | (out & ~defs[addr])
+            if new_in != live_in[addr]:
+                live_in[addr] = new_in
+                changed = True
+    return live_in, live_out
+
+
+def intervals(live_in: list[int], defs: list[int], count: int) -> list[tuple[int, int]]:
+    """Интервал живучести каждой переменной: первая и последняя инструкция, где она жива или пишется."""
+    bounds = [(-1, -1)] * count
+    for addr, live in enumerate(live_in):
+        live |= defs[addr]
+        number = 0
+        while live:
+            if live & 1:
+                start, _ = bounds[number]
+                bounds[number] = (addr if start < 0 else start, addr)
+            live >>= 1
+            number += 1
+    return bounds
+
+
+def linear_scan(bounds: list[tuple[int, int]]) -> dict[int, Register]:
+    """Номер переменной -> регистр; вытесненных переменных в результате нет."""
+    assignment: dict[int, Register] = {}
+    active: list[int] = []
+    free = list(home_registers)
+    for number in sorted(range(len(bounds)), key=lambda n: bounds[n]):
+        start, end = bounds[number]
+        if start < 0:
+            continue
+        for other in [other for other in active if bounds[other][1] < start]:
+            active.remove(other)
+            free.append(assignment[other])
+        if free:
+            free.sort(key=lambda reg: reg.value)
+            assignment[number] = free.pop(0)
+            active.append(number)
+            continue
+        spilled = max(active, key=lambda n: bounds[n][1])
+        if bounds[spilled][1] > end:
+            assignment[number] = assignment.pop(spilled)
+            active.remove(spilled)
+            active.append(number)
+    return assignment
+
+
+def rewrite_access(instr: Instr, home: Register | None) -> None:
+    """MV с переменной -> MV с её регистром или, если переменная вытеснена, обращение к её слоту стека."""
+    if isinstance(instr.dst, VirtualRegister):
+        if home is None:
+            instr.opcode, instr.dst, instr.srcs = Opcode.ST_STACK, None, [instr.srcs[0], instr.dst.slot]
+        else:
+            instr.dst = home
+    elif home is None:
+        instr.opcode, instr.srcs = Opcode.LD_STACK, [instr.srcs[0].slot]
+    else:
+        instr.srcs[0] = home
+
+
+def allocate_registers(program: IrProgram) -> None:
+    """Заменить виртуальные регистры переменных физическими регистрами или слотами стека."""
+    instrs = list(program.instructions())
+    numbers: dict[VirtualRegister, int] = {}
+    uses, defs = uses_and_defs(instrs, numbers)
+    live_in, live_out = liveness(instruction_successors(program), uses, defs)
+    assignment = linear_scan(intervals(live_in, defs, len(numbers)))
+
+    dead: set[Instr] = set()
+    for addr, instr in enumerate(instrs):
+        if isinstance(instr.dst, VirtualRegister) and not live_out[addr] >> numbers[instr.dst] & 1:
+            dead.add(instr)
+        elif defs[addr] or uses[addr]:
+            vreg = instr.dst if defs[addr] else instr.srcs[0]
+            rewrite_access(instr, assignment.get(numbers[vreg]))
+    for block in program.blocks:
+        block.instrs = [instr for instr in block.instrs if instr not in dead]
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from machine.emulator import instruction_ticks
+from machine.isa import Opcode, Register
+
+from interpreter.folding import evaluate, hardware_opcode
+from interpreter.parser import AstType
+
+# Умножение, деление и остаток на число без встроенных подпрограмм (с уровня оптимизации 1).
+#
+# Умножение на число -- сдвиги и сложения по схеме Горнера над цифрами множителя: двоичными или
+# знаковыми (NAF, цифры -1, 0, 1). Умножает машина не на само число, а на то, что посчитала бы
+# подпрограмма (см. `interpreter.folding`), при отрицательном множителе подпрограмма остаётся.
+# Деление и остаток на степень двойки -- SHR и AND; делимое у подпрограммы деления не отрицательное,
+# на отрицательном она не завершается. На другие числа делит подпрограмма: умножение на обратное
+# требует старшей половины 64-битного произведения, а такой инструкции у машины нет.
+#
+# С расширенной системой команд умножение на число -- ещё и MUL_LIT, деление и остаток -- DIV и MOD:
+# они округляют к нулю, а SHR -- вниз, поэтому на степень двойки тоже делит DIV.
+#
+# Из вариантов последовательности выбирается самый дешёвый по тактам (`instruction_ticks`).
+
+Instruction = tuple[Opcode, Register, int | Register]
+
+
+def ticks(instructions: list[Instruction]) -> int:
+    return sum(instruction_ticks[opcode] for opcode, _, _ in instructions)
+
+
+def binary_digits(number: int) -> list[int]:
+    """Двоичные цифры, от старшей."""
+    return [int(bit) for bit in bin(number)[2:]]
+
+
+def signed_digits(number: int) -> list[int]:
+    """Несмежная знаковая запись (NAF): цифры -1, 0, 1 от старшей, ненулевые не стоят рядом."""
+    digits = []
+    while number:
+        digit = 2 - number % 4 if number % 2 else 0
+        digits.append(digit)
+        number = (number - digit) // 2
+    return digits[::-1]
+
+
+def shift_left(acc: Register, amount: int, scratch: Register | None) -> list[Instruction]:
+    """Сдвиг acc на amount: сложениями с собой или через регистр scratch, что дешевле."""
+    doubling: list[Instruction] = [(Opcode.ADD, acc, acc)] * amount
+    if scratch is None:
+        return doubling
+    shifting: list[Instruction] = [(Opcode.LD_LIT, scratch, amount), (Opcode.SHL, acc, scratch)]
+    return min(doubling, shifting, key=ticks)
+
+
+def horner(digits: list[int], acc: Register, copy: Register, scratch: Register | None) -> list[Instruction]:
+    """acc * число с цифрами digits (старшая -- 1); copy -- регистр для исходного acc."""
+    code: list[Instruction] = []
+    shift = 0
+    for digit in digits[1:]:
+        shift += 1
+        if digit:
+            code += shift_left(acc, shift, scratch)
+            code.append((Opcode.ADD if digit > 0 else Opcode.SUB, acc, copy))
+            shift = 0
+    code += shift_left(acc, shift, scratch)
+    if any(opcode in (Opcode.ADD, Opcode.SUB) and arg2 == copy for opcode, _, arg2 in code):
+        code.insert(0, (Opcode.MV, acc, copy))
+    return code
+
+
+def multiply(multiplier: int, regs: list[Register]) -> list[Instruction]:
+    """regs[0] * multiplier на регистрах regs."""
+    if multiplier == 0:
+        return [(Opcode.LD_LIT, regs[0], 0)]
+    scratch = regs[2] if len(regs) > 2 else None
+    candidates = [horner(digits(multiplier), regs[0], regs[1], scratch) for digits in (binary_digits, signed_digits)]
+    return min(candidates, key=ticks)
+
+
+def divide(divisor: int, remainder: bool, regs: list[Register]) -> list[Instruction] | None:
+    """regs[0] / divisor или regs[0] % divisor, если делитель -- степень двойки."""
+    if divisor <= 0 or divisor & (divisor - 1):
+        return None
+    if remainder:
+        return [(Opcode.LD_LIT, regs[1], divisor - 1), (Opcode.AND, regs[0], regs[1])]
+    if divisor == 1:
+        return []
+    return [(Opcode.LD_LIT, regs[1], divisor.bit_length() - 1), (Opcode.SHR, regs[0], regs[1])]
+
+
+def hardware_multiply(multiplier: int, regs: list[Register]) -> list[Instruction]:
+    """regs[0] * multiplier: MUL_LIT или, если дешевле, сдвиги и сложения."""
+    code: list[Instruction] = [(Opcode.MUL_LIT, regs[0], multiplier)]
+    if multiplier < 0:
+        return code
+    return min(code, multiply(multiplier, regs), key=ticks)
+
+
+def reduce_operation(
+    operation: AstType, constant: int, regs: list[Register], isa: str = "base"
+) -> list[Instruction] | None:
+    """Инструкции для `regs[0] <операция> constant` или None, если нужна подпрограмма или инструкция с регистром.
+
+    Портятся только regs, их должно быть не меньше двух.
+    """
+    if hardware_opcode(operation, isa) is not None:
+        return hardware_multiply(constant, regs) if operation == AstType.MUL else None
+    if operation == AstType.MUL:
+        multiplier = evaluate(AstType.MUL, 1, constant)
+        return None if multiplier is None else multiply(multiplier, regs)
+    return divide(constant, operation == AstType.MOD, regs)
@@ -1,10 +1,17 @@
 from __future__ import annotations
 
-import sys
+import argparse
+from collections.abc import Callable
+from functools import partial
 
-from machine.isa import Opcode, Register, StaticMemAddressStub, Word, write_code
+from machine.debuginfo import DebugInfo, SourceLocation, debug_filename, write_debug_info
+from machine.isa import Opcode, Register, StaticMemAddressStub, VirtualRegister, Word, isa_profiles, write_code
 
-from interpreter.parser import AstNode, AstType, parse
+from interpreter.folding import constant_value, hardware_opcode
+from interpreter.ir import BasicBlock, Instr, IrProgram, Label
+from interpreter.parser import AstNode, AstType, parse, postorder
+from interpreter.passes import pipelines, run_ast_passes, run_passes
+from interpreter.strength import reduce_operation
 
 
 class WrongTokenTypeError(Exception):
@@ -40,15 +47,25 @@ condition_inverted = {
 
 
 class Program:
-    def __init__(self):
-        self.machine_code: list[Word] = []
+    def __init__(self, opt_level: int = 0, isa: str = "base"):
+        self.opt_level = opt_level  # см. `interpreter.passes.pipelines`
+        self.isa = isa  # профиль системы команд, см. `machine.isa.isa_profiles`
+        self.ir = IrProgram()
+        self.machine_code: list[Word] = []  # заполняется из ir в `lower`
+        self.locations: list[SourceLocation] = []  # по месту в исходном тексте на каждое слово machine_code
+        self.location = SourceLocation()  # оператор, который сейчас транслируется
         self.current_command_address = 0  # адрес последней команды, в 4байтовых байтах
         self.static_mem: list[int] = []
         self.current_static_offset = 0  # оффсет следующей переменной от начала статической памяти
+        self.interned: dict[str, int] = {}  # строка -> её оффсет (с уровня оптимизации 1)
+        self.static_saved = 0  # слов статической памяти, сэкономленных на одинаковых строках
         self.variables: dict[str, int] = {}  # переменные и их адрес(оффсет на самом деле)
         self.reg_to_var: dict[Register, str] = {}
         self.var_to_reg: dict[str, Register] = {}
         self.reg_counter = 2
+        self.slot_vregs: dict[int, VirtualRegister] = {}  # смещение переменной -> её виртуальный регистр
+        self.frame_size = 0  # слотов переменных в стеке (с уровня оптимизации 1), см. `frame_size`
+        self.routine_calls: dict[str, list[Instr]] = {}  # подпрограмма -> её вызовы, см. `runtime_call`
         self.prog_size = 4096
         self.input_buffer_size = 32
 
@@ -57,10 +74,25 @@ class Program:
         opcode: Opcode,
         arg1: int | Register | StaticMemAddressStub = 0,
         arg2: int | Register | StaticMemAddressStub = 0,
-    ) -> int:
-        self.machine_code.append(Word(self.current_command_address, opcode, arg1, arg2))
+        arg3: int | None = None,
+    ) -> Instr:
+        return self.ir.append(Instr.from_args(opcode, arg1, arg2, self.location, arg3))
+
+    def new_label(self) -> Label:
+        return self.ir.new_label()
+
+    def place_label(self, label: Label) -> None:
+        self.ir.place(label)
+
+    def lower(self) -> None:
+        """Перевести IR в машинный код, адреса -- с 0."""
+        self.machine_code, self.locations = self.ir.to_words()
+        self.current_command_address = len(self.machine_code)
+
+    def _add_data_word(self, value: int) -> None:
+        self.machine_code.append(Word(self.current_command_address, Opcode.JUMP, value, 0))
+        self.locations.append(self.location)
         self.current_command_address += 1
-        return self.current_command_address - 1
 
     def _add_data(self, value: int):
         self.static_mem.append(value)
@@ -68,9 +100,19 @@ class Program:
 
     def push_variable_in_stack(self, name: str, value: int):
         addr: int = len(self.variables)
-        reg = self.clear_register_for_variable()
-        self.add_instruction(Opcode.LD_LIT, reg, value)
-        self.add_instruction(Opcode.PUSH, reg)
+        if self.opt_level:
+            # слот рассчитан заранее и sp уже ниже него: переменной нужен только виртуальный регистр,
+            # из него она вытесняется в слот
+            assert addr < self.frame_size, "Variable {} outside of the stack frame".format(name)
+            self.slot_vregs[addr] = VirtualRegister(name, addr)
+            reg = Register.r9 if value else Register.r0
+            if value:
+                self.add_instruction(Opcode.LD_LIT, reg, value)
+            self.add_instruction(Opcode.MV, reg, self.slot_vregs[addr])
+        else:
+            reg = self.clear_register_for_variable()
+            self.add_instruction(Opcode.LD_LIT, reg, value)
+            self.add_instruction(Opcode.PUSH, reg)
         self.variables[name] = addr
         return addr
 
@@ -82,9 +124,25 @@ class Program:
                 vars_to_del.append(name)
         for name in vars_to_del:
             self.variables.pop(name)
-        self.add_instruction(Opcode.LD_LIT, Register.r15, self.prog_size - 1 - stack_offset_before_block)
+        if not self.opt_level:
+            self.add_instruction(Opcode.LD_LIT, Register.r15, self.prog_size - 1 - stack_offset_before_block)
+
+    def allocate_frame(self, statements: list[AstNode]) -> None:
+        """Поставить sp под слоты всех переменных программы: дальше переменным не нужны PUSH и сброс sp."""
+        self.frame_size = frame_size(statements)
+        if self.frame_size:
+            self.add_instruction(Opcode.LD_LIT, Register.r15, self.prog_size - 1 - self.frame_size)
 
     def add_variable_in_static_mem(self, value: str) -> int:
+        """Оффсет строки в статической памяти; с уровня оптимизации 1 одинаковые строки хранятся один раз.
+
+        Строки в программе не меняются, поэтому общая копия безопасна. Хвост одной строки другую не заменяет:
+        перед строкой -- её длина, а перед хвостом -- символ.
+        """
+        if self.opt_level and value in self.interned:
+            self.static_saved += len(value) + 1
+            return self.interned[value]
+        self.interned[value] = self.current_static_offset
         size = len(value)
         self._add_data(size)
         for char in value:
@@ -105,10 +163,11 @@ class Program:
 
     def resolve_static_mem(self) -> None:
         self._add_strings_in_static_mem()
+        self.location = SourceLocation(0, "data")
         for data in self.static_mem:
-            self.add_instruction(Opcode.JUMP, data)
+            self._add_data_word(data)
         static_mem_end = self.current_command_address - 1
-        self.add_instruction(Opcode.JUMP, self.current_command_address + 1)  # begin of read buffer
+        self._add_data_word(self.current_command_address + 1)  # begin of read buffer
         for instruction in self.machine_code:
             if isinstance(instruction.arg1, StaticMemAddressStub) and instruction.arg1.offset < 0:
                 instruction.arg1 = -instruction.arg1.offset + static_mem_end
@@ -128,7 +187,9 @@ class Program:
         self.var_to_reg.pop(var, None)
         return reg
 
-    def load_variable(self, var_name: str) -> Register:
+    def load_variable(self, var_name: str) -> Register | VirtualRegister:
+        if self.opt_level:
+            return self.slot_vregs[self.variables[var_name]]
         reg = self.var_to_reg.get(var_name)
         if reg is not None:
             return reg
@@ -139,6 +200,22 @@ class Program:
         self.reg_to_var[reg] = var_name
         return reg
 
+    def load_slot(self, offset: int, reg: Register) -> None:
+        """Прочитать в reg переменную со смещением offset."""
+        vreg = self.slot_vregs.get(offset) if self.opt_level else None
+        if vreg is None:
+            self.add_instruction(Opcode.LD_STACK, reg, offset)
+        else:
+            self.add_instruction(Opcode.MV, vreg, reg)
+
+    def store_slot(self, reg: Register, offset: int) -> None:
+        """Записать reg в переменную со смещением offset."""
+        vreg = self.slot_vregs.get(offset) if self.opt_level else None
+        if vreg is None:
+            self.add_instruction(Opcode.ST_STACK, reg, offset)
+        else:
+            self.add_instruction(Opcode.MV, reg, vreg)
+
     def clear_variable_in_registers(self, name: str) -> None:
         reg: Register | None = self.var_to_reg.get(name)
         if reg is not None:
@@ -150,16 +227,53 @@ class Program:
         self.var_to_reg.clear()
 
 
-def ast_to_machine_code(root: AstNode) -> list[Word]:
-    program = Program()
+def ast_to_program(root: AstNode, opt_level: int = 0, isa: str = "base") -> Program:
+    program = Program(opt_level, isa)
+    run_ast_passes(root, opt_level, isa)
+    if opt_level:
+        program.allocate_frame(root.children)
     for child in root.children:
         ast_to_machine_code_rec(child, program)
     program.add_instruction(Opcode.HALT)
+    emit_runtime_routines(program)
+    run_passes(program.ir, opt_level)
+    program.lower()
     program.resolve_static_mem()
-    return program.machine_code
+    return program
+
+
+def frame_size(statements: list[AstNode]) -> int:
+    """Слотов стека для переменных операторов statements и вложенных блоков.
+
+    Переменная получает слот по числу переменных объемлющих блоков, объявленных до неё, поэтому блоки,
+    которые не вложены друг в друга, занимают одни и те же слоты.
+    """
+    size = declared = 0
+    for statement in statements:
+        if statement.astType == AstType.LET:
+            declared += 1
+        elif statement.astType == AstType.IF or statement.astType == AstType.WHILE:
+            size = max(size, declared + frame_size(statement.children[1].children))
+        elif statement.astType == AstType.BLOCK:
+            size = max(size, declared + frame_size(statement.children))
+        size = max(size, declared)
+    return size
+
+
+def ast_to_machine_code(root: AstNode, opt_level: int = 0, isa: str = "base") -> list[Word]:
+    return ast_to_program(root, opt_level, isa).machine_code
 
 
 def ast_to_machine_code_rec(node: AstNode, program: Program) -> None:
+    outer = program.location
+    program.location = outer.enter(node.line, node.astType.value, node.astType == AstType.WHILE)
+    try:
+        ast_to_machine_code_statement(node, program)
+    finally:
+        program.location = outer
+
+
+def ast_to_machine_code_statement(node: AstNode, program: Program) -> None:
     if node.astType == AstType.WHILE or node.astType == AstType.IF:
         ast_to_machine_code_if_or_while(node, program)
     elif node.astType == AstType.LET:
@@ -168,13 +282,142 @@ def ast_to_machine_code_rec(node: AstNode, program: Program) -> None:
         ast_to_machine_code_assign(node, program)
     elif node.astType == AstType.PRINT_STR or node.astType == AstType.PRINT_INT or node.astType == AstType.PRINT_CHAR:
         ast_to_machine_code_print(node, program)
+    elif node.astType == AstType.BLOCK:
+        ast_to_machine_code_scope(node, program)
     else:
         raise WrongTokenTypeError("Invalid ast node type {}".format(node.astType.name))
 
 
-def ast_to_machine_code_math(node: AstNode, program: Program) -> None:
-    if not ast_to_machine_code_math_rec(node, program):
+# регистры для вычисления выражений с -O1; результат -- в первом
+expression_registers: list[Register] = [Register.r9, Register.r10, Register.r11, Register.r12]
+
+
+def ast_to_machine_code_math(node: AstNode, program: Program, regs: list[Register] = expression_registers) -> None:
+    """Вычислить выражение в r9; с -O1 портятся только regs."""
+    if program.opt_level:
+        ast_to_machine_code_expr(node, program, regs)
+    elif not ast_to_machine_code_math_rec(node, program):
+        program.add_instruction(Opcode.POP, Register.r9)
+
+
+# шаг вычисления выражения: функция, которая добавляет инструкции, или подвыражение с тем, куда его вычислить
+Step = Callable[[], object] | tuple
+
+
+def run_steps(first: Step, expand: Callable[..., list[Step]]) -> None:
+    """Выполнить шаги по стеку, а не рекурсией (глубина выражения не ограничена); expand раскладывает подвыражение."""
+    steps = [first]
+    while steps:
+        step = steps.pop()
+        if callable(step):
+            step()
+        else:
+            steps.extend(reversed(expand(*step)))
+
+
+def register_needs(node: AstNode) -> dict[int, int]:
+    """Числа Сети-Ульмана подвыражений (по id): сколько регистров нужно, чтобы вычислить их без стека."""
+    needs: dict[int, int] = {}
+    for current in postorder(node):
+        if not current.children:
+            needs[id(current)] = 1
+            continue
+        left, right = (needs[id(child)] for child in current.children)
+        needs[id(current)] = left + 1 if left == right else max(left, right)
+    return needs
+
+
+def ast_to_machine_code_expr(node: AstNode, program: Program, regs: list[Register]) -> None:
+    """Вычислить выражение в regs[0], портятся только regs.
+
+    Сначала вычисляется операнд, которому нужно больше регистров (Сети-Ульман); на стек
+    промежуточный результат кладётся, только если второму операнду не хватает оставшихся регистров.
+    """
+    needs = register_needs(node)
+    run_steps((node, regs), lambda current, current_regs: expression_steps(current, program, current_regs, needs))
+
+
+def expression_steps(node: AstNode, program: Program, regs: list[Register], needs: dict[int, int]) -> list[Step]:
+    if node.astType == AstType.NUMBER:
+        return [partial(program.add_instruction, Opcode.LD_LIT, regs[0], node.value)]
+    if node.astType == AstType.NAME:
+        return [partial(program.add_instruction, Opcode.MV, program.load_variable(node.value), regs[0])]
+    if node.astType in (AstType.MUL, AstType.DIV, AstType.MOD):
+        reduced = reduced_steps(node, program, regs)
+        if reduced is not None:
+            return reduced
+    steps = operand_steps(node, program, regs, needs)
+    opcode = machine_opcode(node.astType, program)
+    if opcode is None:
+        steps.append(partial(ast_to_machine_code_routine, node, program, regs))
+    else:
+        steps.append(partial(program.add_instruction, opcode, regs[0], regs[1]))
+    return steps
+
+
+def machine_opcode(operation: AstType, program: Program) -> Opcode | None:
+    """Инструкция для операции или None, если операцию выполняет встроенная подпрограмма."""
+    return ast_type2opcode.get(operation) or hardware_opcode(operation, program.isa)
+
+
+def reduced_steps(node: AstNode, program: Program, regs: list[Register]) -> list[Step] | None:
+    """Умножение, деление, остаток на число сдвигами и сложениями (`interpreter.strength`), если можно."""
+    left, right = node.children
+    if right.astType != AstType.NUMBER:
+        return None
+    code = reduce_operation(node.astType, right.value, regs, program.isa)
+    if code is None:
+        return None
+    steps: list[Step] = []
+    if code[-1:] != [(Opcode.LD_LIT, regs[0], 0)]:  # результат не зависит от левого операнда
+        steps.append((left, regs))
+    return steps + [partial(program.add_instruction, *instruction) for instruction in code]
+
+
+def operand_steps(node: AstNode, program: Program, regs: list[Register], needs: dict[int, int]) -> list[Step]:
+    """Левый операнд -- в regs[0], правый -- в regs[1]."""
+    left, right = node.children
+    left_first = needs[id(left)] >= needs[id(right)]
+    first, second = (left, right) if left_first else (right, left)
+    first_regs = regs if left_first else [regs[1], regs[0], *regs[2:]]
+    if needs[id(second)] < len(regs):
+        return [(first, first_regs), (second, first_regs[1:])]
+    return [
+        (first, first_regs),
+        partial(program.add_instruction, Opcode.PUSH, first_regs[0]),
+        (second, [first_regs[1], first_regs[0], *first_regs[2:]]),
+        partial(program.add_instruction, Opcode.POP, first_regs[0]),
+    ]
+
+
+def ast_to_machine_code_routine(node: AstNode, program: Program, regs: list[Register]) -> None:
+    """Умножение, деление, остаток встроенной подпрограммой: операнды в r9 и r10, результат в r9.
+
+    Подпрограмма сохраняет r11 и r12, а r9 и r10, если в них значения объемлющего выражения, сохраняются здесь.
+    """
+    saved = [reg for reg in (Register.r9, Register.r10) if reg not in regs]
+    for reg in saved:
+        program.add_instruction(Opcode.PUSH, reg)
+    left, right = regs[0], regs[1]
+    if (left, right) == (Register.r10, Register.r9):
+        program.add_instruction(Opcode.PUSH, Register.r10)
+        program.add_instruction(Opcode.MV, Register.r9, Register.r10)
         program.add_instruction(Opcode.POP, Register.r9)
+    elif right is Register.r9:
+        program.add_instruction(Opcode.MV, right, Register.r10)
+        program.add_instruction(Opcode.MV, left, Register.r9)
+    else:
+        move_register(program, left, Register.r9)
+        move_register(program, right, Register.r10)
+    perform_userspace_math(node, program)
+    move_register(program, Register.r9, left)
+    for reg in reversed(saved):
+        program.add_instruction(Opcode.POP, reg)
+
+
+def move_register(program: Program, reg_from: Register, reg_to: Register) -> None:
+    if reg_from is not reg_to:
+        program.add_instruction(Opcode.MV, reg_from, reg_to)
 
 
 def resolve_register_for_operation(is_left: bool = True) -> Register:
@@ -183,34 +426,53 @@ def resolve_register_for_operation(is_left: bool = True) -> Register:
 
 #  returns True if no arythm
 def ast_to_machine_code_math_rec(node: AstNode, program: Program, is_left: bool = True) -> bool:
+    run_steps((node, is_left), lambda current, current_is_left: stack_math_steps(current, program, current_is_left))
+    return not node.children
+
+
+def stack_math_steps(node: AstNode, program: Program, is_left: bool) -> list[Step]:
+    """Шаги вычисления через стек (уровень оптимизации 0): операнды -- в r9 и r10, результат -- на стек."""
     if node.astType == AstType.NUMBER:
-        program.add_instruction(Opcode.LD_LIT, resolve_register_for_operation(is_left), int(node.value))
-        return True
+        return [partial(program.add_instruction, Opcode.LD_LIT, resolve_register_for_operation(is_left), node.value)]
     if node.astType == AstType.NAME:
-        reg = program.load_variable(node.value)
-        program.add_instruction(Opcode.MV, reg, resolve_register_for_operation(is_left))
-        return True
-    if ast_to_machine_code_math_rec(node.children[0], program, True):
-        program.add_instruction(Opcode.PUSH, Register.r9)
-    if ast_to_machine_code_math_rec(node.children[1], program, False):
-        program.add_instruction(Opcode.PUSH, Register.r10)
-    program.add_instruction(Opcode.POP, Register.r10)
-    program.add_instruction(Opcode.POP, Register.r9)
+        return [partial(load_name, program, node.value, resolve_register_for_operation(is_left))]
+    left, right = node.children
+    steps: list[Step] = [(left, True)]
+    if not left.children:
+        steps.append(partial(program.add_instruction, Opcode.PUSH, Register.r9))
+    steps.append((right, False))
+    if not right.children:
+        steps.append(partial(program.add_instruction, Opcode.PUSH, Register.r10))
+    return [
+        *steps,
+        partial(program.add_instruction, Opcode.POP, Register.r10),
+        partial(program.add_instruction, Opcode.POP, Register.r9),
+        partial(stack_operation, node, program),
+        partial(program.add_instruction, Opcode.PUSH, Register.r9),
+    ]
+
+
+def load_name(program: Program, name: str, target: Register) -> None:
+    reg = program.load_variable(name)
+    program.add_instruction(Opcode.MV, reg, target)
+
+
+def stack_operation(node: AstNode, program: Program) -> None:
     if not perform_userspace_math(node, program):
-        program.add_instruction(ast_type2opcode[node.astType], Register.r9, Register.r10)
-    program.add_instruction(Opcode.PUSH, Register.r9)
-    return False
+        program.add_instruction(machine_opcode(node.astType, program), Register.r9, Register.r10)
 
 
 def perform_userspace_math(node: AstNode, program: Program) -> bool:
+    if machine_opcode(node.astType, program) is not None:
+        return False
     if node.astType is AstType.DIV:
-        ast_to_machine_code_div(node, program)
+        runtime_call(program, "div")
         return True
     if node.astType is AstType.MOD:
         ast_to_machine_code_mod(node, program)
         return True
     if node.astType is AstType.MUL:
-        ast_to_machine_code_mul(program)
+        runtime_call(program, "mul")
         return True
     return False
 
@@ -225,22 +487,24 @@ def ast_to_machine_code_mul(program: Program):
     program.add_instruction(Opcode.LD_LIT, Register.r5, 0)
     program.add_instruction(Opcode.LD_LIT, Register.r3, 1)
 
-    loop_start = program.add_instruction(Opcode.CMP, Register.r10, Register.r0)
-    loop_jump = program.add_instruction(Opcode.JE, 0)
+    loop_start, after_if, after_loop = program.new_label(), program.new_label(), program.new_label()
+    program.place_label(loop_start)
+    program.add_instruction(Opcode.CMP, Register.r10, Register.r0)
+    program.add_instruction(Opcode.JE, after_loop)
     program.add_instruction(Opcode.MV, Register.r10, Register.r12)
     program.add_instruction(Opcode.ADD, Register.r12, Register.r3)
     program.add_instruction(Opcode.CMP, Register.r12, Register.r0)
-    if_statement = program.add_instruction(Opcode.JE, 0)
+    program.add_instruction(Opcode.JE, after_if)
     program.add_instruction(Opcode.MV, Register.r9, Register.r4)
     program.add_instruction(Opcode.SHL, Register.r4, Register.r5)
     program.add_instruction(Opcode.ADD, Register.r11, Register.r4)
     program.add_instruction(Opcode.INC, Register.r5)
-    after_if = program.add_instruction(Opcode.SHR, Register.r10, Register.r3)
-    program.machine_code[if_statement].arg1 = after_if
+    program.place_label(after_if)
+    program.add_instruction(Opcode.SHR, Register.r10, Register.r3)
     program.add_instruction(Opcode.JUMP, loop_start)
 
-    after_loop = program.add_instruction(Opcode.MV, Register.r11, Register.r9)
-    program.machine_code[loop_jump].arg1 = after_loop
+    program.place_label(after_loop)
+    program.add_instruction(Opcode.MV, Register.r11, Register.r9)
     program.add_instruction(Opcode.POP, Register.r12)
     program.add_instruction(Opcode.POP, Register.r11)
     program.add_instruction(Opcode.POP, Register.r5)
@@ -248,8 +512,8 @@ def ast_to_machine_code_mul(program: Program):
     program.add_instruction(Opcode.POP, Register.r3)
 
 
-def ast_to_machine_code_div(node: AstNode, program: Program) -> int:
-    prog_begin = program.add_instruction(Opcode.PUSH, Register.r2)  # r_addr
+def ast_to_machine_code_div(program: Program) -> None:
+    program.add_instruction(Opcode.PUSH, Register.r2)  # r_addr
     program.add_instruction(Opcode.PUSH, Register.r3)  # q_addr
     program.add_instruction(Opcode.PUSH, Register.r4)  # bits_num_addr
     program.add_instruction(Opcode.PUSH, Register.r11)  # tmp
@@ -262,31 +526,40 @@ def ast_to_machine_code_div(node: AstNode, program: Program) -> int:
 
     program.add_instruction(Opcode.PUSH, Register.r9)
 
-    loop_start = program.add_instruction(Opcode.CMP, Register.r9, Register.r0)  # in r4 количество бит в N
-    program.add_instruction(Opcode.JE, loop_start + 5)
+    count_start, count_end = program.new_label(), program.new_label()
+    program.place_label(count_start)
+    program.add_instruction(Opcode.CMP, Register.r9, Register.r0)  # in r4 количество бит в N
+    program.add_instruction(Opcode.JE, count_end)
     program.add_instruction(Opcode.SHR, Register.r9, Register.r12)
     program.add_instruction(Opcode.INC, Register.r4)
-    program.add_instruction(Opcode.JUMP, loop_start)
+    program.add_instruction(Opcode.JUMP, count_start)
 
+    program.place_label(count_end)
     program.add_instruction(Opcode.DEC, Register.r4)
     program.add_instruction(Opcode.POP, Register.r9)
-    loop_start = program.add_instruction(Opcode.CMP, Register.r4, Register.r0)
-    program.add_instruction(Opcode.JL, loop_start + 16)
+    loop_start, loop_end = program.new_label(), program.new_label()
+    program.place_label(loop_start)
+    program.add_instruction(Opcode.CMP, Register.r4, Register.r0)
+    program.add_instruction(Opcode.JL, loop_end)
     program.add_instruction(Opcode.SHL, Register.r2, Register.r12)
     program.add_instruction(Opcode.MV, Register.r9, Register.r11)
     program.add_instruction(Opcode.SHR, Register.r11, Register.r4)
     program.add_instruction(Opcode.AND, Register.r11, Register.r12)
     program.add_instruction(Opcode.ADD, Register.r2, Register.r11)
 
-    if_begin = program.add_instruction(Opcode.CMP, Register.r2, Register.r10)
-    program.add_instruction(Opcode.JL, if_begin + 6)
+    else_begin, after_if = program.new_label(), program.new_label()
+    program.add_instruction(Opcode.CMP, Register.r2, Register.r10)
+    program.add_instruction(Opcode.JL, else_begin)
     program.add_instruction(Opcode.SUB, Register.r2, Register.r10)
     program.add_instruction(Opcode.SHL, Register.r3, Register.r12)
     program.add_instruction(Opcode.ADD, Register.r3, Register.r12)
-    program.add_instruction(Opcode.JUMP, if_begin + 7)
+    program.add_instruction(Opcode.JUMP, after_if)
+    program.place_label(else_begin)
     program.add_instruction(Opcode.SHL, Register.r3, Register.r12)  # else
+    program.place_label(after_if)
     program.add_instruction(Opcode.DEC, Register.r4)
     program.add_instruction(Opcode.JUMP, loop_start)
+    program.place_label(loop_end)
     program.add_instruction(Opcode.MV, Register.r3, Register.r9)
     program.add_instruction(Opcode.MV, Register.r2, Register.r10)
 
@@ -295,67 +568,89 @@ def ast_to_machine_code_div(node: AstNode, program: Program) -> int:
     program.add_instruction(Opcode.POP, Register.r4)
     program.add_instruction(Opcode.POP, Register.r3)
     program.add_instruction(Opcode.POP, Register.r2)
-    return prog_begin
 
 
 def ast_to_machine_code_mod(node: AstNode, program: Program):
-    ast_to_machine_code_div(node, program)
+    runtime_call(program, "div")
     program.add_instruction(Opcode.MV, Register.r10, Register.r9)
 
 
-def ast_to_machine_code_block(node: AstNode, program: Program) -> int:
+def ast_to_machine_code_block(node: AstNode, program: Program) -> None:
     for child in node.children:
         ast_to_machine_code_rec(child, program)
-    return program.current_command_address
 
 
-def ast_to_machine_code_if_or_while(node: AstNode, program: Program) -> None:
+def ast_to_machine_code_scope(node: AstNode, program: Program) -> None:
+    """Блок как оператор (тело if с условием, истинным при трансляции): свои переменные, без переходов."""
     program.drop_variables_in_registers()
     block_begin_stack_pointer: int = len(program.variables)
-    comparator = node.children[0]
-    block_begin: int = program.current_command_address
+    ast_to_machine_code_block(node, program)
+    program.drop_variables_in_registers()
+    program.return_from_block(block_begin_stack_pointer)
+
+
+def ast_to_machine_code_condition(comparator: AstNode, program: Program, skip_block: Label) -> None:
+    """Сравнение и переход на skip_block, если условие ложно."""
     addr_left = parse_expression(comparator.children[0], program)
     if addr_left is None:
         program.add_instruction(Opcode.MV, Register.r9, Register.r12)
     else:
-        program.add_instruction(Opcode.LD_STACK, Register.r12, addr_left)
-    addr_right = parse_expression(comparator.children[1], program)
-    if addr_right is not None:
-        program.add_instruction(Opcode.LD_STACK, Register.r9, addr_right)
+        program.load_slot(addr_left, Register.r12)
+    literal = constant_value(comparator.children[1]) if program.opt_level else None
+    if literal is not None:  # с числом сравнивает CMP_LIT, без загрузки в r9
+        program.add_instruction(Opcode.CMP_LIT, Register.r12, literal)
+    else:
+        addr_right = parse_expression(comparator.children[1], program, expression_registers[:3])  # левое -- в r12
+        if addr_right is not None:
+            program.load_slot(addr_right, Register.r9)
+        program.add_instruction(Opcode.CMP, Register.r12, Register.r9)
+    program.add_instruction(condition_inverted[ast_type2opcode[comparator.astType]], skip_block)
 
-    program.add_instruction(Opcode.CMP, Register.r12, Register.r9)
-    comp_instr_addr = program.add_instruction(condition_inverted[ast_type2opcode[comparator.astType]], -1)
-    block_end = ast_to_machine_code_block(node.children[1], program)
 
+def ast_to_machine_code_if_or_while(node: AstNode, program: Program) -> None:
+    program.drop_variables_in_registers()
+    block_begin_stack_pointer: int = len(program.variables)
+    block_begin, skip_block = program.new_label(), program.new_label()
+    program.place_label(block_begin)
+    ast_to_machine_code_condition(node.children[0], program, skip_block)
+    ast_to_machine_code_block(node.children[1], program)
+
+    # после if переход ведёт за восстановление sp (LD_LIT r15) в return_from_block
+    after_block: Label | None = skip_block
     if node.astType == AstType.WHILE:
-        block_end = program.add_instruction(Opcode.JUMP, block_begin)
-        program.machine_code[comp_instr_addr].arg1 = block_end + 1
-    else:
-        if len(node.children) == 3 and node.children[2].astType == AstType.ELSE:
-            addr_before_else_block = program.add_instruction(Opcode.JUMP, -1)
-            else_block_end = ast_to_machine_code_block(node.children[1], program)
-            program.machine_code[comp_instr_addr].arg1 = addr_before_else_block + 1  # else start address
-            program.machine_code[addr_before_else_block].arg1 = else_block_end + 1
-        else:
-            program.machine_code[comp_instr_addr].arg1 = block_end + 1
+        program.add_instruction(Opcode.JUMP, block_begin)
+        program.place_label(skip_block)
+        after_block = None
+    elif len(node.children) == 3 and node.children[2].astType == AstType.ELSE:
+        after_block = program.new_label()
+        program.add_instruction(Opcode.JUMP, after_block)
+        program.place_label(skip_block)  # else start address
+        ast_to_machine_code_block(node.children[1], program)
     program.drop_variables_in_registers()
     program.return_from_block(block_begin_stack_pointer)
+    if after_block is not None:
+        program.place_label(after_block)
 
 
 def ast_to_machine_code_read(program: Program) -> None:
+    if program.opt_level:
+        ast_to_machine_code_read_block(program)
+        return
     program.add_instruction(Opcode.PUSH, Register.r8)
     program.add_instruction(Opcode.LD_LIT, Register.r9, 0)  # прочитанный символ
     program.add_instruction(Opcode.LD_LIT, Register.r11, 0)  # счетчик
     program.add_instruction(Opcode.LD_ADDR, Register.r8, StaticMemAddressStub(-1))
     program.add_instruction(Opcode.MV, Register.r8, Register.r12)  # в r8 адрес начала буфера
-    do_while_start = program.current_command_address
+    do_while_start, do_while_end = program.new_label(), program.new_label()
+    program.place_label(do_while_start)
     program.add_instruction(Opcode.READ, Register.r9, 0)
     program.add_instruction(Opcode.CMP, Register.r9, Register.r0)
-    program.add_instruction(Opcode.JE, do_while_start + 7)
+    program.add_instruction(Opcode.JE, do_while_end)
     program.add_instruction(Opcode.INC, Register.r11)
     program.add_instruction(Opcode.INC, Register.r12)
     program.add_instruction(Opcode.ST, Register.r9, Register.r12)
     program.add_instruction(Opcode.JUMP, do_while_start)
+    program.place_label(do_while_end)
     program.add_instruction(Opcode.ST, Register.r11, Register.r8)
     program.add_instruction(Opcode.MV, Register.r8, Register.r9)  # save read string address in r9
     program.add_instruction(Opcode.ADD, Register.r8, Register.r11)
@@ -364,15 +659,30 @@ def ast_to_machine_code_read(program: Program) -> None:
     program.add_instruction(Opcode.POP, Register.r8)
 
 
+def ast_to_machine_code_read_block(program: Program) -> None:
+    """Строка из ввода одной инструкцией READ_BLOCK -- до свободного места перед стеком."""
+    program.add_instruction(Opcode.LD_ADDR, Register.r9, StaticMemAddressStub(-1))  # адрес строки -- её длина
+    program.add_instruction(Opcode.MV, Register.r9, Register.r12)
+    program.add_instruction(Opcode.INC, Register.r12)  # первый символ
+    program.add_instruction(Opcode.MV, Register.r15, Register.r11)  # до sp
+    program.add_instruction(Opcode.SUB, Register.r11, Register.r12)
+    program.add_instruction(Opcode.READ_BLOCK, Register.r12, Register.r11, 0)  # r12 -- за последним символом
+    program.add_instruction(Opcode.MV, Register.r12, Register.r11)
+    program.add_instruction(Opcode.SUB, Register.r11, Register.r9)
+    program.add_instruction(Opcode.DEC, Register.r11)
+    program.add_instruction(Opcode.ST, Register.r11, Register.r9)
+    program.add_instruction(Opcode.ST_ADDR, Register.r12, StaticMemAddressStub(-1))
+
+
 def ast_to_machine_code_read_char(program: Program) -> None:
     program.add_instruction(Opcode.READ, Register.r9, 0)
 
 
 # util func, сохранение значения по адресу(оба не в регистрах)
 def st_literal_by_stack_offset(program: Program, value: int | StaticMemAddressStub, var_addr: int):
-    reg: Register = program.clear_register_for_variable()
+    reg: Register = Register.r9 if program.opt_level else program.clear_register_for_variable()
     program.add_instruction(Opcode.LD_LIT, reg, value)
-    program.add_instruction(Opcode.ST_STACK, reg, var_addr)
+    program.store_slot(reg, var_addr)
 
 
 def ast_to_machine_code_assign(node: AstNode, program: Program) -> None:
@@ -387,15 +697,15 @@ def ast_to_machine_code_assign(node: AstNode, program: Program) -> None:
             program.clear_variable_in_registers(name)
         elif node.children[1].astType == AstType.READ:
             ast_to_machine_code_read(program)
-            program.add_instruction(Opcode.ST_STACK, Register.r9, addr)  # update var value
+            program.store_slot(Register.r9, addr)  # update var value
             program.clear_variable_in_registers(name)
         elif node.children[1].astType == AstType.READ_CHAR:
             ast_to_machine_code_read_char(program)
-            program.add_instruction(Opcode.ST_STACK, Register.r9, addr)
+            program.store_slot(Register.r9, addr)
             program.clear_variable_in_registers(name)
         else:
             ast_to_machine_code_math(node.children[1], program)
-            program.add_instruction(Opcode.ST_STACK, Register.r9, addr)
+            program.store_slot(Register.r9, addr)
             program.clear_variable_in_registers(name)
 
 
@@ -410,26 +720,7 @@ def ast_to_machine_code_let(node: AstNode, program: Program) -> None:
 def ast_to_machine_code_print(node: AstNode, program: Program) -> None:
     if node.astType == AstType.PRINT_INT:
         ast_to_machine_code_math(node.children[0], program)
-        program.add_instruction(Opcode.PUSH, Register.r11)
-        program.add_instruction(Opcode.LD_LIT, Register.r11, 1)
-        loop_begin = program.add_instruction(Opcode.LD_LIT, Register.r10, 10)
-        ast_to_machine_code_div(node, program)
-        program.add_instruction(Opcode.ADD_LIT, Register.r10, 48)
-        cmp_addr = program.add_instruction(Opcode.CMP, Register.r9, Register.r0)
-        program.add_instruction(Opcode.JE, cmp_addr + 5)
-        program.add_instruction(Opcode.INC, Register.r11)
-        program.add_instruction(Opcode.PUSH, Register.r10)
-        program.add_instruction(Opcode.JUMP, loop_begin)
-
-        program.add_instruction(Opcode.PUSH, Register.r10)  # даже если 0, последний остаток надо записывать
-
-        loop_begin = program.add_instruction(Opcode.CMP, Register.r11, Register.r0)
-        program.add_instruction(Opcode.JE, loop_begin + 6)
-        program.add_instruction(Opcode.POP, Register.r10)
-        program.add_instruction(Opcode.PRINT, Register.r10, 0)
-        program.add_instruction(Opcode.DEC, Register.r11)
-        program.add_instruction(Opcode.JUMP, loop_begin)
-        program.add_instruction(Opcode.POP, Register.r11)
+        runtime_call(program, "print_int")
     if node.astType == AstType.PRINT_STR:
         if node.children[0].astType == AstType.STRING:
             str_addr = program.add_variable_in_static_mem(node.children[0].value)
@@ -437,40 +728,161 @@ def ast_to_machine_code_print(node: AstNode, program: Program) -> None:
         else:
             var_addr: int | None = program.get_variable_offset(node.children[0].value)
             assert var_addr is not None
-            program.add_instruction(Opcode.LD_STACK, Register.r9, var_addr)
+            program.load_slot(var_addr, Register.r9)
         program.add_instruction(Opcode.MV, Register.r9, Register.r11)
         program.add_instruction(Opcode.INC, Register.r11)  # первый байт данных
         program.add_instruction(Opcode.LD, Register.r9, Register.r9)  # теперь в r9 размер
+        if program.opt_level:
+            program.add_instruction(Opcode.PRINT_BLOCK, Register.r11, Register.r9, 0)
+            return
         program.add_instruction(Opcode.LD_LIT, Register.r10, 0)  # счётчик
-        while_start: int = program.current_command_address
+        while_start, while_end = program.new_label(), program.new_label()
+        program.place_label(while_start)
         program.add_instruction(Opcode.CMP, Register.r9, Register.r10)
-        program.add_instruction(Opcode.JE, while_start + 7)
+        program.add_instruction(Opcode.JE, while_end)
         program.add_instruction(Opcode.INC, Register.r10)
         program.add_instruction(Opcode.LD, Register.r12, Register.r11)
         program.add_instruction(Opcode.PRINT, Register.r12, 0)
         program.add_instruction(Opcode.INC, Register.r11)
         program.add_instruction(Opcode.JUMP, while_start)
+        program.place_label(while_end)
     if node.astType == AstType.PRINT_CHAR:
         ast_to_machine_code_math(node.children[0], program)
         program.add_instruction(Opcode.PRINT, Register.r9, 0)
 
 
-def parse_expression(node: AstNode, program: Program) -> int | None:
+def ast_to_machine_code_print_int(program: Program) -> None:
+    program.add_instruction(Opcode.PUSH, Register.r11)
+    program.add_instruction(Opcode.LD_LIT, Register.r11, 1)
+    loop_begin, last_digit = program.new_label(), program.new_label()
+    program.place_label(loop_begin)
+    program.add_instruction(Opcode.LD_LIT, Register.r10, 10)
+    ast_to_machine_code_divmod(program)
+    program.add_instruction(Opcode.ADD_LIT, Register.r10, 48)
+    program.add_instruction(Opcode.CMP, Register.r9, Register.r0)
+    program.add_instruction(Opcode.JE, last_digit)
+    program.add_instruction(Opcode.INC, Register.r11)
+    program.add_instruction(Opcode.PUSH, Register.r10)
+    program.add_instruction(Opcode.JUMP, loop_begin)
+
+    program.place_label(last_digit)
+    program.add_instruction(Opcode.PUSH, Register.r10)  # даже если 0, последний остаток надо записывать
+
+    loop_begin, loop_end = program.new_label(), program.new_label()
+    program.place_label(loop_begin)
+    program.add_instruction(Opcode.CMP, Register.r11, Register.r0)
+    program.add_instruction(Opcode.JE, loop_end)
+    program.add_instruction(Opcode.POP, Register.r10)
+    program.add_instruction(Opcode.PRINT, Register.r10, 0)
+    program.add_instruction(Opcode.DEC, Register.r11)
+    program.add_instruction(Opcode.JUMP, loop_begin)
+    program.place_label(loop_end)
+    program.add_instruction(Opcode.POP, Register.r11)
+
+
+def ast_to_machine_code_divmod(program: Program) -> None:
+    """Частное r9 / r10 в r9, остаток в r10: подпрограммой деления или, если есть, инструкциями DIV и MOD."""
+    if hardware_opcode(AstType.DIV, program.isa) is None:
+        runtime_call(program, "div")
+        return
+    program.add_instruction(Opcode.MV, Register.r9, Register.r12)
+    program.add_instruction(Opcode.MOD, Register.r12, Register.r10)
+    program.add_instruction(Opcode.DIV, Register.r9, Register.r10)
+    program.add_instruction(Opcode.MV, Register.r12, Register.r10)
+
+
+# встроенные подпрограммы: операнды и результат в r9 и r10, остальные используемые регистры сохраняются на стеке
+runtime_routines: dict[str, Callable[[Program], None]] = {
+    "mul": ast_to_machine_code_mul,
+    "div": ast_to_machine_code_div,
+    "print_int": ast_to_machine_code_print_int,
+}
+
+
+def runtime_call(program: Program, name: str) -> None:
+    """Встроенная подпрограмма: с -O1 -- CALL её копии (см. `emit_runtime_routines`), иначе -- её код на месте."""
+    if not program.opt_level:
+        runtime_routines[name](program)
+        return
+    calls = program.routine_calls.setdefault(name, [])
+    label = calls[0].srcs[0] if calls else program.ir.new_label(name)
+    calls.append(program.add_instruction(Opcode.CALL, label))
+
+
+def emit_runtime_routines(program: Program) -> None:
+    """Разместить вызванные подпрограммы за HALT, по копии с RET в конце на каждую.
+
+    Подпрограмма, которую вызывают из одного места, переносится на место вызова без CALL и RET:
+    общая копия уменьшает код, только если вызовов несколько.
+    """
+    program.location = SourceLocation(0, "runtime")
+    bodies: dict[str, list[BasicBlock]] = {}
+    while len(bodies) < len(program.routine_calls):  # подпрограмма может вызвать ещё не размещённую
+        name, calls = list(program.routine_calls.items())[len(bodies)]
+        start = len(program.ir.blocks)  # последний блок кончается HALT или RET, метка начнёт новый
+        program.place_label(calls[0].srcs[0])
+        runtime_routines[name](program)
+        program.add_instruction(Opcode.RET)
+        bodies[name] = program.ir.blocks[start:]
+    for name, calls in program.routine_calls.items():
+        if len(calls) == 1:
+            inline_routine(program.ir, bodies[name], calls[0])
+
+
+def inline_routine(ir: IrProgram, body: list[BasicBlock], call: Instr) -> None:
+    """Перенести блоки подпрограммы на место единственного вызова call, убрав CALL и RET."""
+    blocks = [block for block in ir.blocks if block not in body]
+    index = next(index for index, block in enumerate(blocks) if block.instrs[-1:] == [call])
+    blocks[index].instrs.pop()
+    body[-1].instrs.pop()
+    for block in body:
+        for instr in block.instrs:
+            instr.location = call.location
+    blocks[index + 1 : index + 1] = body
+    ir.blocks = blocks
+
+
+def parse_expression(node: AstNode, program: Program, regs: list[Register] = expression_registers) -> int | None:
     if node.astType == AstType.NAME:
         return program.get_variable_offset(node.value)
     if node.astType == AstType.STRING:
         return program.add_variable_in_static_mem(node.value)
-    return ast_to_machine_code_math(node, program)
+    return ast_to_machine_code_math(node, program, regs)
+
+
+def translate(source: str, opt_level: int = 0, isa: str = "base") -> list[Word]:
+    """Исходный текст -> машинный код."""
+    return ast_to_machine_code(parse(source), opt_level, isa)
+
 
+def main(source, target, binary=False, opt_level=0, stats=False, isa="base"):
+    """Транслировать source в target; место в исходном тексте каждого слова пишется рядом, в `<target>.dbg`.
 
-def main(source, target):
+    stats -- напечатать, сколько инструкций и тактов сэкономило каждое правило оконной оптимизации
+    и сколько слов статической памяти -- хранение одинаковых строк один раз;
+    isa -- профиль системы команд: с "extended" умножение, деление и остаток -- инструкции MUL, DIV, MOD.
+    """
     with open(source, encoding="utf-8") as f:
         source = f.read()
-    ast = parse(source)
-    write_code(target, ast_to_machine_code(ast))
+    program = ast_to_program(parse(source), opt_level, isa)
+    write_code(target, program.machine_code, binary)
+    write_debug_info(debug_filename(target), DebugInfo(source.splitlines(), program.locations))
+    if stats:
+        print("{:<12} {:>12} {:>12}".format("rule", "instructions", "ticks"))
+        for rule, (instructions, ticks) in program.ir.stats.items():
+            print("{:<12} {:>12} {:>12}".format(rule, instructions, ticks))
+        print("static words saved by interning: {}".format(program.static_saved))
 
 
 if __name__ == "__main__":
-    assert len(sys.argv) == 2, "Wrong arguments: translator.py <input_file> <target_file>"
-    source, target = sys.argv
-    main(source, target)
+    parser = argparse.ArgumentParser(description="Translator")
+    parser.add_argument("source", help="source file")
+    parser.add_argument("target", help="machine code file")
+    parser.add_argument(
+        "-O", dest="opt_level", type=int, default=0, choices=sorted(pipelines), help="optimization level"
+    )
+    parser.add_argument("--binary", action="store_true", help="write a binary object file instead of JSON")
+    parser.add_argument("--stats", action="store_true", help="print instructions, ticks and static words saved")
+    parser.add_argument("--isa", default="base", choices=sorted(isa_profiles), help="instruction set profile")
+    args = parser.parse_args()
+    main(args.source, args.target, args.binary, args.opt_level, args.stats, args.isa)
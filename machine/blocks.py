@@ -0,0 +1,369 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+from typing import ClassVar
+
+from machine.isa import Opcode, Register, Word, fused_branches
+from machine.memory import Memory
+
+binary_expressions: dict[Opcode, str] = {
+    Opcode.ADD: "{a} + {b}",
+    Opcode.OR: "{a} | {b}",
+    Opcode.AND: "{a} & {b}",
+    Opcode.XOR: "{a} ^ {b}",
+    Opcode.SHR: "{a} >> {b}",
+    Opcode.SHL: "(0 if {a} == 0 else {a} << {b})",
+    Opcode.SUB: "{a} + (~{b} + 1)",
+    Opcode.MUL: "{a} * {b}",
+    Opcode.DIV: "divide({a}, {b})",
+    Opcode.MOD: "remainder({a}, {b})",
+}
+
+unary_expressions: dict[Opcode, str] = {
+    Opcode.INC: "{a} + 1",
+    Opcode.DEC: "{a} - 1",
+    Opcode.NEG: "~{a}",
+}
+
+branch_conditions: dict[Opcode, str] = {
+    Opcode.JUMP: "True",
+    Opcode.JE: "zero",
+    Opcode.JNE: "not zero",
+    Opcode.JG: "not neg",
+    Opcode.JGE: "not neg or zero",
+    Opcode.JL: "neg",
+    Opcode.JLE: "neg or zero",
+}
+
+# опкоды, у которых оба аргумента -- регистры
+register_pairs: set[Opcode] = {Opcode.LD, Opcode.ST, Opcode.MV, Opcode.CMP} | set(binary_expressions)
+
+# опкоды, у которых регистр только первый аргумент
+single_registers: set[Opcode] = {Opcode.LD_LIT, Opcode.PUSH, Opcode.POP} | set(unary_expressions)
+
+# опкоды с регистром и числом
+register_and_number: set[Opcode] = {
+    Opcode.LD_ADDR,
+    Opcode.LD_STACK,
+    Opcode.ST_ADDR,
+    Opcode.ST_STACK,
+    Opcode.READ,
+    Opcode.PRINT,
+    Opcode.ADD_LIT,
+    Opcode.MUL_LIT,
+    Opcode.CMP_LIT,
+}
+
+
+# переходы в подпрограмму и возврат: завершают блок, адрес возврата -- на стеке
+subroutine_jumps: set[Opcode] = {Opcode.CALL, Opcode.RET}
+
+
+class CompiledBlock:
+    function: Callable[[], int]
+    start: int
+    end: int  # адрес после последней инструкции блока
+    length: int
+
+    def __init__(self, function: Callable[[], int], start: int, end: int):
+        self.function = function
+        self.start = start
+        self.end = end
+        self.length = end - start
+
+
+class BlockCompiler:
+    """Компилятор линейных участков машинного кода в функции Python.
+
+    Блок начинается с адреса входа и продолжается до перехода, `CALL` или `RET` (включительно), до `HALT`,
+    до известной цели перехода или до инструкции, которую нельзя скомпилировать (не включительно).
+    Функция блока держит регистры в локальных переменных, в конце записывает изменённые
+    регистры, `pc`, флаги и такты в модель процессора и возвращает число исполненных инструкций.
+    Если запись в память попала в ещё не исполненную часть блока, блок завершается сразу после неё.
+    """
+
+    max_length: int = 64
+
+    def __init__(
+        self,
+        memory: Memory,
+        instruction_ticks: dict[Opcode, int],
+        branch_ticks: dict[Opcode, tuple[int, int]],
+        namespace: dict,
+    ):
+        self.memory = memory
+        self.instruction_ticks = instruction_ticks
+        self.branch_ticks = branch_ticks
+        self.namespace = namespace
+        self.leaders: set[int] = set()
+
+    def compile(self, start: int) -> CompiledBlock | None:
+        """Вернуть блок, начинающийся с адреса start, или None, если его нельзя скомпилировать."""
+        builder = _BlockBuilder(start, self.instruction_ticks, self.branch_ticks)
+        addr = start
+        while addr < len(self.memory) and builder.count < self.max_length:
+            if addr != start and addr in self.leaders:
+                break
+            word: Word = self.memory[addr]
+            if not compilable(word):
+                break
+            if not builder.add(addr, word):
+                break
+            if word.opcode in branch_conditions or word.opcode in fused_branches or word.opcode is Opcode.CALL:
+                self.leaders.add(word.arg1)
+                self.leaders.add(addr + 1)
+            addr += 1
+        if builder.count == 0:
+            return None
+        source = builder.source(addr)
+        namespace = dict(self.namespace)
+        exec(compile(source, "<block {}>".format(start), "exec"), namespace)
+        return CompiledBlock(namespace["block"], start, addr)
+
+
+def compilable(word: Word) -> bool:
+    if word.opcode in branch_conditions or word.opcode is Opcode.CALL:
+        return isinstance(word.arg1, int)
+    if word.opcode in fused_branches:
+        return isinstance(word.arg1, int) and isinstance(word.arg2, Register) and isinstance(word.arg3, Register | int)
+    if word.opcode in register_pairs:
+        return isinstance(word.arg1, Register) and isinstance(word.arg2, Register)
+    if word.opcode in register_and_number:
+        return isinstance(word.arg1, Register) and isinstance(word.arg2, int)
+    if word.opcode is Opcode.RET:
+        return True
+    return word.opcode in single_registers and isinstance(word.arg1, Register)
+
+
+def literal(value) -> str:
+    if isinstance(value, Register):
+        return "REG[{}]".format(value.value)
+    return repr(value)
+
+
+class _BlockBuilder:
+    def __init__(self, start: int, instruction_ticks: dict[Opcode, int], branch_ticks: dict[Opcode, tuple[int, int]]):
+        self.start = start
+        self.instruction_ticks = instruction_ticks
+        self.branch_ticks = branch_ticks
+        self.lines: list[str] = []
+        self.inputs: set[int] = set()  # регистры, прочитанные до записи в блоке
+        self.defined: set[int] = set()
+        self.dirty: set[int] = set()
+        self.dr: str | None = None  # dr после выборки, пока его никто не читал
+        self.alu_set = False
+        self.count = 0
+        self.ticks = 0
+        self.addr = start
+        self.closed = False
+
+    def emit(self, line: str) -> None:
+        self.lines.append("    " + line)
+
+    def reg(self, reg: Register) -> str:
+        if reg.value == 13:
+            self.emit("r13 = {}".format(self.addr))
+            self.defined.add(13)
+        elif reg.value == 14 and self.dr is not None:
+            self.emit("r14 = {}".format(self.dr))
+            self.dr = None
+            self.defined.add(14)
+        elif reg.value not in self.defined:
+            self.inputs.add(reg.value)
+            self.defined.add(reg.value)
+        return "r{}".format(reg.value)
+
+    def target(self, reg: Register) -> str:
+        if reg.value == 14:
+            self.dr = None
+        self.defined.add(reg.value)
+        self.dirty.add(reg.value)
+        return "r{}".format(reg.value)
+
+    def exit_lines(self, pc: str, ticks: int, count: int, indent: str = "    ") -> list[str]:
+        lines = ["regs[{n}] = r{n}".format(n=n) for n in sorted(self.dirty - {13, 14})]
+        lines.append("regs[14] = {}".format("r14" if self.dr is None else self.dr))
+        if self.alu_set:
+            lines.append("cu.alu_value = alu")
+        lines += ["regs[13] = {}".format(pc), "cu._tick += {}".format(ticks), "return {}".format(count)]
+        return [indent + line for line in lines]
+
+    def check_write(self, addr_expr: str) -> None:
+        # выход из блока, если запись попала в его ещё не исполненную часть
+        self.emit("if {next} <= {addr} < __END__ or {addr} < 0:".format(next=self.addr + 1, addr=addr_expr))
+        self.lines += self.exit_lines(str(self.addr + 1), self.ticks, self.count, "        ")
+
+    def add(self, addr: int, word: Word) -> bool:
+        """Добавить инструкцию в блок. Вернуть False, если она не входит в блок."""
+        if self.closed or word.opcode is Opcode.HALT:
+            return False
+        self.addr = addr
+        self.count += 1
+        self.dr = literal(word.arg1)  # выборка защёлкивает arg1 в dr
+        if word.opcode in fused_branches:
+            self.compare(word.arg2, word.arg3)
+        if word.opcode in branch_conditions or word.opcode in fused_branches:
+            self.branch(word.opcode, word.arg1)
+            self.closed = True
+            return True
+        self.ticks += self.instruction_ticks[word.opcode]
+        self.instruction(word.opcode, word.arg1, word.arg2)
+        if word.opcode in subroutine_jumps:
+            self.closed = True
+        elif 13 in self.dirty:
+            # запись в pc -- переход на pc + 1, как в потактовой модели
+            self.lines += self.exit_lines("r13 + 1", self.ticks, self.count)
+            self.closed = True
+        return True
+
+    def instruction(self, opcode: Opcode, arg1, arg2) -> None:
+        if opcode in binary_expressions:
+            a, b = self.reg(arg1), self.reg(arg2)
+            self.emit("alu = {} = {}".format(self.target(arg1), binary_expressions[opcode].format(a=a, b=b)))
+            self.alu_set = True
+        elif opcode in unary_expressions:
+            a = self.reg(arg1)
+            self.emit("alu = {} = {}".format(self.target(arg1), unary_expressions[opcode].format(a=a)))
+            self.alu_set = True
+        else:
+            self.emitters[opcode](self, arg1, arg2)
+
+    def ld_addr(self, reg, addr):
+        self.emit("{} = {} = read({})".format(self.target(Register.r14), self.target(reg), addr))
+
+    def ld_lit(self, reg, val):
+        self.emit("{} = {}".format(self.target(reg), literal(val)))
+
+    def ld(self, reg_to, addr_reg):
+        self.emit("alu = {}".format(self.reg(addr_reg)))
+        self.emit("{} = {} = read(alu)".format(self.target(Register.r14), self.target(reg_to)))
+        self.alu_set = True
+
+    def ld_stack(self, reg_to, offset):
+        self.emit("{} = {} = read(mem_size - {} - 1)".format(self.target(Register.r14), self.target(reg_to), offset))
+
+    def st_addr(self, reg, addr):
+        self.emit("alu = {} = {}".format(self.target(Register.r14), self.reg(reg)))
+        self.emit("write({}, alu)".format(addr))
+        self.alu_set = True
+        self.check_write(str(addr))
+
+    def st(self, data_reg, addr_reg):
+        data = self.reg(data_reg)
+        self.emit("{} = {}".format(self.target(Register.r14), data))
+        self.emit("alu = {}".format(self.reg(addr_reg)))
+        self.emit("write(alu, r14)")
+        self.alu_set = True
+        self.check_write("alu")
+
+    def st_stack(self, reg_from, offset):
+        self.emit("alu = {} = {}".format(self.target(Register.r14), self.reg(reg_from)))
+        self.emit("write(mem_size - {} - 1, alu)".format(offset))
+        self.alu_set = True
+        self.check_write("mem_size - {} - 1".format(offset))
+
+    def mv(self, reg_from, reg_to):
+        data = self.reg(reg_from)
+        self.emit("alu = {} = {}".format(self.target(reg_to), data))
+        self.alu_set = True
+
+    def read(self, reg, port):
+        self.emit("{} = pick({})".format(self.target(reg), port))
+
+    def print_symbol(self, reg, port):
+        self.emit("alu = {}".format(self.reg(reg)))
+        self.emit("put(alu, {})".format(port))
+        self.alu_set = True
+
+    def add_lit(self, reg, val):
+        data = self.reg(reg)
+        self.emit("alu = {} = {} + {}".format(self.target(reg), data, val))
+        self.alu_set = True
+
+    def mul_lit(self, reg, val):
+        data = self.reg(reg)
+        self.emit("alu = {} = {} * {}".format(self.target(reg), data, val))
+        self.alu_set = True
+
+    def cmp(self, reg1, reg2):
+        self.emit("alu = {} + (~{} + 1)".format(self.reg(reg1), self.reg(reg2)))
+        self.alu_set = True
+
+    def compare(self, reg, operand) -> None:
+        """CMP_LIT и сравнение в `fused_branches`: operand -- регистр или число."""
+        self.emit(
+            "alu = {} - {}".format(self.reg(reg), self.reg(operand) if isinstance(operand, Register) else operand)
+        )
+        self.alu_set = True
+
+    def push(self, reg, _):
+        data = self.reg(reg)
+        self.emit("{} = {}".format(self.target(Register.r14), data))
+        sp = self.reg(Register.r15)
+        self.emit("write({}, r14)".format(sp))
+        self.emit("alu = {} = {} - 1".format(self.target(Register.r15), sp))
+        self.alu_set = True
+        self.check_write("alu + 1")
+
+    def pop(self, reg, _):
+        sp = self.reg(Register.r15)
+        self.emit("alu = {} = {} + 1".format(self.target(Register.r15), sp))
+        self.emit("{} = {} = read(alu)".format(self.target(Register.r14), self.target(reg)))
+        self.alu_set = True
+
+    def call(self, addr, _):
+        self.emit("{} = {}".format(self.target(Register.r14), self.addr + 1))
+        sp = self.reg(Register.r15)
+        self.emit("write({}, r14)".format(sp))
+        self.emit("alu = {} = {} - 1".format(self.target(Register.r15), sp))
+        self.alu_set = True
+        self.lines += self.exit_lines(str(addr), self.ticks, self.count)
+
+    def ret(self, _, __):
+        sp = self.reg(Register.r15)
+        self.emit("alu = {} = {} + 1".format(self.target(Register.r15), sp))
+        self.emit("{} = read(alu)".format(self.target(Register.r14)))
+        self.alu_set = True
+        self.lines += self.exit_lines("r14", self.ticks, self.count)
+
+    emitters: ClassVar[dict[Opcode, Callable]] = {
+        Opcode.LD_ADDR: ld_addr,
+        Opcode.LD_LIT: ld_lit,
+        Opcode.LD: ld,
+        Opcode.LD_STACK: ld_stack,
+        Opcode.ST_ADDR: st_addr,
+        Opcode.ST: st,
+        Opcode.ST_STACK: st_stack,
+        Opcode.MV: mv,
+        Opcode.READ: read,
+        Opcode.PRINT: print_symbol,
+        Opcode.ADD_LIT: add_lit,
+        Opcode.MUL_LIT: mul_lit,
+        Opcode.CMP: cmp,
+        Opcode.CMP_LIT: compare,
+        Opcode.PUSH: push,
+        Opcode.POP: pop,
+        Opcode.CALL: call,
+        Opcode.RET: ret,
+    }
+
+    def branch(self, opcode: Opcode, addr: int) -> None:
+        not_taken, taken = self.branch_ticks[opcode]
+        if opcode is Opcode.JUMP:
+            self.lines += self.exit_lines(str(addr), self.ticks + taken, self.count)
+            return
+        self.emit("neg, zero = {}".format("flags(alu)" if self.alu_set else "cu.flags()"))
+        self.emit("if {}:".format(branch_conditions[fused_branches.get(opcode, opcode)]))
+        self.lines += self.exit_lines(str(addr), self.ticks + taken, self.count, "        ")
+        self.lines += self.exit_lines(str(self.addr + 1), self.ticks + not_taken, self.count)
+
+    def source(self, end: int) -> str:
+        header = (
+            "def block(cu=cu, regs=regs, read=read, write=write, pick=pick, put=put, flags=flags, REG=REG,"
+            " mem_size=mem_size):"
+        )
+        prologue = ["    r{n} = regs[{n}]".format(n=n) for n in sorted(self.inputs)]
+        body = [line.replace("__END__", str(end)) for line in self.lines]
+        if not self.closed:
+            body += self.exit_lines(str(end), self.ticks, self.count)
+        return "\n".join([header, *prologue, *body]) + "\n"
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+# Отладочная информация транслятора лежит рядом с машинным кодом в файле `<target>.dbg` (JSON):
+#   source    -- строки исходного текста;
+#   locations -- по записи на слово машинного кода: [строка, узел AST, строки объемлющих циклов while].
+# Для слов без исходной строки (HALT, статические данные) строка -- 0.
+
+VERSION = 1
+
+
+class SourceLocation:
+    """Откуда взялось слово машинного кода: строка исходного текста, тип оператора и объемлющие циклы."""
+
+    line: int
+    node: str
+    loops: tuple[int, ...]  # строки циклов while, от внешнего к внутреннему
+
+    def __init__(self, line: int = 0, node: str = "root", loops: tuple[int, ...] = ()):
+        self.line = line
+        self.node = node
+        self.loops = loops
+
+    def enter(self, line: int, node: str, is_loop: bool = False) -> SourceLocation:
+        """Место вложенного оператора; цикл while добавляет себя к объемлющим циклам."""
+        return SourceLocation(line, node, (*self.loops, line) if is_loop else self.loops)
+
+
+class DebugInfo:
+    source: list[str]
+    locations: list[SourceLocation]
+
+    def __init__(self, source: list[str], locations: list[SourceLocation]):
+        self.source = source
+        self.locations = locations
+
+    def location(self, addr: int) -> SourceLocation:
+        if addr < len(self.locations):
+            return self.locations[addr]
+        return SourceLocation(0, "memory")
+
+    def source_line(self, line: int) -> str:
+        if 0 < line <= len(self.source):
+            return self.source[line - 1].strip()
+        return ""
+
+
+def debug_filename(code_file: str) -> str:
+    return code_file + ".dbg"
+
+
+def write_debug_info(filename: str, info: DebugInfo) -> None:
+    with open(filename, "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "version": VERSION,
+                "source": info.source,
+                "locations": [[loc.line, loc.node, list(loc.loops)] for loc in info.locations],
+            },
+            file,
+            ensure_ascii=False,
+        )
+
+
+def read_debug_info(filename: str) -> DebugInfo | None:
+    """Прочитать отладочную информацию; None, если файла нет."""
+    if not Path(filename).exists():
+        return None
+    with open(filename, encoding="utf-8") as file:
+        data = json.load(file)
+    assert data["version"] == VERSION, "Unsupported debug info version: {}".format(data["version"])
+    return DebugInfo(
+        data["source"],
+        [SourceLocation(line, node, tuple(loops)) for line, node, loops in data["locations"]],
+    )
@@ -1,10 +1,31 @@
 from __future__ import annotations
 
+import argparse
 import logging
 import sys
+from collections.abc import Callable, Sequence
 from enum import Enum
+from typing import ClassVar
 
-from machine.isa import Opcode, Register, Word, dr, pc, read_code, sp
+from machine.blocks import BlockCompiler, CompiledBlock, branch_conditions, register_pairs
+from machine.isa import Opcode, Register, Word, block_transfers, dr, fused_branches, pc, read_code, sp
+from machine.memory import Memory, page_bits
+from machine.objfile import ObjectCode
+from machine.ports import BufferOutput, InputPort, OutputPort, StreamInput, StreamOutput, as_input
+from machine.snapshot import MachineSnapshot
+
+
+def divide(a: int, b: int) -> int:
+    """Частное с округлением к нулю; при делении на 0 -- -1 (все разряды единицы)."""
+    if b == 0:
+        return -1
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+def remainder(a: int, b: int) -> int:
+    """Остаток со знаком делимого; при делении на 0 -- делимое."""
+    return a - b * divide(a, b) if b else a
 
 
 class Alu:
@@ -17,29 +38,47 @@ class Alu:
     min_value = -(2**32)
     max_value = 2**32 - 1
 
+    @classmethod
+    def flags(cls, value: int) -> tuple[bool, bool]:
+        """Флаги (neg, zero) для результата операции."""
+        if value > cls.max_value:
+            value = value & cls.min_value
+        if value < cls.min_value:
+            value = value & cls.min_value
+        return value < 0, value == 0
+
     def set_flags(self, value: int):
-        if value > self.max_value:
-            value = value & self.min_value
-        if value < self.min_value:
-            value = value & self.min_value
-        self.neg = value < 0
-        self.zero = value == 0
+        self.neg, self.zero = self.flags(value)
+
+    operations: ClassVar[dict[Opcode, Callable[[int, int], int]]] = {
+        Opcode.ADD: lambda a, b: a + b,
+        Opcode.ADD_LIT: lambda a, b: a + b,
+        Opcode.INC: lambda a, b: a + 1,
+        Opcode.DEC: lambda a, b: a - 1,
+        Opcode.SHR: lambda a, b: a >> b,
+        Opcode.SHL: lambda a, b: 0 if a == 0 else a << b,
+        Opcode.XOR: lambda a, b: a ^ b,
+        Opcode.AND: lambda a, b: a & b,
+        Opcode.OR: lambda a, b: a | b,
+        Opcode.NEG: lambda a, b: ~a,
+        Opcode.CMP_LIT: lambda a, b: a - b,
+        Opcode.MUL: lambda a, b: a * b,
+        Opcode.MUL_LIT: lambda a, b: a * b,
+        Opcode.DIV: divide,
+        Opcode.MOD: remainder,
+    }
+
+    # такты, которые АЛУ дополнительно занято операцией (умножитель и делитель многотактные)
+    latency: ClassVar[dict[Opcode, int]] = {
+        Opcode.MUL: 3,
+        Opcode.MUL_LIT: 3,
+        Opcode.DIV: 7,
+        Opcode.MOD: 7,
+    }
 
     def execute(self, opcode: Opcode, arg1: int, arg2: int = 0) -> int:
         res: int
-        operations = {
-            Opcode.ADD: lambda a, b: a + b,
-            Opcode.ADD_LIT: lambda a, b: a + b,
-            Opcode.INC: lambda a, b: a + 1,
-            Opcode.DEC: lambda a, b: a - 1,
-            Opcode.SHR: lambda a, b: a >> b,
-            Opcode.SHL: lambda a, b: 0 if a == 0 else a << b,
-            Opcode.XOR: lambda a, b: a ^ b,
-            Opcode.AND: lambda a, b: a & b,
-            Opcode.OR: lambda a, b: a | b,
-            Opcode.NEG: lambda a, b: ~a,
-        }
-        operation = operations.get(opcode, None)
+        operation = self.operations.get(opcode, None)
         if operation is not None:
             res = operation(arg1, arg2)
         else:
@@ -48,27 +87,44 @@ class Alu:
         return res
 
 
+def load_memory(data: Sequence[Word] | Memory, mem_size: int) -> Memory:
+    """Память машины с программой: `Memory` как есть, объектный файл -- копированием колонок, иначе по словам."""
+    if isinstance(data, Memory):
+        return data
+    if isinstance(data, ObjectCode):
+        return data.to_memory(mem_size)
+    return Memory.from_words(data, mem_size)
+
+
 class DataPath:
     registers: dict[Register, int]
 
     mem_size: int
 
-    memory: list[Word]
+    memory: Memory
 
-    input_ports: dict[int, list[str]]
+    input_ports: dict[int, InputPort]
 
-    output_ports: dict[int, list[str]]
+    output_ports: dict[int, OutputPort]
 
     alu: Alu = None
 
-    def __init__(self, data: list[Word], ports: dict[int, list[str]], mem_size: int = 4096):
+    write_listeners: list[Callable[[int], None]]
+
+    def __init__(
+        self,
+        data: Sequence[Word] | Memory,
+        ports: dict[int, InputPort | Sequence[str]],
+        mem_size: int = 4096,
+        output_ports: dict[int, OutputPort] | None = None,
+    ):
         self.registers = {}
-        self.output_ports = {}
+        self.write_listeners = []
         self.mem_size = mem_size
-        self.memory = data
+        self.memory = load_memory(data, mem_size)
         self.alu = Alu()
-        self.input_ports = ports
-        self.output_ports[0] = []
+        self.input_ports = {port: as_input(tokens) for port, tokens in ports.items()}
+        self.output_ports = output_ports if output_ports is not None else {0: BufferOutput()}
         for reg_num in range(0, 15):
             self.registers[Register(reg_num)] = 0
         self.registers[sp] = self.mem_size - 1
@@ -79,17 +135,24 @@ class DataPath:
     def load_reg(self, reg: Register) -> int:
         return self.registers[reg]
 
-    def _get_instruction(self, addr: int) -> Word:
-        return self.memory[addr]
-
-    def memory_perform(self, oe: bool, wr: bool, addr: int) -> Word | None:
-        instr: Word = self._get_instruction(addr)
+    def memory_perform(self, oe: bool, wr: bool, addr: int) -> int | Register | None:
         if oe:
-            return instr
+            return self.memory.read(addr)
         if wr:
-            instr.arg1 = self.registers[dr]
+            self.write_memory(addr, self.registers[dr])
         return None
 
+    def write_memory(self, addr: int, value: int) -> None:
+        self.memory.write(addr, value)
+        for listener in self.write_listeners:
+            listener(addr)
+
+    def write_block(self, addr: int, values: list[int]) -> None:
+        self.memory.write_block(addr, values)
+        for cell in range(addr, addr + len(values)):
+            for listener in self.write_listeners:
+                listener(cell)
+
     def perform_arithmetic(self, opcode: Opcode, arg1: int, arg2: int = 0) -> int:
         return self.alu.execute(opcode, arg1, arg2)
 
@@ -100,12 +163,34 @@ class DataPath:
         return self.alu.neg
 
     def pick_char(self, port: int) -> int:
-        if len(self.input_ports[port]) == 0:
-            return 0
-        return ord(self.input_ports[port].pop(0))
+        return self.input_ports[port].read()
 
     def put_char(self, char: int, port: int):
-        self.output_ports[port].append(chr(char))
+        self.output_ports[port].write(char)
+
+    def snapshot(self) -> MachineSnapshot:
+        """Снимок регистров, флагов, портов и памяти (такты и счётчик инструкций добавляет ControlUnit)."""
+        return MachineSnapshot(
+            [self.registers[reg] for reg in Register],
+            (self.alu.neg, self.alu.zero),
+            {port: device.tell() for port, device in self.input_ports.items()},
+            {port: device.getvalue() for port, device in self.output_ports.items()},
+            self.memory.snapshot(),
+        )
+
+    def restore(self, snapshot: MachineSnapshot) -> None:
+        """Вернуть состояние из снимка; для переписанных страниц памяти вызываются write_listeners."""
+        for reg, value in zip(Register, snapshot.registers):
+            self.registers[reg] = value
+        self.alu.neg, self.alu.zero = snapshot.neg, snapshot.zero
+        for port, position in snapshot.input_positions.items():
+            self.input_ports[port].seek(position)
+        for port, text in snapshot.outputs.items():
+            self.output_ports[port].restore(text)
+        for page in self.memory.restore(snapshot.memory):
+            for addr in range(page << page_bits, min((page + 1) << page_bits, self.mem_size)):
+                for listener in self.write_listeners:
+                    listener(addr)
 
 
 class ControlUnit:
@@ -116,6 +201,44 @@ class ControlUnit:
     def __init__(self, data_path):
         self._tick = 0
         self.data_path = data_path
+        self.opcode_mapping = {
+            Opcode.LD_ADDR: self.ld_addr,
+            Opcode.LD_LIT: self.ld_lit,
+            Opcode.LD: self.ld,
+            Opcode.LD_STACK: self.ld_stack,
+            Opcode.ST_ADDR: self.st_addr,
+            Opcode.ST: self.st,
+            Opcode.ST_STACK: self.st_stack,
+            Opcode.MV: self.mv,
+            Opcode.READ: self.read,
+            Opcode.PRINT: self.print_symbol,
+            Opcode.READ_BLOCK: self.read_block,
+            Opcode.PRINT_BLOCK: self.print_block,
+            Opcode.ADD: self.arythm,
+            Opcode.OR: self.arythm,
+            Opcode.AND: self.arythm,
+            Opcode.SHL: self.arythm,
+            Opcode.SHR: self.arythm,
+            Opcode.XOR: self.arythm,
+            Opcode.INC: self.unary_arythm,
+            Opcode.DEC: self.unary_arythm,
+            Opcode.ADD_LIT: self.add_lit,
+            Opcode.CMP: self.cmp,
+            Opcode.CMP_LIT: self.cmp_lit,
+            Opcode.SUB: self.sub,
+            Opcode.PUSH: self.push,
+            Opcode.POP: self.pop,
+            Opcode.NEG: self.unary_arythm,
+            Opcode.MUL: self.long_arythm,
+            Opcode.MUL_LIT: self.long_arythm,
+            Opcode.DIV: self.long_arythm,
+            Opcode.MOD: self.long_arythm,
+        }
+        # переходы в подпрограмму и возврат сами пишут pc
+        self.subroutine_mapping = {
+            Opcode.CALL: self.call,
+            Opcode.RET: self.ret,
+        }
 
     def tick(self):
         self._tick += 1
@@ -123,6 +246,31 @@ class ControlUnit:
     def current_tick(self):
         return self._tick
 
+    def step(self, budget: int) -> int:
+        """Исполнить не более budget инструкций, вернуть число исполненных."""
+        self.decode_and_execute_instruction()
+        return 1
+
+    def sync(self) -> None:
+        """Перенести состояние в DataPath, если модель хранит его отдельно."""
+
+    def load_state(self) -> None:
+        """Взять состояние из DataPath, если модель хранит его отдельно."""
+
+    def snapshot(self, instr_counter: int) -> MachineSnapshot:
+        self.sync()
+        snapshot = self.data_path.snapshot()
+        snapshot.tick = self._tick
+        snapshot.instr_counter = instr_counter
+        return snapshot
+
+    def restore(self, snapshot: MachineSnapshot) -> int:
+        """Вернуть машину к снимку, вернуть число исполненных к снимку инструкций."""
+        self.data_path.restore(snapshot)
+        self._tick = snapshot.tick
+        self.load_state()
+        return snapshot.instr_counter
+
     def decode_and_execute_control_flow_instruction(self, instr, opcode) -> bool:
         if opcode is Opcode.HALT:
             raise StopIteration()
@@ -174,10 +322,10 @@ class ControlUnit:
     def ld_addr(self, instr: Word):
         addr: int = instr.arg2
         reg: Register = instr.arg1
-        data: Word = self.data_path.memory_perform(True, False, addr)
-        self.data_path.latch_reg(dr, data.arg1)
+        data: int = self.data_path.memory_perform(True, False, addr)
+        self.data_path.latch_reg(dr, data)
         self.tick()
-        self.data_path.latch_reg(reg, data.arg1)
+        self.data_path.latch_reg(reg, data)
         self.tick()
 
     def ld_lit(self, instr: Word):
@@ -191,20 +339,20 @@ class ControlUnit:
         addr_reg: Register = instr.arg2
         addr_to_read: int = self.data_path.perform_arithmetic(Opcode.ADD, 0, self.data_path.registers[addr_reg])
         self.tick()
-        data: Word = self.data_path.memory_perform(True, False, addr_to_read)
-        self.data_path.latch_reg(dr, data.arg1)
+        data: int = self.data_path.memory_perform(True, False, addr_to_read)
+        self.data_path.latch_reg(dr, data)
         self.tick()
-        self.data_path.latch_reg(reg_to, data.arg1)
+        self.data_path.latch_reg(reg_to, data)
         self.tick()
 
     def ld_stack(self, instr: Word):
         reg_to: Register = instr.arg1
         addr: int = self.data_path.mem_size - instr.arg2 - 1
         self.tick()
-        data: Word = self.data_path.memory_perform(True, False, addr)
-        self.data_path.latch_reg(dr, data.arg1)
+        data: int = self.data_path.memory_perform(True, False, addr)
+        self.data_path.latch_reg(dr, data)
         self.tick()
-        self.data_path.latch_reg(reg_to, data.arg1)
+        self.data_path.latch_reg(reg_to, data)
         self.tick()
 
     def st_addr(self, instr: Word):
@@ -262,6 +410,37 @@ class ControlUnit:
         self.data_path.put_char(data, port)
         self.tick()
 
+    def read_block(self, instr: Word):
+        """Символы из порта arg3 -- в память с адреса в arg1, до конца ввода или arg2 символов: по два такта на символ."""
+        addr: int = self.data_path.registers[instr.arg1]
+        limit: int = self.data_path.registers[instr.arg2]
+        self.tick()
+        count = 0
+        while count < limit:
+            char: int = self.data_path.pick_char(instr.arg3)
+            if char == 0:
+                break
+            self.data_path.latch_reg(dr, char)
+            self.tick()
+            self.data_path.memory_perform(False, True, addr + count)
+            self.tick()
+            count += 1
+        self.data_path.latch_reg(instr.arg1, addr + count)
+        self.tick()
+
+    def print_block(self, instr: Word):
+        """arg2 ячеек с адреса в arg1 -- в порт arg3: по два такта на ячейку."""
+        addr: int = self.data_path.registers[instr.arg1]
+        count: int = self.data_path.registers[instr.arg2]
+        self.tick()
+        for cell in range(addr, addr + count):
+            self.data_path.latch_reg(dr, self.data_path.memory_perform(True, False, cell))
+            self.tick()
+            self.data_path.put_char(self.data_path.registers[dr], instr.arg3)
+            self.tick()
+        self.data_path.latch_reg(instr.arg1, addr + max(count, 0))
+        self.tick()
+
     def arythm(self, instr: Word):
         res: int = self.data_path.perform_arithmetic(
             instr.opcode, self.data_path.load_reg(instr.arg1), self.data_path.load_reg(instr.arg2)
@@ -269,6 +448,14 @@ class ControlUnit:
         self.data_path.latch_reg(instr.arg1, res)
         self.tick()
 
+    def long_arythm(self, instr: Word):
+        arg2 = instr.arg2 if instr.opcode is Opcode.MUL_LIT else self.data_path.load_reg(instr.arg2)
+        res: int = self.data_path.perform_arithmetic(instr.opcode, self.data_path.load_reg(instr.arg1), arg2)
+        for _ in range(Alu.latency[instr.opcode]):
+            self.tick()
+        self.data_path.latch_reg(instr.arg1, res)
+        self.tick()
+
     def add_lit(self, instr: Word):
         res: int = self.data_path.perform_arithmetic(instr.opcode, self.data_path.load_reg(instr.arg1), instr.arg2)
         self.data_path.latch_reg(instr.arg1, res)
@@ -293,10 +480,35 @@ class ControlUnit:
         self.tick()
         addr: int = self.data_path.perform_arithmetic(Opcode.ADD, self.data_path.registers[sp], 0)
         self.tick()
-        data: Word = self.data_path.memory_perform(True, False, addr)
-        self.data_path.latch_reg(dr, data.arg1)
+        data: int = self.data_path.memory_perform(True, False, addr)
+        self.data_path.latch_reg(dr, data)
         self.tick()
-        self.data_path.latch_reg(instr.arg1, data.arg1)
+        self.data_path.latch_reg(instr.arg1, data)
+        self.tick()
+
+    def call(self, instr: Word):
+        ret_addr: int = self.data_path.perform_arithmetic(Opcode.INC, self.data_path.load_reg(pc))
+        self.data_path.latch_reg(dr, ret_addr)
+        self.tick()
+        addr: int = self.data_path.perform_arithmetic(Opcode.ADD, 0, self.data_path.registers[sp])
+        self.data_path.memory_perform(False, True, addr)
+        self.tick()
+        res: int = self.data_path.perform_arithmetic(Opcode.DEC, self.data_path.load_reg(sp))
+        self.data_path.latch_reg(sp, res)
+        self.tick()
+        self.data_path.latch_reg(pc, instr.arg1)
+        self.tick()
+
+    def ret(self, instr: Word):
+        res: int = self.data_path.perform_arithmetic(Opcode.INC, self.data_path.load_reg(sp))
+        self.data_path.latch_reg(sp, res)
+        self.tick()
+        addr: int = self.data_path.perform_arithmetic(Opcode.ADD, self.data_path.registers[sp], 0)
+        self.tick()
+        data: int = self.data_path.memory_perform(True, False, addr)
+        self.data_path.latch_reg(dr, data)
+        self.tick()
+        self.data_path.latch_reg(pc, data)
         self.tick()
 
     def cmp(self, instr: Word):
@@ -307,6 +519,17 @@ class ControlUnit:
         self.data_path.perform_arithmetic(Opcode.ADD, self.data_path.load_reg(instr.arg1), inv)
         self.tick()
 
+    def cmp_lit(self, instr: Word):
+        self.data_path.perform_arithmetic(Opcode.CMP_LIT, self.data_path.load_reg(instr.arg1), instr.arg2)
+        self.tick()
+
+    def fused_branch(self, instr: Word):
+        """Сравнение arg2 с arg3 (регистром или числом) за такт и переход, как у Jcc."""
+        arg3 = instr.arg3 if isinstance(instr.arg3, int) else self.data_path.load_reg(instr.arg3)
+        self.data_path.perform_arithmetic(Opcode.CMP_LIT, self.data_path.load_reg(instr.arg2), arg3)
+        self.tick()
+        self.decode_and_execute_control_flow_instruction(instr, fused_branches[instr.opcode])
+
     def sub(self, instr: Word):
         inv = self.data_path.perform_arithmetic(Opcode.NEG, self.data_path.load_reg(instr.arg2))
         self.tick()
@@ -324,36 +547,16 @@ class ControlUnit:
     def decode_and_execute_instruction(self):
         instr: Word = self.fetch_instruction()
         opcode: Opcode = instr.opcode
-        opcode_mapping = {
-            Opcode.LD_ADDR: self.ld_addr,
-            Opcode.LD_LIT: self.ld_lit,
-            Opcode.LD: self.ld,
-            Opcode.LD_STACK: self.ld_stack,
-            Opcode.ST_ADDR: self.st_addr,
-            Opcode.ST: self.st,
-            Opcode.ST_STACK: self.st_stack,
-            Opcode.MV: self.mv,
-            Opcode.READ: self.read,
-            Opcode.PRINT: self.print_symbol,
-            Opcode.ADD: self.arythm,
-            Opcode.OR: self.arythm,
-            Opcode.AND: self.arythm,
-            Opcode.SHL: self.arythm,
-            Opcode.SHR: self.arythm,
-            Opcode.XOR: self.arythm,
-            Opcode.INC: self.unary_arythm,
-            Opcode.DEC: self.unary_arythm,
-            Opcode.ADD_LIT: self.add_lit,
-            Opcode.CMP: self.cmp,
-            Opcode.SUB: self.sub,
-            Opcode.PUSH: self.push,
-            Opcode.POP: self.pop,
-            Opcode.NEG: self.unary_arythm,
-        }
         if self.decode_and_execute_control_flow_instruction(instr, opcode):
             return
-        if opcode in opcode_mapping:
-            opcode_mapping[opcode](instr)
+        if opcode in self.subroutine_mapping:
+            self.subroutine_mapping[opcode](instr)
+            return
+        if opcode in fused_branches:
+            self.fused_branch(instr)
+            return
+        if opcode in self.opcode_mapping:
+            self.opcode_mapping[opcode](instr)
 
         self.data_path.latch_reg(pc, self.data_path.registers[pc] + 1)
         self.tick()
@@ -364,18 +567,18 @@ class ControlUnit:
         return value
 
     def __repr__(self):
+        instr = self.data_path.memory[self.data_path.registers[pc]]
         formatted_registers = {f"r{register.value}": value for register, value in self.data_path.registers.items()}
         formatted_string = ", ".join([f"'{key}': {value}" for key, value in formatted_registers.items()])
 
         state_repr = "TICK: {:3} PC: {:3}  MEM_OUT: {} {} reg: {}".format(
             self._tick,
             self.data_path.registers[pc],
-            self.print_val_if_enum(self.data_path.memory[self.data_path.registers[pc]].arg1),
-            self.print_val_if_enum(self.data_path.memory[self.data_path.registers[pc]].arg2),
+            self.print_val_if_enum(instr.arg1),
+            self.print_val_if_enum(instr.arg2),
             formatted_string,
         )
 
-        instr = self.data_path.memory[self.data_path.registers[pc]]
         opcode = str(instr.opcode)
 
         instr_repr = "  ('{}'@{}:{} {})".format(instr.index, opcode, instr.arg1, instr.arg2)
@@ -383,50 +586,703 @@ class ControlUnit:
         return "{} \t{}".format(state_repr, instr_repr)
 
 
-def simulation(mem: list[Word], input_tokens: list[str], limit: int):
-    ports: dict[int, list[str]] = {}
-    ports[0] = input_tokens
-    data_path = DataPath(mem, ports)
+def measure_ticks(opcode: Opcode, neg: bool = False, zero: bool = False, count: int = 0) -> tuple[int, bool]:
+    """Исполнить инструкцию в потактовой модели, вернуть число тактов и был ли совершён переход.
+
+    count -- длина блока для `block_transfers`.
+    """
+    target = 8
+    jumps = opcode in branch_conditions or opcode in fused_branches or opcode is Opcode.CALL
+    arg1 = target if jumps else Register.r1
+    arg2 = Register.r2 if opcode in register_pairs or opcode in fused_branches or opcode in block_transfers else 0
+    arg3 = 0 if opcode in block_transfers else Register.r0
+    data_path = DataPath([Word(0, opcode, arg1, arg2, arg3)], {0: "?" * count}, mem_size=16)
+    data_path.registers[sp] = target
+    data_path.registers[Register.r2] = -1 if neg else int(not zero)  # флаги для `fused_branches`
+    if opcode in block_transfers:
+        data_path.registers[Register.r1], data_path.registers[Register.r2] = target, count
+    data_path.alu.neg, data_path.alu.zero = neg, zero
     control_unit = ControlUnit(data_path)
-    instr_counter = 0
+    try:
+        control_unit.decode_and_execute_instruction()
+    except StopIteration:
+        pass
+    return control_unit.current_tick(), data_path.registers[pc] == target
+
+
+def measure_instruction_ticks() -> tuple[dict[Opcode, int], dict[Opcode, tuple[int, int]]]:
+    """Таблицы тактов, снятые с методов ControlUnit.
+
+    Возвращает такты на инструкцию (с выборкой и инкрементом pc) и для переходов --
+    такты без перехода и с переходом.
+    """
+    instruction_ticks: dict[Opcode, int] = {}
+    branch_ticks: dict[Opcode, tuple[int, int]] = {}
+    for opcode in Opcode:
+        instruction_ticks[opcode], _ = measure_ticks(opcode)
+        if opcode in branch_conditions or opcode in fused_branches:
+            paths = {
+                taken: ticks
+                for ticks, taken in (
+                    measure_ticks(opcode, neg, zero) for neg in (False, True) for zero in (False, True)
+                )
+            }
+            branch_ticks[opcode] = (paths.get(False, paths[True]), paths[True])
+    return instruction_ticks, branch_ticks
+
+
+instruction_ticks, branch_ticks = measure_instruction_ticks()
+
+# такты `block_transfers` на слово блока сверх instruction_ticks
+block_ticks: dict[Opcode, int] = {
+    opcode: measure_ticks(opcode, count=1)[0] - instruction_ticks[opcode] for opcode in block_transfers
+}
+
+
+class DecodedControlUnit(ControlUnit):
+    """Модель процессора, исполняющая заранее декодированную память.
+
+    Каждый адрес декодируется один раз в запись (обработчик, dr, arg1, arg2, доп. данные, такты),
+    запись в память сбрасывает только соответствующую запись. Регистры, флаги и такты
+    совпадают с потактовой моделью `ControlUnit`, такты берутся из `instruction_ticks` и `branch_ticks`.
+    """
+
+    regs: list
+
+    decoded: list[tuple | None]
+
+    def __init__(self, data_path: DataPath):
+        super().__init__(data_path)
+        self.regs = [data_path.registers[Register(reg_num)] for reg_num in range(16)]
+        self.alu_value: int | None = None  # результат последней операции АЛУ, флаги считаются по требованию
+        self.decoded = [None] * len(data_path.memory)
+        self.handlers = {
+            Opcode.LD_ADDR: self._ld_addr,
+            Opcode.LD_LIT: self._ld_lit,
+            Opcode.LD: self._ld,
+            Opcode.LD_STACK: self._ld_stack,
+            Opcode.ST_ADDR: self._st_addr,
+            Opcode.ST: self._st,
+            Opcode.ST_STACK: self._st_stack,
+            Opcode.MV: self._mv,
+            Opcode.READ: self._read,
+            Opcode.PRINT: self._print,
+            Opcode.READ_BLOCK: self._read_block,
+            Opcode.PRINT_BLOCK: self._print_block,
+            Opcode.ADD: self._arythm,
+            Opcode.OR: self._arythm,
+            Opcode.AND: self._arythm,
+            Opcode.SHL: self._arythm,
+            Opcode.SHR: self._arythm,
+            Opcode.XOR: self._arythm,
+            Opcode.MUL: self._arythm,
+            Opcode.DIV: self._arythm,
+            Opcode.MOD: self._arythm,
+            Opcode.MUL_LIT: self._mul_lit,
+            Opcode.INC: self._unary_arythm,
+            Opcode.DEC: self._unary_arythm,
+            Opcode.NEG: self._unary_arythm,
+            Opcode.ADD_LIT: self._add_lit,
+            Opcode.CMP: self._cmp,
+            Opcode.CMP_LIT: self._cmp_lit,
+            Opcode.SUB: self._sub,
+            Opcode.PUSH: self._push,
+            Opcode.POP: self._pop,
+            Opcode.JUMP: self._jump,
+            Opcode.CALL: self._call,
+            Opcode.RET: self._ret,
+            Opcode.JE: self._branch,
+            Opcode.JNE: self._branch,
+            Opcode.JL: self._branch,
+            Opcode.JLE: self._branch,
+            Opcode.JG: self._branch,
+            Opcode.JGE: self._branch,
+            Opcode.HALT: self._halt,
+            **dict.fromkeys(fused_branches, self._fused_branch),
+        }
+        self.conditions = {
+            Opcode.JE: lambda neg, zero: zero,
+            Opcode.JNE: lambda neg, zero: not zero,
+            Opcode.JG: lambda neg, zero: not neg,
+            Opcode.JGE: lambda neg, zero: not neg or zero,
+            Opcode.JL: lambda neg, zero: neg,
+            Opcode.JLE: lambda neg, zero: neg or zero,
+        }
+        self.conditions.update({fused: self.conditions[jump] for fused, jump in fused_branches.items()})
+        data_path.write_listeners.append(self.invalidate)
+
+    def invalidate(self, addr: int) -> None:
+        self.decoded[addr] = None
+
+    def decode(self, addr: int) -> tuple:
+        instr: Word = self.data_path.memory[addr]
+        handler = self.handlers.get(instr.opcode, self._nop)
+        extra = Alu.operations.get(instr.opcode)
+        ticks = instruction_ticks[instr.opcode]
+        if instr.opcode in self.conditions:
+            not_taken, taken = branch_ticks[instr.opcode]
+            extra = (self.conditions[instr.opcode], taken - not_taken)
+            ticks = not_taken
+        if instr.opcode in fused_branches:
+            extra = (*extra, isinstance(instr.arg3, Register), self._operand(instr.arg3))
+        if instr.opcode in block_transfers:
+            extra = (instr.arg3, block_ticks[instr.opcode])
+        entry = (handler, instr.arg1, self._operand(instr.arg1), self._operand(instr.arg2), extra, ticks)
+        self.decoded[addr] = entry
+        return entry
+
+    @staticmethod
+    def _operand(arg):
+        if isinstance(arg, Register):
+            return arg.value
+        return arg
+
+    def decode_and_execute_instruction(self):
+        entry = self.decoded[self.regs[13]]
+        if entry is None:
+            entry = self.decode(self.regs[13])
+        handler, self.regs[14], arg1, arg2, extra, ticks = entry
+        self._tick += ticks
+        handler(arg1, arg2, extra)
+
+    def flags(self) -> tuple[bool, bool]:
+        if self.alu_value is not None:
+            self.data_path.alu.set_flags(self.alu_value)
+            self.alu_value = None
+        return self.data_path.alu.neg, self.data_path.alu.zero
+
+    def sync(self) -> None:
+        """Перенести состояние в DataPath, например, для журнала."""
+        for reg_num, value in enumerate(self.regs):
+            self.data_path.registers[Register(reg_num)] = value
+        self.flags()
+
+    def load_state(self) -> None:
+        # список regs общий с блоками BlockControlUnit, поэтому обновляется на месте
+        self.regs[:] = [self.data_path.registers[reg] for reg in Register]
+        self.alu_value = None
+
+    def _halt(self, arg1, arg2, extra):
+        raise StopIteration()
+
+    def _jump(self, addr, arg2, extra):
+        self.regs[13] = addr
+
+    def _call(self, addr, arg2, extra):
+        regs = self.regs
+        data = regs[14] = regs[13] + 1
+        self.data_path.write_memory(regs[15], data)
+        regs[15] = self.alu_value = regs[15] - 1
+        regs[13] = addr
+
+    def _ret(self, arg1, arg2, extra):
+        regs = self.regs
+        addr = regs[15] = self.alu_value = regs[15] + 1
+        regs[14] = regs[13] = self.data_path.memory.read(addr)
+
+    def _branch(self, addr, arg2, extra):
+        condition, taken_ticks = extra
+        neg, zero = self.flags()
+        if condition(neg, zero):
+            self.regs[13] = addr
+            self._tick += taken_ticks
+        else:
+            self.regs[13] += 1
+
+    def _fused_branch(self, addr, reg, extra):
+        condition, taken_ticks, register, operand = extra
+        regs = self.regs
+        self.alu_value = regs[reg] - (regs[operand] if register else operand)
+        if condition(*self.flags()):
+            regs[13] = addr
+            self._tick += taken_ticks
+        else:
+            regs[13] += 1
+
+    def _nop(self, arg1, arg2, extra):
+        self.regs[13] += 1
+
+    def _ld_addr(self, reg, addr, extra):
+        regs = self.regs
+        regs[14] = regs[reg] = self.data_path.memory.read(addr)
+        regs[13] += 1
+
+    def _ld_lit(self, reg, val, extra):
+        regs = self.regs
+        regs[reg] = val
+        regs[13] += 1
+
+    def _ld(self, reg_to, addr_reg, extra):
+        regs = self.regs
+        addr = self.alu_value = regs[addr_reg]
+        regs[14] = regs[reg_to] = self.data_path.memory.read(addr)
+        regs[13] += 1
+
+    def _ld_stack(self, reg_to, offset, extra):
+        regs = self.regs
+        regs[14] = regs[reg_to] = self.data_path.memory.read(self.data_path.mem_size - offset - 1)
+        regs[13] += 1
+
+    def _st_addr(self, reg, addr, extra):
+        regs = self.regs
+        data = self.alu_value = regs[14] = regs[reg]
+        self.data_path.write_memory(addr, data)
+        regs[13] += 1
+
+    def _st(self, data_reg, addr_reg, extra):
+        regs = self.regs
+        data = regs[14] = regs[data_reg]
+        addr = self.alu_value = regs[addr_reg]
+        self.data_path.write_memory(addr, data)
+        regs[13] += 1
+
+    def _st_stack(self, reg_from, offset, extra):
+        regs = self.regs
+        data = self.alu_value = regs[14] = regs[reg_from]
+        self.data_path.write_memory(self.data_path.mem_size - offset - 1, data)
+        regs[13] += 1
+
+    def _mv(self, reg_from, reg_to, extra):
+        regs = self.regs
+        regs[reg_to] = self.alu_value = regs[reg_from]
+        regs[13] += 1
+
+    def _read(self, reg, port, extra):
+        regs = self.regs
+        regs[reg] = self.data_path.pick_char(port)
+        regs[13] += 1
+
+    def _print(self, reg, port, extra):
+        regs = self.regs
+        self.alu_value = regs[reg]
+        self.data_path.put_char(regs[reg], port)
+        regs[13] += 1
+
+    def _read_block(self, addr_reg, limit_reg, extra):
+        port, word_ticks = extra
+        regs = self.regs
+        chars = self.data_path.input_ports[port].read_block(regs[limit_reg])
+        if chars:
+            regs[14] = chars[-1]
+        self.data_path.write_block(regs[addr_reg], chars)
+        regs[addr_reg] += len(chars)
+        self._tick += word_ticks * len(chars)
+        regs[13] += 1
+
+    def _print_block(self, addr_reg, count_reg, extra):
+        port, word_ticks = extra
+        regs = self.regs
+        values = self.data_path.memory.read_block(regs[addr_reg], regs[count_reg])
+        if values:
+            regs[14] = values[-1]
+        self.data_path.output_ports[port].write_block(values)
+        regs[addr_reg] += len(values)
+        self._tick += word_ticks * len(values)
+        regs[13] += 1
+
+    def _arythm(self, reg1, reg2, operation):
+        regs = self.regs
+        regs[reg1] = self.alu_value = operation(regs[reg1], regs[reg2])
+        regs[13] += 1
+
+    def _unary_arythm(self, reg, arg2, operation):
+        regs = self.regs
+        regs[reg] = self.alu_value = operation(regs[reg], 0)
+        regs[13] += 1
+
+    def _add_lit(self, reg, val, extra):
+        regs = self.regs
+        regs[reg] = self.alu_value = regs[reg] + val
+        regs[13] += 1
+
+    def _mul_lit(self, reg, val, extra):
+        regs = self.regs
+        regs[reg] = self.alu_value = regs[reg] * val
+        regs[13] += 1
+
+    def _cmp(self, reg1, reg2, extra):
+        regs = self.regs
+        self.alu_value = regs[reg1] + (~regs[reg2] + 1)
+        regs[13] += 1
+
+    def _cmp_lit(self, reg, val, extra):
+        regs = self.regs
+        self.alu_value = regs[reg] - val
+        regs[13] += 1
+
+    def _sub(self, reg1, reg2, extra):
+        regs = self.regs
+        regs[reg1] = self.alu_value = regs[reg1] + (~regs[reg2] + 1)
+        regs[13] += 1
+
+    def _push(self, reg, arg2, extra):
+        regs = self.regs
+        data = regs[14] = regs[reg]
+        self.data_path.write_memory(regs[15], data)
+        regs[15] = self.alu_value = regs[15] - 1
+        regs[13] += 1
+
+    def _pop(self, reg, arg2, extra):
+        regs = self.regs
+        addr = regs[15] = self.alu_value = regs[15] + 1
+        regs[14] = regs[reg] = self.data_path.memory.read(addr)
+        regs[13] += 1
 
-    logging.debug("%s", control_unit)
+    def __repr__(self):
+        self.sync()
+        return super().__repr__()
+
+
+class BlockControlUnit(DecodedControlUnit):
+    """Модель процессора, исполняющая линейные блоки кода, скомпилированные в функции Python.
+
+    Блок компилируется, когда в его адрес входа перешли `hot_threshold` раз, до этого код исполняется
+    как в `DecodedControlUnit`: большинство блоков -- несколько инструкций, и компиляция редко
+    исполняемого блока стоит дороже, чем экономит. Блоки кешируются по адресу входа. Запись в любой адрес
+    скомпилированного блока удаляет блок из кеша. Если блок длиннее оставшегося лимита инструкций или
+    не компилируется (например, `HALT`), инструкция исполняется как в `DecodedControlUnit`.
+    Такты берутся из `instruction_ticks`.
+    """
+
+    hot_threshold: int = 32
+
+    blocks: dict[int, CompiledBlock | None]
+
+    block_owners: dict[int, list[int]]  # адрес -> адреса входа блоков, которые его содержат
+
+    entries: dict[int, int]  # адрес входа ещё не скомпилированного блока -> сколько раз в него перешли
+
+    halted: bool = False
+
+    def __init__(self, data_path: DataPath):
+        super().__init__(data_path)
+        self.blocks = {}
+        self.block_owners = {}
+        self.entries = {}
+        namespace = {
+            "cu": self,
+            "regs": self.regs,
+            "read": data_path.memory.read,
+            "write": data_path.write_memory,
+            "pick": data_path.pick_char,
+            "put": data_path.put_char,
+            "flags": Alu.flags,
+            "divide": divide,
+            "remainder": remainder,
+            "REG": list(Register),
+            "mem_size": data_path.mem_size,
+        }
+        self.compiler = BlockCompiler(data_path.memory, instruction_ticks, branch_ticks, namespace)
+
+    def invalidate(self, addr: int) -> None:
+        super().invalidate(addr)
+        for start in self.block_owners.pop(addr % self.data_path.mem_size, ()):
+            self.blocks.pop(start, None)
+
+    def compile_block(self, start: int) -> CompiledBlock | None:
+        block = self.compiler.compile(start)
+        self.blocks[start] = block
+        for addr in range(start, start + 1 if block is None else block.end):
+            self.block_owners.setdefault(addr, []).append(start)
+        return block
+
+    def load_state(self) -> None:
+        super().load_state()
+        self.halted = False
+
+    def step(self, budget: int) -> int:
+        if self.halted:
+            raise StopIteration()
+        start = self.regs[13]
+        if start in self.blocks:
+            block = self.blocks[start]
+        else:
+            self.entries[start] = self.entries.get(start, 0) + 1
+            if self.entries[start] < self.hot_threshold:
+                return self.execute_decoded(budget)
+            block = self.compile_block(start)
+        if block is None or block.length > budget:
+            self.decode_and_execute_instruction()
+            return 1
+        return block.function()
+
+    def execute_decoded(self, budget: int) -> int:
+        """Исполнять декодированные инструкции до перехода, входа в скомпилированный блок или конца лимита."""
+        regs = self.regs
+        executed = 0
+        try:
+            while executed < budget:
+                pc = regs[13]
+                self.decode_and_execute_instruction()
+                executed += 1
+                if regs[13] != pc + 1 or regs[13] in self.blocks:
+                    break
+        except StopIteration:
+            if not executed:
+                raise
+            self.halted = True
+        return executed
+
+
+class FastControlUnit(DecodedControlUnit):
+    """Модель процессора уровня инструкций.
+
+    Исполняет декодированные инструкции подряд в одном вызове `step` и добавляет такты
+    из `instruction_ticks`/`branch_ticks`, не моделируя выборку в dr и не записывая журнал
+    на каждой инструкции. Архитектурные регистры, флаги, вывод и такты совпадают с `micro`.
+    """
+
+    halted: bool = False
+
+    def load_state(self) -> None:
+        super().load_state()
+        self.halted = False
+
+    def step(self, budget: int) -> int:
+        if self.halted:
+            raise StopIteration()
+        decoded = self.decoded
+        regs = self.regs
+        ticks = 0
+        executed = 0
+        try:
+            while executed < budget:
+                entry = decoded[regs[13]] or self.decode(regs[13])
+                ticks += entry[5]
+                entry[0](entry[2], entry[3], entry[4])
+                executed += 1
+        except StopIteration:
+            self.halted = True
+        finally:
+            self._tick += ticks
+        return executed
+
+
+class ProfilingControlUnit(DecodedControlUnit):
+    """Модель процессора с профилем: число исполнений и тактов по адресам инструкций.
+
+    Исполняет по одной декодированной инструкции, такты совпадают с `micro`. Такты HALT
+    и прерванной концом ввода инструкции учитываются, но в число исполнений не входят,
+    как и в `instr_counter`.
+    """
+
+    def __init__(self, data_path: DataPath):
+        super().__init__(data_path)
+        self.instructions = [0] * len(data_path.memory)  # адрес -> сколько раз исполнена
+        self.ticks = [0] * len(data_path.memory)  # адрес -> такты
+
+    def step(self, budget: int) -> int:
+        addr = self.regs[13]
+        start = self._tick
+        try:
+            self.decode_and_execute_instruction()
+            self.instructions[addr] += 1
+        finally:
+            self.ticks[addr] += self._tick - start
+        return 1
+
+
+control_units: dict[str, type[ControlUnit]] = {
+    "micro": ControlUnit,
+    "decoded": DecodedControlUnit,
+    "block": BlockControlUnit,
+    "fast": FastControlUnit,
+    "profile": ProfilingControlUnit,
+}
+
+
+def execute(
+    control_unit: ControlUnit,
+    instr_counter: int,
+    limit: int,
+    stop: int,
+    trace: bool,
+    on_snapshot: Callable[[MachineSnapshot], None] | None,
+) -> int:
+    """Цикл моделирования до HALT или лимита; на stop < limit снимок передаётся в on_snapshot."""
+    # stacklevel=3: записи журнала относятся к simulation
     try:
         while instr_counter < limit:
-            control_unit.decode_and_execute_instruction()
-            instr_counter += 1
-            logging.debug("%s", control_unit)
+            instr_counter += control_unit.step(stop - instr_counter)
+            if trace:
+                logging.debug("%s", control_unit, stacklevel=3)
+            if instr_counter == stop < limit:
+                on_snapshot(control_unit.snapshot(instr_counter))
+                stop = limit
     except EOFError:
-        logging.warning("Input buffer is empty!")
+        if trace:
+            logging.warning("Input buffer is empty!", stacklevel=3)
     except StopIteration:
         pass
+    return instr_counter
+
+
+def run(
+    mem: Sequence[Word] | Memory,
+    input_tokens: InputPort | Sequence[str],
+    limit: int,
+    mode: str = "micro",
+    trace: bool = True,
+    output: OutputPort | None = None,
+    resume: MachineSnapshot | None = None,
+    snapshot_at: int | None = None,
+    on_snapshot: Callable[[MachineSnapshot], None] | None = None,
+) -> tuple[DataPath, ControlUnit, int]:
+    """Исполнять программу до HALT или лимита, вернуть DataPath, ControlUnit и число инструкций.
+
+    С resume исполнение продолжается со снимка (лимит -- по общему числу инструкций),
+    после snapshot_at инструкций снимок передаётся в on_snapshot.
+    """
+    ports: dict[int, InputPort | Sequence[str]] = {}
+    ports[0] = input_tokens
+    data_path = DataPath(mem, ports, output_ports={0: output or BufferOutput()})
+    control_unit = control_units[mode](data_path)
+    instr_counter = control_unit.restore(resume) if resume is not None else 0
+    stop = snapshot_at if snapshot_at is not None and instr_counter < snapshot_at < limit else limit
+
+    # stacklevel=2: в журнале записи относятся к вызывающей simulation, как и раньше
+    if trace:
+        logging.debug("%s", control_unit, stacklevel=2)
+    instr_counter = execute(control_unit, instr_counter, limit, stop, trace, on_snapshot)
+    control_unit.sync()
+    data_path.output_ports[0].flush()
+    return data_path, control_unit, instr_counter
+
+
+def machine_state(data_path: DataPath, control_unit: ControlUnit, instr_counter: int) -> dict:
+    """Архитектурное состояние для сравнения режимов: регистры без dr, флаги, вывод, счётчики."""
+    return {
+        "registers": [data_path.registers[reg] for reg in Register if reg is not dr],
+        "flags": (data_path.neg(), data_path.zero()),
+        "output": data_path.output_ports[0].getvalue(),
+        "instr_counter": instr_counter,
+        "ticks": control_unit.current_tick(),
+    }
+
+
+def cross_check(reference: dict, actual: dict, mode: str) -> None:
+    for key, value in reference.items():
+        if actual[key] != value:
+            raise AssertionError("{} differs in mode {}: {} (micro: {})".format(key, mode, actual[key], value))
+
+
+def simulation(
+    mem: Sequence[Word] | Memory,
+    input_tokens: InputPort | Sequence[str],
+    limit: int,
+    mode: str = "micro",
+    check: bool = False,
+    output: OutputPort | None = None,
+    resume: MachineSnapshot | None = None,
+    snapshot_at: int | None = None,
+    on_snapshot: Callable[[MachineSnapshot], None] | None = None,
+):
+    """Запустить модель процессора.
+
+    Ввод -- символы в памяти или устройство `InputPort`, вывод по умолчанию копится в `BufferOutput`.
+    С check=True программа дополнительно исполняется в режиме `micro`, и регистры,
+    флаги, вывод, число инструкций и тактов сравниваются с выбранным режимом;
+    для этого ввод и вывод должны быть в памяти.
+    Снимки -- см. `run`: при восстановлении ввод подаётся заново, чтение продолжается с позиции снимка.
+    """
+    if check:
+        assert not isinstance(input_tokens, InputPort), "check requires in-memory input"
+        assert output is None, "check requires in-memory output"
+        reference_mem = mem.copy() if isinstance(mem, Memory) else mem
+        reference = machine_state(*run(reference_mem, input_tokens, limit, trace=False, resume=resume))
+    data_path, control_unit, instr_counter = run(
+        mem, input_tokens, limit, mode, output=output, resume=resume, snapshot_at=snapshot_at, on_snapshot=on_snapshot
+    )
+    if check:
+        cross_check(reference, machine_state(data_path, control_unit, instr_counter), mode)
 
     if instr_counter >= limit:
         logging.warning("Limit exceeded!")
-    logging.info("output_buffer: %s", repr("".join(data_path.output_ports[0])))
-    return "".join(data_path.output_ports[0]), instr_counter, control_unit.current_tick()
-
-
-def main(code_file, input_file):
-    code: list[Word] = read_code(code_file)
-    with open(input_file, encoding="utf-8") as file:
-        input_text = file.read()
-        input_token = []
-        for char in input_text:
-            input_token.append(char)
-
-    output, instr_counter, ticks = simulation(
-        code,
-        input_tokens=input_token,
-        limit=100000,
-    )
-
-    print("".join(output))
+    port = data_path.output_ports[0]
+    if isinstance(port, StreamOutput):
+        logging.info("output_stream: %d chars", port.written)
+    else:
+        logging.info("output_buffer: %s", repr(port.getvalue()))
+    return port.getvalue(), instr_counter, control_unit.current_tick()
+
+
+def main(
+    code_file,
+    input_file,
+    mode="micro",
+    check=False,
+    stream=False,
+    limit=100000,
+    resume=None,
+    snapshot=None,
+    snapshot_at=None,
+):
+    """Исполнить программу из code_file на вводе из input_file ("-" -- stdin).
+
+    С stream=True ввод читается кусками, а вывод печатается по мере исполнения.
+    resume -- файл снимка, с которого продолжить; snapshot -- куда записать снимок после snapshot_at инструкций.
+    """
+    code: Sequence[Word] = read_code(code_file)
+    snapshots = {
+        "resume": MachineSnapshot.load(resume) if resume else None,
+        "snapshot_at": snapshot_at,
+        "on_snapshot": (lambda state: state.save(snapshot)) if snapshot else None,
+    }
+    file = sys.stdin if input_file == "-" else open(input_file, encoding="utf-8")
+    try:
+        if stream:
+            port = StreamOutput(sys.stdout)
+            output, instr_counter, ticks = simulation(
+                code,
+                input_tokens=StreamInput(file, tie=port),
+                limit=limit,
+                mode=mode,
+                output=port,
+                **snapshots,
+            )
+        else:
+            output, instr_counter, ticks = simulation(
+                code,
+                input_tokens=file.read(),
+                limit=limit,
+                mode=mode,
+                check=check,
+                **snapshots,
+            )
+    finally:
+        if file is not sys.stdin:
+            file.close()
+        if isinstance(code, ObjectCode):
+            code.close()
+
+    print(output)
     print("instr_counter: ", instr_counter, "ticks:", ticks)
 
 
 if __name__ == "__main__":
-    logging.getLogger().setLevel(logging.DEBUG)
-    assert len(sys.argv) == 2, "Wrong arguments: emulator.py <code_file> <input_file>"
-    code_file, input_file = sys.argv
-    main(code_file, input_file)
+    parser = argparse.ArgumentParser(description="Processor model")
+    parser.add_argument("code_file", help="machine code (JSON or object file)")
+    parser.add_argument("input_file", help="input, '-' for stdin")
+    parser.add_argument("--mode", default="micro", choices=sorted(control_units), help="processor model")
+    parser.add_argument("--check", action="store_true", help="cross-check against micro (implies --buffered)")
+    parser.add_argument("--buffered", action="store_true", help="read input at once, print output after halt")
+    parser.add_argument("--limit", type=int, default=100000, help="instruction limit")
+    parser.add_argument("--resume", metavar="SNAPSHOT", help="continue from a snapshot file")
+    parser.add_argument("--snapshot", metavar="SNAPSHOT", help="write a snapshot file after --snapshot-at instructions")
+    parser.add_argument("--snapshot-at", type=int, metavar="N", help="instruction count for --snapshot")
+    parser.add_argument("-q", "--quiet", action="store_true", help="no per-instruction log")
+    args = parser.parse_args()
+    assert (args.snapshot is None) == (args.snapshot_at is None), "--snapshot and --snapshot-at go together"
+
+    logging.getLogger().setLevel(logging.WARNING if args.quiet else logging.DEBUG)
+    main(
+        args.code_file,
+        args.input_file,
+        mode=args.mode,
+        check=args.check,
+        stream=not (args.buffered or args.check),
+        limit=args.limit,
+        resume=args.resume,
+        snapshot=args.snapshot,
+        snapshot_at=args.snapshot_at,
+    )
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import json
+from collections.abc import Sequence
 from enum import Enum
 
 
@@ -22,16 +23,30 @@ class Opcode(Enum):
     MV = "MV"
     READ = "READ"
     PRINT = "PRINT"
+    READ_BLOCK = "READ_BLOCK"  # READ into memory from arg1 until 0, at most arg2 chars; arg1 moves past the block
+    PRINT_BLOCK = "PRINT_BLOCK"  # PRINT arg2 cells from arg1; arg1 moves past the block
     JLE = "JLE"  # less or equals
     JL = "JL"  # less
     JGE = "JGE"  # greater or equals
     JG = "JG"  # greater
     JNE = "JNE"  # not equals
     JE = "JE"  # equals
+    BRLE = "BRLE"  # fused: CMP arg2, arg3; JLE arg1
+    BRL = "BRL"
+    BRGE = "BRGE"
+    BRG = "BRG"
+    BRNE = "BRNE"
+    BRE = "BRE"
     JUMP = "JUMP"
+    CALL = "CALL"  # push return address, jump
+    RET = "RET"  # pop return address into pc
     ADD = "ADD"
     ADD_LIT = "ADD_LIT"
     SUB = "SUB"
+    MUL = "MUL"  # extended
+    MUL_LIT = "MUL_LIT"  # extended
+    DIV = "DIV"  # extended, rounds toward zero
+    MOD = "MOD"  # extended, sign of the dividend
     NEG = "NEG"
     SHL = "SHL"
     SHR = "SHR"
@@ -39,6 +54,7 @@ class Opcode(Enum):
     OR = "OR"
     XOR = "XOR"
     CMP = "CMP"
+    CMP_LIT = "CMP_LIT"
     PUSH = "PUSH"
     POP = "POP"
     INC = "INC"
@@ -46,6 +62,30 @@ class Opcode(Enum):
     HALT = "HALT"
 
 
+# сравнение и условный переход одной инструкцией: `BRcc target, a, b` -- это `CMP a, b; Jcc target`
+# (флаги те же), b -- регистр или число; адрес перехода, как и у Jcc, в arg1
+fused_branches: dict[Opcode, Opcode] = {
+    Opcode.BRE: Opcode.JE,
+    Opcode.BRNE: Opcode.JNE,
+    Opcode.BRG: Opcode.JG,
+    Opcode.BRGE: Opcode.JGE,
+    Opcode.BRL: Opcode.JL,
+    Opcode.BRLE: Opcode.JLE,
+}
+
+# блочный ввод-вывод: `READ_BLOCK addr, max, port`, `PRINT_BLOCK addr, len, port` -- регистры адреса и длины,
+# порт в arg3; такты зависят от длины блока (`machine.emulator.block_ticks`)
+block_transfers: set[Opcode] = {Opcode.READ_BLOCK, Opcode.PRINT_BLOCK}
+
+# необязательное расширение системы команд: аппаратные умножение, деление и остаток
+extended_opcodes: set[Opcode] = {Opcode.MUL, Opcode.MUL_LIT, Opcode.DIV, Opcode.MOD}
+
+# профиль системы команд -> опкоды, которые транслятор может использовать
+isa_profiles: dict[str, set[Opcode]] = {
+    "base": set(Opcode) - extended_opcodes,
+    "extended": set(Opcode),
+}
+
 mem_size: int = 4096
 
 
@@ -82,30 +122,50 @@ class StaticMemAddressStub:
         self.offset = offset
 
 
+class VirtualRegister:
+    """Переменная транслятора до распределения регистров: в машинный код попадает регистром или слотом стека."""
+
+    name: str
+    slot: int  # смещение переменной в стеке (как у LD_STACK), туда она вытесняется
+
+    def __init__(self, name: str, slot: int):
+        self.name = name
+        self.slot = slot
+
+    def __repr__(self):
+        return "%{}@{}".format(self.name, self.slot)
+
+
 class Word:
     index: int
     opcode: Opcode
-    arg1: int | Register | StaticMemAddressStub
-    arg2: int | Register | StaticMemAddressStub
+    arg1: int | Register | StaticMemAddressStub | VirtualRegister
+    arg2: int | Register | StaticMemAddressStub | VirtualRegister
+    arg3: int | Register | None  # только у `fused_branches` и `block_transfers`
 
-    def __init__(self, index: int, opcode: Opcode, arg1=None, arg2=None):
+    def __init__(self, index: int, opcode: Opcode, arg1=None, arg2=None, arg3=None):
         self.opcode = opcode
         self.arg1 = arg1
         self.arg2 = arg2
+        self.arg3 = arg3
         self.index = index
 
 
-def write_code(filename: str, code: list[Word]) -> None:
-    """Записать машинный код в файл."""
+def write_code(filename: str, code: list[Word], binary: bool = False) -> None:
+    """Записать машинный код в файл: JSON или, с binary=True, бинарный объектный файл."""
+    if binary:
+        # objfile импортирует isa
+        from machine.objfile import write_object
+
+        write_object(filename, code)
+        return
     with open(filename, "w", encoding="utf-8") as file:
         buf = []
         for instr in code:
-            buf.append(
-                json.dumps(
-                    {"index": instr.index, "opcode": instr.opcode.value, "arg1": instr.arg1, "arg2": instr.arg2},
-                    cls=EnumEncoder,
-                )
-            )
+            fields = {"index": instr.index, "opcode": instr.opcode.value, "arg1": instr.arg1, "arg2": instr.arg2}
+            if instr.arg3 is not None:
+                fields["arg3"] = instr.arg3
+            buf.append(json.dumps(fields, cls=EnumEncoder))
         file.write("[" + ",\n ".join(buf) + "]")
 
 
@@ -115,7 +175,12 @@ def convert_to_register(arg):
     return arg
 
 
-def read_code(filename) -> list[Word]:
+def read_code(filename) -> Sequence[Word]:
+    """Прочитать машинный код; формат (JSON или бинарный объектный файл) определяется по заголовку."""
+    from machine.objfile import ObjectCode, is_object_file
+
+    if is_object_file(filename):
+        return ObjectCode(filename)
     with open(filename, encoding="utf-8") as file:
         code = json.loads(file.read())
     prog: list[Word] = []
@@ -125,8 +190,7 @@ def read_code(filename) -> list[Word]:
             Opcode[instr["opcode"]],
             convert_to_register(instr["arg1"]),
             convert_to_register(instr["arg2"]),
+            convert_to_register(instr.get("arg3")),
         )
         prog.append(word)
-    for index in range(len(prog), mem_size):
-        prog.append(Word(index, Opcode.JUMP, 0))
     return prog
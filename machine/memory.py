@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+from array import array
+from collections.abc import Sequence
+
+from machine.isa import Opcode, Register, Word
+
+opcodes: list[Opcode] = list(Opcode)  # номер опкода -> опкод
+
+opcode_ids: dict[Opcode, int] = {opcode: opcode_id for opcode_id, opcode in enumerate(opcodes)}
+
+registers: list[Register] = list(Register)
+
+# теги аргументов
+ARG_NONE = 0
+ARG_INT = 1
+ARG_REG = 2
+ARG_WIDE = 3  # число вне int64: в колонке -- его номер в `Memory.wide`
+
+int64_range = range(-(1 << 63), 1 << 63)
+
+page_bits = 8  # страница -- 256 слов
+
+columns: tuple[str, ...] = ("opcodes", "arg1", "arg2", "arg3", "tag1", "tag2", "tag3")
+
+
+def encode_arg(arg: int | Register | None) -> tuple[int, int]:
+    if arg is None:
+        return ARG_NONE, 0
+    if isinstance(arg, Register):
+        return ARG_REG, arg.value
+    return ARG_INT, arg
+
+
+def decode_arg(tag: int, value: int) -> int | Register | None:
+    if tag == ARG_INT:
+        return value
+    if tag == ARG_REG:
+        return registers[value]
+    return None
+
+
+class MemorySnapshot:
+    """Снимок памяти по страницам: для каждой страницы -- байты её колонок.
+
+    Страницы неизменяемы, поэтому снимки делят общие (не записанные между снимками) страницы.
+    """
+
+    size: int
+    pages: list[tuple[bytes, ...]]
+    wide: dict[int, int]
+
+    def __init__(self, size: int, pages: list[tuple[bytes, ...]], wide: dict[int, int] | None = None):
+        self.size = size
+        self.pages = pages
+        self.wide = wide or {}
+
+
+class Memory:
+    """Память машины в виде колонок: номер опкода, arg1, arg2, arg3 (int64) и теги аргументов.
+
+    Регистры в аргументах хранятся своими номерами, тег отличает их от чисел. Числа вне int64
+    (регистры машины не ограничены) лежат в словаре `wide`, в колонке -- их номер с тегом `ARG_WIDE`.
+    Незаполненные ячейки -- `JUMP 0`, как и раньше.
+
+    Память помнит последний снимок (`base`) и страницы, записанные после него (`dirty`),
+    поэтому снимок и восстановление копируют только изменившиеся страницы.
+    """
+
+    size: int
+
+    base: MemorySnapshot | None
+
+    dirty: set[int]
+
+    opcodes: array
+    arg1: array
+    arg2: array
+    arg3: array
+    tag1: array
+    tag2: array
+    tag3: array
+
+    wide: dict[int, int]  # номер -> число вне int64
+    next_wide: int  # номера не переиспользуются, поэтому другое число меняет и байты страницы
+
+    def __init__(self, size: int):
+        self.size = size
+        self.opcodes = array("B", [opcode_ids[Opcode.JUMP]]) * size
+        self.arg1 = array("q", bytes(8 * size))
+        self.arg2 = array("q", bytes(8 * size))
+        self.arg3 = array("q", bytes(8 * size))
+        self.tag1 = array("B", [ARG_INT]) * size
+        self.tag2 = array("B", [ARG_NONE]) * size
+        self.tag3 = array("B", [ARG_NONE]) * size
+        self.wide = {}
+        self.next_wide = 0
+        self.base = None
+        self.dirty = set()
+
+    @classmethod
+    def from_words(cls, words: Sequence[Word], size: int) -> Memory:
+        memory = cls(size)
+        for addr, word in enumerate(words):
+            memory.store_word(addr, word)
+        return memory
+
+    def copy(self) -> Memory:
+        memory = Memory.__new__(Memory)
+        memory.size = self.size
+        for column in columns:
+            setattr(memory, column, getattr(self, column)[:])
+        memory.wide = dict(self.wide)
+        memory.next_wide = self.next_wide
+        memory.base = self.base
+        memory.dirty = set(self.dirty)
+        return memory
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, addr: int) -> Word:
+        if addr < 0:
+            addr += self.size
+        decode = self.decode if self.wide else decode_arg
+        return Word(
+            addr,
+            opcodes[self.opcodes[addr]],
+            decode(self.tag1[addr], self.arg1[addr]),
+            decode(self.tag2[addr], self.arg2[addr]),
+            decode(self.tag3[addr], self.arg3[addr]),
+        )
+
+    def encode(self, arg: int | Register | None) -> tuple[int, int]:
+        """Как `encode_arg`, но число вне int64 кладётся в `wide`."""
+        if arg.__class__ is int and arg not in int64_range:
+            self.next_wide += 1
+            self.wide[self.next_wide] = arg
+            return ARG_WIDE, self.next_wide
+        return encode_arg(arg)
+
+    def decode(self, tag: int, value: int) -> int | Register | None:
+        if tag == ARG_WIDE:
+            return self.wide[value]
+        return decode_arg(tag, value)
+
+    def release(self, tags: array, args: array, addr: int) -> None:
+        """Забыть число вне int64, которое перезаписывается в ячейке addr."""
+        if tags[addr] == ARG_WIDE:
+            self.wide.pop(args[addr], None)
+
+    def store_word(self, addr: int, word: Word) -> None:
+        self.dirty.add((addr % self.size) >> page_bits)
+        if self.wide:
+            for tags, args in ((self.tag1, self.arg1), (self.tag2, self.arg2), (self.tag3, self.arg3)):
+                self.release(tags, args, addr)
+        self.opcodes[addr] = opcode_ids[word.opcode]
+        self.tag1[addr], self.arg1[addr] = self.encode(word.arg1)
+        self.tag2[addr], self.arg2[addr] = self.encode(word.arg2)
+        self.tag3[addr], self.arg3[addr] = self.encode(word.arg3)
+
+    def opcode(self, addr: int) -> Opcode:
+        return opcodes[self.opcodes[addr]]
+
+    def read(self, addr: int) -> int | Register | None:
+        """Значение ячейки -- её первый аргумент."""
+        if self.tag1[addr] == ARG_INT:
+            return self.arg1[addr]
+        return self.decode(self.tag1[addr], self.arg1[addr])
+
+    def write(self, addr: int, value: int | Register | None) -> None:
+        self.dirty.add((addr % self.size) >> page_bits)
+        if self.wide:
+            self.release(self.tag1, self.arg1, addr)
+        if value.__class__ is int and value in int64_range:
+            self.tag1[addr] = ARG_INT
+            self.arg1[addr] = value
+        else:
+            self.tag1[addr], self.arg1[addr] = self.encode(value)
+
+    def read_block(self, addr: int, count: int) -> list[int | Register | None]:
+        """Значения count ячеек с адреса addr."""
+        end = addr + max(count, 0)
+        assert 0 <= addr, "Block out of memory: {}".format(addr)
+        assert end <= self.size, "Block out of memory: {}".format(end)
+        if self.tag1[addr:end].count(ARG_INT) == end - addr:
+            return self.arg1[addr:end].tolist()
+        return [self.read(cell) for cell in range(addr, end)]
+
+    def write_block(self, addr: int, values: list[int]) -> None:
+        """Записать числа в ячейки с адреса addr."""
+        end = addr + len(values)
+        assert 0 <= addr, "Block out of memory: {}".format(addr)
+        assert end <= self.size, "Block out of memory: {}".format(end)
+        try:
+            column = array("q", values)
+        except OverflowError:
+            for cell, value in enumerate(values, addr):
+                self.write(cell, value)
+            return
+        self.dirty.update(range(addr >> page_bits, ((end - 1) >> page_bits) + 1))
+        if self.wide:
+            for cell in range(addr, end):
+                self.release(self.tag1, self.arg1, cell)
+        self.tag1[addr:end] = array("B", [ARG_INT]) * len(values)
+        self.arg1[addr:end] = column
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(getattr(self, column)) * getattr(self, column).itemsize for column in columns)
+
+    @property
+    def page_count(self) -> int:
+        return -(-self.size >> page_bits)
+
+    def page(self, page: int) -> tuple[bytes, ...]:
+        start, end = page << page_bits, min((page + 1) << page_bits, self.size)
+        return tuple(getattr(self, column)[start:end].tobytes() for column in columns)
+
+    def load_page(self, page: int, data: tuple[bytes, ...]) -> None:
+        start, end = page << page_bits, min((page + 1) << page_bits, self.size)
+        for column, chunk in zip(columns, data):
+            values = getattr(self, column)
+            values[start:end] = array(values.typecode, chunk)
+
+    def snapshot(self) -> MemorySnapshot:
+        """Снимок памяти: копируются только страницы, записанные после прошлого снимка."""
+        if self.base is None:
+            pages = [self.page(page) for page in range(self.page_count)]
+        else:
+            pages = list(self.base.pages)
+            for page in self.dirty:
+                pages[page] = self.page(page)
+        self.base = MemorySnapshot(self.size, pages, dict(self.wide))
+        self.dirty.clear()
+        return self.base
+
+    def restore(self, snapshot: MemorySnapshot) -> list[int]:
+        """Вернуть память к снимку, вернуть номера переписанных страниц."""
+        assert snapshot.size == self.size, "Snapshot of another memory size: {}".format(snapshot.size)
+        if self.base is None:
+            changed = list(range(self.page_count))
+        else:
+            changed = [
+                page
+                for page, (current, target) in enumerate(zip(self.base.pages, snapshot.pages))
+                if page in self.dirty or current is not target
+            ]
+        for page in changed:
+            self.load_page(page, snapshot.pages[page])
+        self.wide = dict(snapshot.wide)
+        self.next_wide = max(self.next_wide, max(snapshot.wide, default=0))
+        self.base = snapshot
+        self.dirty.clear()
+        return changed
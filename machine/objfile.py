@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import mmap
+import struct
+import sys
+from array import array
+from collections.abc import Sequence
+
+from machine.isa import Opcode, Word
+from machine.memory import Memory, decode_arg, encode_arg, int64_range, opcode_ids
+
+# Бинарный объектный файл:
+#   заголовок  -- MAGIC, версия, число опкодов в таблице, число слов;
+#   таблица    -- имена опкодов, встречающихся в программе (длина + ASCII), номер в таблице -- опкод в файле;
+#   колонки    -- arg1, arg2 и arg3 (int64), опкоды, tag1, tag2 и tag3 (uint8), little-endian, по слову на адрес.
+# Колонки выровнены на 8 байт, поэтому загрузка -- копирование кусков файла в колонки `Memory`.
+
+MAGIC = b"VJSO"
+
+VERSION = 3  # 2 -- колонки arg3 и tag3 для `machine.isa.fused_branches`; 3 -- аргументы int64
+
+header = struct.Struct("<4sHHI")
+
+
+def is_object_file(filename: str) -> bool:
+    with open(filename, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def _column(typecode: str, values) -> bytes:
+    column = array(typecode, values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+
+def write_object(filename: str, code: Sequence[Word]) -> None:
+    """Записать машинный код в бинарный объектный файл."""
+    table: dict[Opcode, int] = {}
+    for word in code:
+        table.setdefault(word.opcode, len(table))
+    args1 = [encode_arg(word.arg1) for word in code]
+    args2 = [encode_arg(word.arg2) for word in code]
+    args3 = [encode_arg(word.arg3) for word in code]
+    wide = [value for _, value in args1 + args2 + args3 if value not in int64_range]
+    assert not wide, "Object file arguments are int64, use the JSON format: {}".format(wide[0])
+
+    names = b"".join(bytes([len(opcode.value)]) + opcode.value.encode("ascii") for opcode in table)
+    padding = -(header.size + len(names)) % 8
+    with open(filename, "wb") as file:
+        file.write(header.pack(MAGIC, VERSION, len(table), len(code)))
+        file.write(names + bytes(padding))
+        file.write(_column("q", [value for _, value in args1]))
+        file.write(_column("q", [value for _, value in args2]))
+        file.write(_column("q", [value for _, value in args3]))
+        file.write(bytes(table[word.opcode] for word in code))
+        file.write(bytes(tag for tag, _ in args1))
+        file.write(bytes(tag for tag, _ in args2))
+        file.write(bytes(tag for tag, _ in args3))
+
+
+class ObjectCode(Sequence[Word]):
+    """Машинный код из объектного файла, отображённого в память через mmap.
+
+    Слова декодируются по обращению, `to_memory` копирует колонки в `Memory` целиком.
+    Отображение освобождает `close` или выход из `with`; скопированная `Memory` от него не зависит.
+    """
+
+    def __init__(self, filename: str):
+        with open(filename, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, opcode_count, self.size = header.unpack_from(self.buffer)
+        assert magic == MAGIC, "Not an object file: {}".format(filename)
+        assert version == VERSION, "Unsupported object file version: {}".format(version)
+
+        self.opcodes: list[Opcode] = []
+        offset = header.size
+        for _ in range(opcode_count):
+            length = self.buffer[offset]
+            self.opcodes.append(Opcode[self.buffer[offset + 1 : offset + 1 + length].decode("ascii")])
+            offset += 1 + length
+        offset += -offset % 8
+
+        self.arg1_offset = offset
+        self.arg2_offset = self.arg1_offset + 8 * self.size
+        self.arg3_offset = self.arg2_offset + 8 * self.size
+        self.opcodes_offset = self.arg3_offset + 8 * self.size
+        self.tag1_offset = self.opcodes_offset + self.size
+        self.tag2_offset = self.tag1_offset + self.size
+        self.tag3_offset = self.tag2_offset + self.size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __enter__(self) -> ObjectCode:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.buffer.close()
+
+    @property
+    def closed(self) -> bool:
+        return self.buffer.closed
+
+    def __getitem__(self, addr):
+        if isinstance(addr, slice):
+            return [self[i] for i in range(*addr.indices(self.size))]
+        if addr < 0:
+            addr += self.size
+        if not 0 <= addr < self.size:
+            raise IndexError(addr)
+        buffer = self.buffer
+        (arg1,) = struct.unpack_from("<q", buffer, self.arg1_offset + 8 * addr)
+        (arg2,) = struct.unpack_from("<q", buffer, self.arg2_offset + 8 * addr)
+        (arg3,) = struct.unpack_from("<q", buffer, self.arg3_offset + 8 * addr)
+        return Word(
+            addr,
+            self.opcodes[buffer[self.opcodes_offset + addr]],
+            decode_arg(buffer[self.tag1_offset + addr], arg1),
+            decode_arg(buffer[self.tag2_offset + addr], arg2),
+            decode_arg(buffer[self.tag3_offset + addr], arg3),
+        )
+
+    def _bytes(self, offset: int, size: int) -> bytes:
+        return self.buffer[offset : offset + size]
+
+    def _int_column(self, offset: int) -> array:
+        column = array("q")
+        column.frombytes(self._bytes(offset, 8 * self.size))
+        if sys.byteorder == "big":
+            column.byteswap()
+        return column
+
+    def to_memory(self, mem_size: int) -> Memory:
+        """Память машины с программой в начале: колонки копируются кусками, без построения `Word`."""
+        assert self.size <= mem_size, "Program does not fit in memory: {} > {}".format(self.size, mem_size)
+        # номер опкода в файле -> номер опкода в Memory
+        translation = bytearray(256)
+        for file_id, opcode in enumerate(self.opcodes):
+            translation[file_id] = opcode_ids[opcode]
+
+        memory = Memory(mem_size)
+        size = self.size
+        memory.arg1[:size] = self._int_column(self.arg1_offset)
+        memory.arg2[:size] = self._int_column(self.arg2_offset)
+        memory.arg3[:size] = self._int_column(self.arg3_offset)
+        memory.opcodes[:size] = array("B", self._bytes(self.opcodes_offset, size).translate(translation))
+        memory.tag1[:size] = array("B", self._bytes(self.tag1_offset, size))
+        memory.tag2[:size] = array("B", self._bytes(self.tag2_offset, size))
+        memory.tag3[:size] = array("B", self._bytes(self.tag3_offset, size))
+        return memory
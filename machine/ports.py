@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from collections.abc import Sequence
+from typing import TextIO
+
+
+class InputPort(ABC):
+    """Устройство ввода: по символу за чтение, 0 -- конец ввода."""
+
+    @abstractmethod
+    def read(self) -> int:
+        """Следующий символ или 0."""
+
+    def read_block(self, limit: int) -> list[int]:
+        """Прочитать до конца ввода (0 тоже читается, но не возвращается), не больше limit символов."""
+        chars = []
+        while len(chars) < limit:
+            char = self.read()
+            if char == 0:
+                break
+            chars.append(char)
+        return chars
+
+    @abstractmethod
+    def tell(self) -> int:
+        """Сколько символов прочитано."""
+
+    @abstractmethod
+    def seek(self, position: int) -> None:
+        """Продолжить чтение с символа position (для восстановления из снимка)."""
+
+
+class OutputPort(ABC):
+    """Устройство вывода: принимает коды символов."""
+
+    @abstractmethod
+    def write(self, char: int) -> None:
+        """Вывести символ."""
+
+    def write_block(self, chars: list[int]) -> None:
+        for char in chars:
+            self.write(char)
+
+    def flush(self) -> None:
+        """Отдать накопленный вывод."""
+
+    def getvalue(self) -> str:
+        """Вывод, оставшийся в памяти устройства."""
+        return ""
+
+    def restore(self, text: str) -> None:
+        """Вернуть вывод, сделанный до снимка; потоковые устройства его уже отдали."""
+
+
+class BufferInput(InputPort):
+    """Ввод из строки или списка символов, целиком лежащих в памяти.
+
+    Читает по индексу, последовательность не меняется.
+    """
+
+    def __init__(self, tokens: Sequence[str]):
+        self.tokens = tokens
+        self.position = 0
+
+    def read(self) -> int:
+        if self.position >= len(self.tokens):
+            return 0
+        char = self.tokens[self.position]
+        self.position += 1
+        return ord(char)
+
+    def read_block(self, limit: int) -> list[int]:
+        chars = [ord(char) for char in self.tokens[self.position : self.position + max(limit, 0)]]
+        if 0 in chars:
+            chars = chars[: chars.index(0)]
+            self.position += 1
+        self.position += len(chars)
+        return chars
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, position: int) -> None:
+        self.position = position
+
+
+class StreamInput(InputPort):
+    """Ввод из файла или stdin кусками: до конца строки, но не больше chunk_size символов.
+
+    В памяти держится только текущий кусок. Перед чтением из потока сбрасывается вывод tie:
+    приглашение программы видно до того, как она остановится в ожидании ввода.
+    """
+
+    def __init__(self, stream: TextIO, chunk_size: int = 1 << 16, tie: OutputPort | None = None):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.tie = tie
+        self.chunk = ""
+        self.position = 0
+        self.consumed = 0  # символов в прочитанных раньше кусках
+
+    def next_chunk(self) -> bool:
+        """Прочитать следующий кусок, False -- поток кончился."""
+        if self.tie is not None:
+            self.tie.flush()
+        self.consumed += len(self.chunk)
+        self.chunk = self.stream.readline(self.chunk_size)
+        self.position = 0
+        return bool(self.chunk)
+
+    def read(self) -> int:
+        if self.position >= len(self.chunk) and not self.next_chunk():
+            return 0
+        char = self.chunk[self.position]
+        self.position += 1
+        return ord(char)
+
+    def tell(self) -> int:
+        return self.consumed + self.position
+
+    def seek(self, position: int) -> None:
+        """Пропустить символы до position; поток назад не перематывается."""
+        assert position >= self.tell(), "Cannot seek stream input backwards"
+        while self.tell() < position:
+            if self.position >= len(self.chunk) and not self.next_chunk():
+                return
+            self.position = min(len(self.chunk), self.position + position - self.tell())
+
+
+class BufferOutput(OutputPort):
+    """Вывод в память, забирается через getvalue после останова."""
+
+    def __init__(self):
+        self.chars: list[str] = []
+
+    def write(self, char: int) -> None:
+        self.chars.append(chr(char))
+
+    def write_block(self, chars: list[int]) -> None:
+        self.chars += map(chr, chars)
+
+    def getvalue(self) -> str:
+        return "".join(self.chars)
+
+    def restore(self, text: str) -> None:
+        self.chars = list(text)
+
+
+class StreamOutput(OutputPort):
+    """Вывод в sink (файл, stdout) кусками по chunk_size символов во время исполнения.
+
+    Отправленный вывод не хранится, `getvalue` возвращает пустую строку; `written` -- сколько символов выведено.
+    """
+
+    def __init__(self, sink: TextIO, chunk_size: int = 1 << 12):
+        self.sink = sink
+        self.chunk_size = chunk_size
+        self.chars: list[str] = []
+        self.written = 0
+
+    def write(self, char: int) -> None:
+        self.chars.append(chr(char))
+        if len(self.chars) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.chars:
+            self.written += len(self.chars)
+            self.sink.write("".join(self.chars))
+            self.chars.clear()
+        self.sink.flush()
+
+
+def as_input(tokens: InputPort | Sequence[str]) -> InputPort:
+    if isinstance(tokens, InputPort):
+        return tokens
+    return BufferInput(tokens)
@@ -0,0 +1,157 @@
+"""Профиль исполнения по исходному тексту.
+
+Модель `profile` считает исполнения и такты по адресам инструкций, отладочная информация
+транслятора (`<target>.dbg`, см. `machine.debuginfo`) сводит их по строкам исходного текста
+и циклам while. Кроме отчёта, профиль выводится в свёрнутые стеки (`цикл;цикл;оператор такты`)
+для flamegraph.pl, speedscope и подобных.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+from collections.abc import Sequence
+
+from machine.debuginfo import DebugInfo, debug_filename, read_debug_info
+from machine.emulator import run
+from machine.isa import Word, read_code
+from machine.memory import Memory
+from machine.objfile import ObjectCode
+from machine.ports import InputPort
+
+
+class Profile:
+    """Исполнения и такты по адресам вместе с отладочной информацией программы."""
+
+    def __init__(self, memory: Memory, instructions: list[int], ticks: list[int], info: DebugInfo | None):
+        self.memory = memory
+        self.instructions = instructions
+        self.ticks = ticks
+        self.info = info or DebugInfo([], [])
+
+    def executed(self) -> list[int]:
+        """Адреса исполнявшихся инструкций."""
+        return [addr for addr, ticks in enumerate(self.ticks) if ticks]
+
+    def total_ticks(self) -> int:
+        return sum(self.ticks)
+
+    def by_line(self) -> dict[int, tuple[int, int]]:
+        """Строка исходного текста -> (исполнения, такты)."""
+        lines: dict[int, tuple[int, int]] = {}
+        for addr in self.executed():
+            line = self.info.location(addr).line
+            instructions, ticks = lines.get(line, (0, 0))
+            lines[line] = (instructions + self.instructions[addr], ticks + self.ticks[addr])
+        return lines
+
+    def by_loop(self) -> dict[int, tuple[int, int, int]]:
+        """Строка цикла while -> (проверки условия, исполнения, такты) вместе с вложенными операторами.
+
+        Проверки условия -- исполнения первой инструкции цикла, то есть число итераций
+        плюс по одной на каждый вход в цикл.
+        """
+        loops: dict[int, tuple[int, int, int]] = {}
+        for addr in self.executed():
+            location = self.info.location(addr)
+            for line in location.loops:
+                checks, instructions, ticks = loops.get(line, (-1, 0, 0))
+                if checks < 0:  # первый адрес цикла -- начало проверки условия
+                    checks = self.instructions[addr]
+                loops[line] = (checks, instructions + self.instructions[addr], ticks + self.ticks[addr])
+        return loops
+
+    def collapsed_stacks(self) -> list[str]:
+        """Свёрнутые стеки: `program;while@5;let@6 такты`, по строке на стек."""
+        stacks: dict[str, int] = {}
+        for addr in self.executed():
+            location = self.info.location(addr)
+            frames = ["program"] + ["while@{}".format(line) for line in location.loops]
+            if location.node != "while" and location.line:
+                frames.append("{}@{}".format(location.node, location.line))
+            stack = ";".join(frames)
+            stacks[stack] = stacks.get(stack, 0) + self.ticks[addr]
+        return ["{} {}".format(stack, ticks) for stack, ticks in stacks.items()]
+
+    def report(self, top: int = 10) -> str:
+        total = self.total_ticks() or 1
+        rows = ["{:>6} {:>12} {:>12} {:>7}  {}".format("line", "instructions", "ticks", "ticks%", "source")]
+        for line, (instructions, ticks) in sorted(self.by_line().items(), key=lambda item: -item[1][1]):
+            rows.append(
+                "{:>6} {:>12} {:>12} {:>6.1f}%  {}".format(
+                    line, instructions, ticks, 100 * ticks / total, self.info.source_line(line)
+                )
+            )
+
+        rows += [
+            "",
+            "{:>6} {:>12} {:>12} {:>12} {:>7}  {}".format(
+                "while", "checks", "instructions", "ticks", "ticks%", "source"
+            ),
+        ]
+        for line, (checks, instructions, ticks) in sorted(self.by_loop().items()):
+            rows.append(
+                "{:>6} {:>12} {:>12} {:>12} {:>6.1f}%  {}".format(
+                    line, checks, instructions, ticks, 100 * ticks / total, self.info.source_line(line)
+                )
+            )
+
+        rows += [
+            "",
+            "{:>6} {:>12} {:>12} {:>7}  {:<8} {}".format("pc", "instructions", "ticks", "ticks%", "opcode", "line"),
+        ]
+        hot = sorted(self.executed(), key=lambda addr: -self.ticks[addr])[:top]
+        for addr in hot:
+            rows.append(
+                "{:>6} {:>12} {:>12} {:>6.1f}%  {:<8} {}".format(
+                    addr,
+                    self.instructions[addr],
+                    self.ticks[addr],
+                    100 * self.ticks[addr] / total,
+                    self.memory[addr].opcode.name,
+                    self.info.location(addr).line,
+                )
+            )
+        return "\n".join(rows)
+
+
+def profile(
+    code: Sequence[Word] | Memory, input_tokens: InputPort | Sequence[str], limit: int, info: DebugInfo | None = None
+) -> tuple[str, int, Profile]:
+    """Исполнить программу в модели `profile`, вернуть вывод, число инструкций и профиль."""
+    data_path, control_unit, instr_counter = run(code, input_tokens, limit, mode="profile", trace=False)
+    result = Profile(data_path.memory, control_unit.instructions, control_unit.ticks, info)
+    return data_path.output_ports[0].getvalue(), instr_counter, result
+
+
+def main(code_file, input_file, limit=100000, top=10, stacks=None):
+    """Исполнить программу с профилем, напечатать вывод и отчёт; stacks -- файл для свёрнутых стеков."""
+    code = read_code(code_file)
+    info = read_debug_info(debug_filename(code_file))
+    if info is None:
+        logging.warning("No debug info for %s, lines are unknown", code_file)
+    with open(input_file, encoding="utf-8") as file:
+        input_tokens = file.read()
+    try:
+        output, instr_counter, result = profile(code, input_tokens, limit, info)
+    finally:
+        if isinstance(code, ObjectCode):
+            code.close()
+    print(output)
+    print("instr_counter: ", instr_counter, "ticks:", result.total_ticks())
+    print()
+    print(result.report(top))
+    if stacks:
+        with open(stacks, "w", encoding="utf-8") as file:
+            file.write("\n".join(result.collapsed_stacks()) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Source-level profiler")
+    parser.add_argument("code_file", help="machine code (JSON or object file), debug info is read from <code_file>.dbg")
+    parser.add_argument("input_file", help="input")
+    parser.add_argument("--limit", type=int, default=100000, help="instruction limit")
+    parser.add_argument("--top", type=int, default=10, help="hottest instructions to list")
+    parser.add_argument("--stacks", metavar="FILE", help="write collapsed stacks for flame graphs")
+    args = parser.parse_args()
+    main(args.code_file, args.input_file, args.limit, args.top, args.stacks)
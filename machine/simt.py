@@ -0,0 +1,544 @@
+from __future__ import annotations
+
+import operator
+from collections.abc import Callable, Sequence
+from typing import ClassVar
+
+try:
+    import numpy as np
+except ImportError:  # NumPy нужен только при исполнении пакета, см. `simulation_batch`
+    np = None
+
+from machine.blocks import branch_conditions
+from machine.emulator import Alu, block_ticks, branch_ticks, instruction_ticks, load_memory, simulation
+from machine.isa import Opcode, Register, Word, block_transfers, dr, fused_branches, pc, sp
+from machine.memory import ARG_INT, Memory
+
+# значения регистров держатся в int64 с запасом: результат за этой границей -- расхождение с Python int
+value_bound = 2**62
+
+max_char = 0x10FFFF
+
+
+def divide(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Частное как у `machine.emulator.divide`: с округлением к нулю, -1 при делении на 0."""
+    quotient = np.abs(a) // np.maximum(np.abs(b), 1)
+    return np.where(b == 0, -1, np.where((a < 0) == (b < 0), quotient, -quotient))
+
+
+def remainder(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.where(b == 0, a, a - b * divide(a, b))
+
+
+def reg_operand(arg) -> int | None:
+    """Номер регистра операнда; числа 0..15 модели процессора тоже понимают как номер регистра.
+
+    pc и dr пакетом не моделируются: инструкции с ними в аргументах не исполняются.
+    """
+    reg = arg.value if isinstance(arg, Register) else arg
+    if isinstance(reg, int) and 0 <= reg < 16 and reg not in (pc.value, dr.value):
+        return reg
+    return None
+
+
+class BatchMachine:
+    """Пакетная (SIMT) модель: одна программа на N входах, состояние всех экземпляров -- массивы NumPy.
+
+    На каждом шаге исполняется инструкция с наименьшим pc среди живых экземпляров для всех экземпляров
+    с этим pc, остальные ждут. Так разошедшиеся по условным переходам экземпляры снова сходятся.
+    Остановившиеся (`HALT`, лимит инструкций) выбывают.
+
+    Экземпляр, который делает то, что в массивах не повторить в точности -- запись в код, чтение ячейки
+    с регистром, выход значения за int64, инструкция с pc или dr в аргументах, -- тоже выбывает и потом
+    исполняется обычной `simulation`. Поэтому результат по каждому экземпляру совпадает с `simulation`.
+    """
+
+    conditions: ClassVar[dict[Opcode, Callable[[np.ndarray, np.ndarray], np.ndarray]]] = {
+        Opcode.JE: lambda neg, zero: zero,
+        Opcode.JNE: lambda neg, zero: ~zero,
+        Opcode.JG: lambda neg, zero: ~neg,
+        Opcode.JGE: lambda neg, zero: ~neg | zero,
+        Opcode.JL: lambda neg, zero: neg,
+        Opcode.JLE: lambda neg, zero: neg | zero,
+    }
+
+    binary_operations: ClassVar[dict[Opcode, Callable[[np.ndarray, np.ndarray], np.ndarray]]] = {
+        Opcode.ADD: operator.add,
+        Opcode.AND: operator.and_,
+        Opcode.OR: operator.or_,
+        Opcode.XOR: operator.xor,
+        Opcode.DIV: divide,
+        Opcode.MOD: remainder,
+    }
+
+    unary_operations: ClassVar[dict[Opcode, Callable[[np.ndarray], np.ndarray]]] = {
+        Opcode.INC: lambda a: a + 1,
+        Opcode.DEC: lambda a: a - 1,
+        Opcode.NEG: operator.invert,
+    }
+
+    def __init__(self, memory: Memory, inputs: Sequence[str], limit: int):
+        lanes = len(inputs)
+        self.size = len(memory)
+        self.limit = limit
+        self.memory = np.tile(np.frombuffer(memory.arg1, dtype=np.int64), (lanes, 1))
+        self.non_numeric = np.frombuffer(memory.tag1, dtype=np.uint8) != ARG_INT
+
+        self.regs = np.zeros((lanes, 16), dtype=np.int64)
+        self.regs[:, sp.value] = self.size - 1
+        self.neg = np.zeros(lanes, dtype=bool)
+        self.zero = np.zeros(lanes, dtype=bool)
+        self.done = self.size + 1  # pc выбывших экземпляров
+        self.pc = np.zeros(lanes, dtype=np.int64)
+        self.instr_counter = np.zeros(lanes, dtype=np.int64)
+        self.ticks = np.zeros(lanes, dtype=np.int64)
+        self.diverged = np.zeros(lanes, dtype=bool)
+
+        width = max((len(text) for text in inputs), default=0) + 1
+        self.input = np.zeros((lanes, width), dtype=np.int64)
+        for lane, text in enumerate(inputs):
+            self.input[lane, : len(text)] = np.frombuffer(text.encode("utf-32-le"), dtype="<u4")
+        self.input_position = np.zeros(lanes, dtype=np.int64)
+        self.output = np.zeros((lanes, 64), dtype=np.uint32)
+        self.output_length = np.zeros(lanes, dtype=np.int64)
+
+        self.handlers = {
+            Opcode.LD_ADDR: self._ld_addr,
+            Opcode.LD_LIT: self._ld_lit,
+            Opcode.LD: self._ld,
+            Opcode.LD_STACK: self._ld_stack,
+            Opcode.ST_ADDR: self._st_addr,
+            Opcode.ST: self._st,
+            Opcode.ST_STACK: self._st_stack,
+            Opcode.MV: self._mv,
+            Opcode.READ: self._read,
+            Opcode.PRINT: self._print,
+            Opcode.READ_BLOCK: self._read_block,
+            Opcode.PRINT_BLOCK: self._print_block,
+            Opcode.SHL: self._shl,
+            Opcode.SHR: self._shr,
+            Opcode.ADD_LIT: self._add_lit,
+            Opcode.CMP: self._cmp,
+            Opcode.CMP_LIT: self._cmp_lit,
+            Opcode.SUB: self._sub,
+            Opcode.MUL: self._mul,
+            Opcode.MUL_LIT: self._mul_lit,
+            Opcode.PUSH: self._push,
+            Opcode.POP: self._pop,
+            Opcode.JUMP: self._jump,
+            Opcode.CALL: self._call,
+            Opcode.RET: self._ret,
+            Opcode.HALT: self._halt,
+        }
+        self.handlers.update(dict.fromkeys(self.binary_operations, self._arythm))
+        self.handlers.update(dict.fromkeys(self.unary_operations, self._unary_arythm))
+        self.handlers.update(dict.fromkeys(self.conditions, self._branch))
+        self.handlers.update(dict.fromkeys(fused_branches, self._fused_branch))
+        self.code = np.zeros(self.size, dtype=bool)
+        self.decoded = self.decode_reachable(memory)
+
+    # декодирование
+
+    def decode_reachable(self, memory: Memory) -> list[tuple | None]:
+        """Декодировать инструкции, достижимые из адреса 0; None -- экземпляр здесь выбывает.
+
+        Переходы в системе команд прямые, кроме `RET`, а он возвращается за `CALL`, поэтому достижимый код
+        известен заранее.
+        Запись в него выводит экземпляр из пакета.
+        """
+        decoded: list[tuple | None] = [None] * (self.size + 1)
+        pending = [0]
+        while pending:
+            addr = pending.pop()
+            if addr >= self.size or self.code[addr]:
+                continue
+            self.code[addr] = True
+            entry = self.decode(memory[addr])
+            decoded[addr] = entry
+            if entry is not None:
+                pending.extend(self.successors(memory[addr]))
+        return decoded
+
+    def successors(self, word: Word) -> list[int]:
+        if word.opcode is Opcode.HALT or word.opcode is Opcode.RET:
+            return []
+        if word.opcode is Opcode.JUMP:
+            return [word.arg1]
+        if word.opcode in branch_conditions or word.opcode in fused_branches or word.opcode is Opcode.CALL:
+            return [word.arg1, word.index + 1]
+        return [word.index + 1]
+
+    def decode(self, word: Word) -> tuple | None:
+        operands = self.operands(word)
+        if operands is None:
+            return None
+        extra = None
+        ticks = instruction_ticks[word.opcode]
+        if word.opcode in self.conditions or word.opcode in fused_branches:
+            not_taken, taken = branch_ticks[word.opcode]
+            extra = (self.conditions[fused_branches.get(word.opcode, word.opcode)], taken - not_taken)
+            ticks = not_taken
+        if word.opcode in fused_branches:
+            extra = (*extra, *operands[2:])
+        elif word.opcode in block_transfers:
+            extra = block_ticks[word.opcode]
+        elif word.opcode in self.binary_operations:
+            extra = self.binary_operations[word.opcode]
+        elif word.opcode in self.unary_operations:
+            extra = self.unary_operations[word.opcode]
+        return self.handlers[word.opcode], *operands[:2], extra, ticks
+
+    def operands(self, word: Word) -> tuple | None:
+        """Операнды инструкции или None, если инструкция пакетом не исполняется."""
+        if word.opcode is Opcode.HALT or word.opcode is Opcode.RET:
+            return None, None
+        if word.opcode in (Opcode.JUMP, Opcode.CALL) or word.opcode in self.conditions:
+            return (word.arg1, None) if isinstance(word.arg1, int) and 0 <= word.arg1 < self.size else None
+        if word.opcode in fused_branches:
+            return self.fused_operands(word)
+        if word.opcode in block_transfers and word.arg3 != 0:
+            return None
+        reg = reg_operand(word.arg1)
+        if reg is None:
+            return None
+        return self.operand_kinds.get(word.opcode, BatchMachine._reg_pair)(self, word.opcode, reg, word.arg2)
+
+    def fused_operands(self, word: Word) -> tuple | None:
+        """Адрес перехода, регистр и второй операнд сравнения: (True, номер регистра) или (False, число)."""
+        if not isinstance(word.arg1, int) or not 0 <= word.arg1 < self.size:
+            return None
+        reg = reg_operand(word.arg2) if isinstance(word.arg2, Register) else None
+        if isinstance(word.arg3, Register):
+            operand = reg_operand(word.arg3)
+            return None if reg is None or operand is None else (word.arg1, reg, True, operand)
+        return None if reg is None else (word.arg1, reg, False, word.arg3)
+
+    def _reg_pair(self, opcode: Opcode, reg: int, arg) -> tuple | None:
+        return None if reg_operand(arg) is None else (reg, reg_operand(arg))
+
+    def _reg_only(self, opcode: Opcode, reg: int, arg) -> tuple | None:
+        return reg, None
+
+    def _reg_literal(self, opcode: Opcode, reg: int, arg) -> tuple | None:
+        return (reg, arg) if isinstance(arg, int) else None
+
+    def _reg_port(self, opcode: Opcode, reg: int, arg) -> tuple | None:
+        return (reg, None) if arg == 0 else None
+
+    def _reg_cell(self, opcode: Opcode, reg: int, arg) -> tuple | None:
+        """Адрес в инструкции должен быть в памяти, а для чтения -- ещё и указывать на число."""
+        if not isinstance(arg, int):
+            return None
+        addr = arg if opcode in (Opcode.LD_ADDR, Opcode.ST_ADDR) else self.size - arg - 1
+        if not -self.size <= addr < self.size:
+            return None
+        addr %= self.size
+        if opcode in (Opcode.LD_ADDR, Opcode.LD_STACK) and self.non_numeric[addr]:
+            return None
+        return reg, addr
+
+    operand_kinds: ClassVar[dict[Opcode, Callable]] = {
+        Opcode.LD_LIT: _reg_literal,
+        Opcode.ADD_LIT: _reg_literal,
+        Opcode.MUL_LIT: _reg_literal,
+        Opcode.CMP_LIT: _reg_literal,
+        Opcode.READ: _reg_port,
+        Opcode.PRINT: _reg_port,
+        Opcode.LD_ADDR: _reg_cell,
+        Opcode.ST_ADDR: _reg_cell,
+        Opcode.LD_STACK: _reg_cell,
+        Opcode.ST_STACK: _reg_cell,
+        Opcode.INC: _reg_only,
+        Opcode.DEC: _reg_only,
+        Opcode.NEG: _reg_only,
+        Opcode.PUSH: _reg_only,
+        Opcode.POP: _reg_only,
+    }
+
+    # исполнение
+
+    def run(self) -> None:
+        pc = self.pc
+        decoded = self.decoded
+        while True:
+            addr = int(pc.min())
+            if addr >= self.done:
+                return
+            lanes = np.flatnonzero(pc == addr)
+            entry = decoded[addr]
+            if entry is None:
+                self.diverge(lanes)
+                continue
+            handler, arg1, arg2, extra, ticks = entry
+            pc[lanes] = addr + 1
+            self.ticks[lanes] += ticks
+            self.instr_counter[lanes] += 1
+            handler(lanes, addr, arg1, arg2, extra)
+            finished = lanes[self.instr_counter[lanes] >= self.limit]
+            pc[finished] = self.done
+
+    def diverge(self, lanes: np.ndarray) -> None:
+        self.diverged[lanes] = True
+        self.pc[lanes] = self.done
+
+    def source(self, lanes: np.ndarray, reg: int) -> np.ndarray:
+        return self.regs[lanes, reg]
+
+    def set_flags(self, lanes: np.ndarray, values: np.ndarray) -> None:
+        values = np.where(values > Alu.max_value, values & Alu.min_value, values)
+        values = np.where(values < Alu.min_value, values & Alu.min_value, values)
+        self.neg[lanes] = values < 0
+        self.zero[lanes] = values == 0
+
+    def check_bound(self, lanes: np.ndarray, values: np.ndarray) -> None:
+        self.diverge(lanes[np.abs(values) >= value_bound])
+
+    def in_memory(self, addrs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Маска допустимых адресов (отрицательные -- с конца памяти) и адреса, приведённые к 0..size-1."""
+        return (addrs >= -self.size) & (addrs < self.size), addrs % self.size
+
+    def read(self, lanes: np.ndarray, addrs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Прочитать ячейки, вернуть оставшиеся в пакете экземпляры и значения."""
+        valid, addrs = self.in_memory(addrs)
+        valid &= ~self.non_numeric[addrs]
+        self.diverge(lanes[~valid])
+        lanes = lanes[valid]
+        return lanes, self.memory[lanes, addrs[valid]]
+
+    def write(self, lanes: np.ndarray, addrs: np.ndarray, values: np.ndarray) -> None:
+        valid, addrs = self.in_memory(addrs)
+        valid &= ~self.code[addrs]
+        self.diverge(lanes[~valid])
+        self.memory[lanes[valid], addrs[valid]] = values[valid]
+
+    def _halt(self, lanes, addr, arg1, arg2, extra):
+        self.instr_counter[lanes] -= 1
+        self.pc[lanes] = self.done
+
+    def _jump(self, lanes, addr, target, arg2, extra):
+        self.pc[lanes] = target
+
+    def _call(self, lanes, addr, target, arg2, extra):
+        self.pc[lanes] = target  # до записи: выбывшие при записи экземпляры остаются выбывшими
+        stack = self.regs[lanes, sp.value]
+        self.write(lanes, stack, np.full(len(lanes), addr + 1))
+        self.regs[lanes, sp.value] = stack - 1
+        self.set_flags(lanes, stack - 1)
+
+    def _ret(self, lanes, addr, arg1, arg2, extra):
+        stack = self.regs[lanes, sp.value] + 1
+        self.regs[lanes, sp.value] = stack
+        self.set_flags(lanes, stack)
+        lanes, targets = self.read(lanes, stack)
+        valid = (targets >= 0) & (targets < self.size)
+        self.diverge(lanes[~valid])
+        self.pc[lanes[valid]] = targets[valid]
+
+    def _branch(self, lanes, addr, target, arg2, extra):
+        condition, taken_ticks = extra
+        taken = lanes[condition(self.neg[lanes], self.zero[lanes])]
+        self.pc[taken] = target
+        self.ticks[taken] += taken_ticks
+
+    def _fused_branch(self, lanes, addr, target, reg, extra):
+        condition, taken_ticks, register, operand = extra
+        self.set_flags(lanes, self.source(lanes, reg) - (self.source(lanes, operand) if register else operand))
+        taken = lanes[condition(self.neg[lanes], self.zero[lanes])]
+        self.pc[taken] = target
+        self.ticks[taken] += taken_ticks
+
+    def _ld_addr(self, lanes, addr, reg, cell, extra):
+        self.regs[lanes, reg] = self.memory[lanes, cell]
+
+    def _ld_lit(self, lanes, addr, reg, value, extra):
+        self.regs[lanes, reg] = value
+
+    def _ld(self, lanes, addr, reg_to, addr_reg, extra):
+        addrs = self.source(lanes, addr_reg)
+        self.set_flags(lanes, addrs)
+        lanes, values = self.read(lanes, addrs)
+        self.regs[lanes, reg_to] = values
+
+    def _ld_stack(self, lanes, addr, reg_to, cell, extra):
+        self.regs[lanes, reg_to] = self.memory[lanes, cell]
+
+    def _st_addr(self, lanes, addr, reg, cell, extra):
+        values = self.source(lanes, reg)
+        self.set_flags(lanes, values)
+        self.write(lanes, np.full(len(lanes), cell), values)
+
+    _st_stack = _st_addr
+
+    def _st(self, lanes, addr, data_reg, addr_reg, extra):
+        values = self.source(lanes, data_reg)
+        addrs = self.source(lanes, addr_reg)
+        self.set_flags(lanes, addrs)
+        self.write(lanes, addrs, values)
+
+    def _mv(self, lanes, addr, reg_from, reg_to, extra):
+        values = self.source(lanes, reg_from)
+        self.set_flags(lanes, values)
+        self.regs[lanes, reg_to] = values
+
+    def _read(self, lanes, addr, reg, port, extra):
+        position = self.input_position[lanes]
+        self.regs[lanes, reg] = self.input[lanes, position]
+        self.input_position[lanes] = np.minimum(position + 1, self.input.shape[1] - 1)
+
+    def _print(self, lanes, addr, reg, port, extra):
+        values = self.source(lanes, reg)
+        self.set_flags(lanes, values)
+        printable = (values >= 0) & (values <= max_char)
+        self.diverge(lanes[~printable])
+        lanes, values = lanes[printable], values[printable]
+        if len(lanes) and self.output_length[lanes].max() >= self.output.shape[1]:
+            self.output = np.concatenate([self.output, np.zeros_like(self.output)], axis=1)
+        self.output[lanes, self.output_length[lanes]] = values
+        self.output_length[lanes] += 1
+
+    def _read_block(self, lanes, addr, addr_reg, limit_reg, word_ticks):
+        width = self.input.shape[1]
+        for lane in lanes:
+            position, start = self.input_position[lane], self.regs[lane, addr_reg]
+            chars = self.input[lane, position : position + max(self.regs[lane, limit_reg], 0)]
+            ends = np.flatnonzero(chars == 0)
+            count = int(ends[0]) if len(ends) else len(chars)
+            if not 0 <= start <= self.size - count or self.code[start : start + count].any():
+                self.diverge(np.array([lane]))
+                continue
+            self.memory[lane, start : start + count] = chars[:count]
+            self.input_position[lane] = min(position + count + bool(len(ends)), width - 1)
+            self.regs[lane, addr_reg] = start + count
+            self.ticks[lane] += word_ticks * count
+
+    def _print_block(self, lanes, addr, addr_reg, count_reg, word_ticks):
+        for lane in lanes:
+            start, count = self.regs[lane, addr_reg], max(self.regs[lane, count_reg], 0)
+            values = self.memory[lane, start : start + count]
+            if not 0 <= start <= self.size - count or self.non_numeric[start : start + count].any():
+                self.diverge(np.array([lane]))
+                continue
+            if ((values < 0) | (values > max_char)).any():
+                self.diverge(np.array([lane]))
+                continue
+            length = self.output_length[lane]
+            while length + count > self.output.shape[1]:
+                self.output = np.concatenate([self.output, np.zeros_like(self.output)], axis=1)
+            self.output[lane, length : length + count] = values
+            self.output_length[lane] += count
+            self.regs[lane, addr_reg] = start + count
+            self.ticks[lane] += word_ticks * count
+
+    def _arythm(self, lanes, addr, reg1, reg2, operation):
+        values = operation(self.source(lanes, reg1), self.source(lanes, reg2))
+        self.set_flags(lanes, values)
+        self.check_bound(lanes, values)
+        self.regs[lanes, reg1] = values
+
+    def _shl(self, lanes, addr, reg1, reg2, extra):
+        values, shifts = self.source(lanes, reg1), self.source(lanes, reg2)
+        clipped = np.clip(shifts, 0, 62)
+        result = values << clipped
+        exact = (values == 0) | ((shifts == clipped) & ((result >> clipped) == values))
+        self.diverge(lanes[(shifts < 0) | ~exact])
+        self.set_flags(lanes, result)
+        self.check_bound(lanes, result)
+        self.regs[lanes, reg1] = result
+
+    def _shr(self, lanes, addr, reg1, reg2, extra):
+        values, shifts = self.source(lanes, reg1), self.source(lanes, reg2)
+        self.diverge(lanes[shifts < 0])
+        result = values >> np.clip(shifts, 0, 63)
+        self.set_flags(lanes, result)
+        self.regs[lanes, reg1] = result
+
+    def _unary_arythm(self, lanes, addr, reg, arg2, operation):
+        values = operation(self.source(lanes, reg))
+        self.set_flags(lanes, values)
+        self.check_bound(lanes, values)
+        self.regs[lanes, reg] = values
+
+    def _add_lit(self, lanes, addr, reg, value, extra):
+        values = self.source(lanes, reg) + value
+        self.set_flags(lanes, values)
+        self.check_bound(lanes, values)
+        self.regs[lanes, reg] = values
+
+    def _cmp(self, lanes, addr, reg1, reg2, extra):
+        self.set_flags(lanes, self.source(lanes, reg1) - self.source(lanes, reg2))
+
+    def _cmp_lit(self, lanes, addr, reg, value, extra):
+        self.set_flags(lanes, self.source(lanes, reg) - value)
+
+    def _sub(self, lanes, addr, reg1, reg2, extra):
+        values = self.source(lanes, reg1) - self.source(lanes, reg2)
+        self.set_flags(lanes, values)
+        self.check_bound(lanes, values)
+        self.regs[lanes, reg1] = values
+
+    def _mul(self, lanes, addr, reg1, reg2, extra):
+        self.multiply(lanes, reg1, self.source(lanes, reg2))
+
+    def _mul_lit(self, lanes, addr, reg, value, extra):
+        self.multiply(lanes, reg, np.full(len(lanes), value))
+
+    def multiply(self, lanes: np.ndarray, reg: int, factors: np.ndarray) -> None:
+        # множители до 2**31 -- произведение точно в int64
+        values = self.source(lanes, reg)
+        self.diverge(lanes[(np.abs(values) >= 2**31) | (np.abs(factors) >= 2**31)])
+        values = values * factors
+        self.set_flags(lanes, values)
+        self.check_bound(lanes, values)
+        self.regs[lanes, reg] = values
+
+    def _push(self, lanes, addr, reg, arg2, extra):
+        values = self.source(lanes, reg)
+        stack = self.regs[lanes, sp.value]
+        self.write(lanes, stack, values)
+        self.regs[lanes, sp.value] = stack - 1
+        self.set_flags(lanes, stack - 1)
+
+    def _pop(self, lanes, addr, reg, arg2, extra):
+        stack = self.regs[lanes, sp.value] + 1
+        self.regs[lanes, sp.value] = stack
+        self.set_flags(lanes, stack)
+        lanes, values = self.read(lanes, stack)
+        self.regs[lanes, reg] = values
+
+    # результат
+
+    def lane_output(self, lane: int) -> str:
+        chars = self.output[lane, : self.output_length[lane]].astype("<u4")
+        return chars.tobytes().decode("utf-32-le", "surrogatepass")
+
+    def results(self) -> list[tuple[str, int, int] | None]:
+        """(вывод, instr_counter, такты) по экземплярам; None -- экземпляр выбыл из пакета."""
+        return [
+            None
+            if self.diverged[lane]
+            else (self.lane_output(lane), int(self.instr_counter[lane]), int(self.ticks[lane]))
+            for lane in range(len(self.pc))
+        ]
+
+
+def simulation_batch(
+    code: Sequence[Word] | Memory,
+    inputs: Sequence[str],
+    limit: int,
+    mem_size: int = 4096,
+    batch_size: int = 1024,
+) -> list[tuple[str, int, int]]:
+    """Исполнить программу на каждом входе, вернуть по входу то же, что `simulation`: вывод, instr_counter, такты.
+
+    Входы исполняются пакетами по batch_size экземпляров, память пакета -- batch_size * mem_size * 8 байт.
+    """
+    assert np is not None, "Batch simulation needs NumPy: pip install numpy"
+    memory = load_memory(code, mem_size)
+    results: list[tuple[str, int, int]] = []
+    for start in range(0, len(inputs), batch_size):
+        chunk = inputs[start : start + batch_size]
+        machine = BatchMachine(memory, chunk, limit)
+        machine.run()
+        for text, result in zip(chunk, machine.results()):
+            results.append(result or simulation(memory.copy(), text, limit, mode="fast"))
+    return results
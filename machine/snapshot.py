@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import json
+import struct
+import sys
+import zlib
+
+from machine.isa import EnumEncoder, Register, convert_to_register
+from machine.memory import Memory, MemorySnapshot, columns, page_bits
+
+# Файл снимка: заголовок (MAGIC, версия, длина JSON), JSON с регистрами, флагами, счётчиками и портами,
+# затем сжатые zlib страницы памяти -- колонки страницы подряд, в порядке `columns`, с шириной колонок `Memory`.
+# Числа памяти вне int64 (`Memory.wide`) -- в JSON, парами [номер, число].
+
+MAGIC = b"VJSS"
+
+VERSION = 4  # 2 -- колонки arg3 и tag3 в памяти; 3 -- аргументы в памяти int64; 4 -- числа вне int64
+
+header = struct.Struct("<4sHI")
+
+
+class MachineSnapshot:
+    """Состояние машины: регистры, флаги АЛУ, такты, число инструкций, позиции портов ввода,
+    вывод до снимка и память (`MemorySnapshot`)."""
+
+    registers: list[int | Register | None]
+    neg: bool
+    zero: bool
+    tick: int
+    instr_counter: int
+    input_positions: dict[int, int]
+    outputs: dict[int, str]
+    memory: MemorySnapshot
+
+    def __init__(
+        self,
+        registers: list[int | Register | None],
+        flags: tuple[bool, bool],
+        input_positions: dict[int, int],
+        outputs: dict[int, str],
+        memory: MemorySnapshot,
+        tick: int = 0,
+        instr_counter: int = 0,
+    ):
+        self.registers = registers
+        self.neg, self.zero = flags
+        self.input_positions = input_positions
+        self.outputs = outputs
+        self.memory = memory
+        self.tick = tick
+        self.instr_counter = instr_counter
+
+    def save(self, filename: str) -> None:
+        state = json.dumps(
+            {
+                "registers": self.registers,
+                "flags": [self.neg, self.zero],
+                "tick": self.tick,
+                "instr_counter": self.instr_counter,
+                "inputs": self.input_positions,
+                "outputs": self.outputs,
+                "mem_size": self.memory.size,
+                "wide": list(self.memory.wide.items()),
+                "page_bits": page_bits,
+                "byteorder": sys.byteorder,
+            },
+            cls=EnumEncoder,
+        ).encode("utf-8")
+        pages = zlib.compress(b"".join(b"".join(page) for page in self.memory.pages))
+        with open(filename, "wb") as file:
+            file.write(header.pack(MAGIC, VERSION, len(state)))
+            file.write(state)
+            file.write(pages)
+
+    @classmethod
+    def load(cls, filename: str) -> MachineSnapshot:
+        with open(filename, "rb") as file:
+            data = file.read()
+        magic, version, state_size = header.unpack_from(data)
+        assert magic == MAGIC, "Not a snapshot file: {}".format(filename)
+        assert version == VERSION, "Unsupported snapshot version: {}".format(version)
+        state = json.loads(data[header.size : header.size + state_size])
+        assert state["page_bits"] == page_bits, "Snapshot page size differs: {}".format(state["page_bits"])
+        assert state["byteorder"] == sys.byteorder, "Snapshot byte order differs: {}".format(state["byteorder"])
+        return cls(
+            [convert_to_register(value) for value in state["registers"]],
+            tuple(state["flags"]),
+            {int(port): position for port, position in state["inputs"].items()},
+            {int(port): text for port, text in state["outputs"].items()},
+            split_pages(zlib.decompress(data[header.size + state_size :]), state["mem_size"], dict(state["wide"])),
+            state["tick"],
+            state["instr_counter"],
+        )
+
+
+def split_pages(data: bytes, size: int, wide: dict[int, int]) -> MemorySnapshot:
+    """Разрезать байты страниц на колонки по размерам элементов колонок `Memory`."""
+    itemsizes = [getattr(Memory(1), column).itemsize for column in columns]
+    pages = []
+    offset = 0
+    for start in range(0, size, 1 << page_bits):
+        words = min(1 << page_bits, size - start)
+        page = []
+        for itemsize in itemsizes:
+            page.append(data[offset : offset + words * itemsize])
+            offset += words * itemsize
+        pages.append(tuple(page))
+    return MemorySnapshot(size, pages, wide)